@@ -0,0 +1,210 @@
+"""
+Chart-sized aggregates over the normalized song columns
+
+Histograms are computed with one vectorized binning pass, and scatter plots
+are reduced to at most a fixed number of points, either by Largest Triangle
+Three Buckets (LTTB) downsampling or by counting rows per grid cell. Either
+way a chart payload stays a few KB whatever the catalog size.
+
+Results are cached per request shape. Entries that read star_rating are
+keyed by the ratings version of the snapshot they were computed from and
+recomputed after ratings change; with track_ratings=False (shared mode,
+where other processes write the rating column) they are not cached.
+"""
+from collections import OrderedDict
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from compact import widen
+from data_engine import DataSnapshot
+
+SCATTER_METHODS = ('lttb', 'grid')
+MAX_HISTOGRAM_EDGES = 1001
+_MAX_CACHED_RESULTS = 64
+_GRID_DECIMALS = 6
+
+def _lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Positions of the points LTTB keeps from a series sorted by x"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # threshold - 2 buckets over the inner points; the first and last points are always kept
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x = x[end:edges[bucket + 2]].mean()
+            next_y = y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+
+        # Keep the point forming the largest triangle with the previous pick and the next bucket's mean
+        px, py = x[previous], y[previous]
+        areas = np.abs((px - next_x) * (y[start:end] - py) - (px - x[start:end]) * (next_y - py))
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+class ColumnAggregates:
+    """Cached histograms and reduced scatter plots over the published dataset snapshots"""
+
+    def __init__(self, snapshot: Callable[[], DataSnapshot], track_ratings: bool = True):
+        self._snapshot = snapshot
+        self._track_ratings = track_ratings
+        self._results: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self.numeric_columns = [name for name, values in snapshot().columns.items() if values.dtype.kind in 'iufb']
+
+    def _check_column(self, name: str):
+        if name not in self.numeric_columns:
+            raise ValueError(f"Cannot aggregate '{name}'; choose one of {self.numeric_columns}")
+
+    def _cached(self, key: tuple, names: Sequence[str], compute: Callable[[Dict[str, np.ndarray]], Any],
+                snapshot: Optional[DataSnapshot] = None) -> Any:
+        """Return the cached result for key, computing it from snapshot (default: the current one) if missing or stale"""
+        snapshot = snapshot or self._snapshot()
+        if 'star_rating' in names and not self._track_ratings:
+            return compute(snapshot.columns)
+        version = snapshot.ratings_version if 'star_rating' in names else 0
+        cached = self._results.get(key)
+        if cached is not None and cached[0] == version:
+            try:
+                self._results.move_to_end(key)
+            except KeyError:
+                pass  # Evicted by a concurrent caller; the result is still valid
+            return cached[1]
+
+        result = compute(snapshot.columns)
+        self._results[key] = (version, result)
+        while len(self._results) > _MAX_CACHED_RESULTS:
+            try:
+                self._results.popitem(last=False)
+            except KeyError:
+                break
+        return result
+
+    def histogram(self, column: str, edges: Optional[List[float]] = None, bins: int = 10,
+                  snapshot: Optional[DataSnapshot] = None) -> Dict[str, Any]:
+        """Count rows per bin of a numeric column
+
+        With explicit edges, bins are half-open [edges[i], edges[i + 1]) and
+        values outside them are reported as underflow or overflow. Otherwise
+        the column's range is split into equal-width bins, the last one closed.
+        Missing values are counted separately. Reads the current snapshot
+        unless one is given.
+        """
+        self._check_column(column)
+        if edges is not None:
+            edges = [float(edge) for edge in edges]
+            if not 2 <= len(edges) <= MAX_HISTOGRAM_EDGES:
+                raise ValueError(f"Histogram needs between 2 and {MAX_HISTOGRAM_EDGES} edges")
+            if not np.all(np.isfinite(edges)) or np.any(np.diff(edges) <= 0):
+                raise ValueError("Histogram edges must be finite and strictly increasing")
+        elif not 1 <= bins <= MAX_HISTOGRAM_EDGES - 1:
+            raise ValueError(f"Histogram needs between 1 and {MAX_HISTOGRAM_EDGES - 1} bins")
+
+        key = ('histogram', column, None if edges is None else tuple(edges), None if edges else bins)
+        return self._cached(key, (column,), lambda columns: self._histogram(columns, column, edges, bins), snapshot)
+
+    def _histogram(self, columns: Dict[str, np.ndarray], column: str, edges: Optional[List[float]],
+                   bins: int) -> Dict[str, Any]:
+        values = widen(columns[column])
+        if values.dtype.kind == 'f':
+            present = ~np.isnan(values)
+            missing = len(values) - int(np.count_nonzero(present))
+            if missing:
+                values = values[present]
+        else:
+            missing = 0
+
+        if edges is None:
+            low, high = (float(values.min()), float(values.max())) if len(values) else (0.0, 1.0)
+            if low == high:
+                high = low + 1.0
+            edge_array = np.linspace(low, high, bins + 1)
+            # Equal-width bins close the last one so the maximum is counted
+            slots = np.clip(np.searchsorted(edge_array, values, side='right'), 1, bins)
+            counts = np.bincount(slots - 1, minlength=bins)
+            underflow = overflow = 0
+        else:
+            edge_array = np.asarray(edges, dtype=np.float64)
+            # Slot 0 is below the first edge and slot len(edges) is at or above the last one
+            slots = np.searchsorted(edge_array, values, side='right')
+            all_counts = np.bincount(slots, minlength=len(edge_array) + 1)
+            underflow, overflow = int(all_counts[0]), int(all_counts[-1])
+            counts = all_counts[1:-1]
+
+        return {
+            'column': column,
+            'edges': edge_array.tolist(),
+            'counts': counts.tolist(),
+            'underflow': underflow,
+            'overflow': overflow,
+            'missing': missing,
+            'total': len(columns[column]),
+        }
+
+    def scatter(self, x: str, y: str, max_points: int = 200, method: str = 'lttb',
+                snapshot: Optional[DataSnapshot] = None) -> Dict[str, Any]:
+        """Reduce the (x, y) scatter of two numeric columns to at most max_points points
+
+        'lttb' keeps the visually significant points of y as a series ordered
+        by x. 'grid' counts rows per cell of an equal-width grid over both
+        ranges and returns one point per non-empty cell at its centre. Reads
+        the current snapshot unless one is given.
+        """
+        self._check_column(x)
+        self._check_column(y)
+        if method not in SCATTER_METHODS:
+            raise ValueError(f"Unknown scatter method '{method}', expected one of {SCATTER_METHODS}")
+        if max_points < 3:
+            raise ValueError("max_points must be at least 3")
+
+        key = ('scatter', x, y, max_points, method)
+        return self._cached(key, (x, y), lambda columns: self._scatter(columns, x, y, max_points, method), snapshot)
+
+    def _scatter(self, columns: Dict[str, np.ndarray], x: str, y: str, max_points: int,
+                 method: str) -> Dict[str, Any]:
+        x_values = widen(columns[x]).astype(np.float64, copy=False)
+        y_values = widen(columns[y]).astype(np.float64, copy=False)
+        present = np.isfinite(x_values) & np.isfinite(y_values)
+        if not present.all():
+            x_values, y_values = x_values[present], y_values[present]
+        result = {'x': x, 'y': y, 'method': method, 'total': len(x_values)}
+
+        if method == 'lttb':
+            order = np.argsort(x_values, kind='stable')
+            x_sorted, y_sorted = x_values[order], y_values[order]
+            kept = _lttb(x_sorted, y_sorted, max_points)
+            result['points'] = {'x': x_sorted[kept].tolist(), 'y': y_sorted[kept].tolist()}
+            return result
+
+        # A square grid with at most max_points cells
+        cells = max(int(np.sqrt(max_points)), 1)
+        x_edges = self._grid_edges(x_values, cells)
+        y_edges = self._grid_edges(y_values, cells)
+        x_slots = np.clip(np.searchsorted(x_edges, x_values, side='right') - 1, 0, cells - 1)
+        y_slots = np.clip(np.searchsorted(y_edges, y_values, side='right') - 1, 0, cells - 1)
+        counts = np.bincount(x_slots * cells + y_slots, minlength=cells * cells)
+        occupied = np.flatnonzero(counts)
+
+        x_centres = (x_edges[:-1] + x_edges[1:]) / 2
+        y_centres = (y_edges[:-1] + y_edges[1:]) / 2
+        result['x_edges'] = np.round(x_edges, _GRID_DECIMALS).tolist()
+        result['y_edges'] = np.round(y_edges, _GRID_DECIMALS).tolist()
+        result['points'] = {
+            'x': np.round(x_centres[occupied // cells], _GRID_DECIMALS).tolist(),
+            'y': np.round(y_centres[occupied % cells], _GRID_DECIMALS).tolist(),
+            'count': counts[occupied].tolist(),
+        }
+        return result
+
+    @staticmethod
+    def _grid_edges(values: np.ndarray, cells: int) -> np.ndarray:
+        low, high = (float(values.min()), float(values.max())) if len(values) else (0.0, 1.0)
+        if low == high:
+            high = low + 1.0
+        return np.linspace(low, high, cells + 1)
@@ -0,0 +1,171 @@
+"""
+Cached summary statistics over the normalized song columns
+
+Each column's statistics come from one pass: a single multi-quantile
+partition for min, percentiles, median and max, plus mean and standard
+deviation. The dashboard's default columns are summarized at load time and
+any other numeric column on first request; the results are then served from
+the cache.
+
+Columns never change after loading except star_rating. Its distribution is
+kept as a count per rating value, which rating writes adjust incrementally,
+so its statistics are derived from a handful of counts instead of a rescan.
+Rating writes replace the counts array rather than changing it, so a reader
+always summarizes one consistent distribution without locking.
+"""
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence
+from compact import widen
+
+# Columns summarized by /api/stats when no selection is given
+DEFAULT_STAT_COLUMNS = ['danceability', 'energy', 'acousticness', 'tempo', 'duration_s', 'valence', 'star_rating']
+PERCENTILES = (5, 25, 75, 95)
+MAX_RATING = 5
+
+def _summarize(values: np.ndarray) -> Dict[str, Any]:
+    """Summary statistics of one numeric column, ignoring missing values"""
+    missing = 0
+    values = widen(values)
+    if values.dtype.kind == 'b':
+        values = values.astype(np.int8)
+    elif values.dtype.kind == 'f':
+        present = ~np.isnan(values)
+        missing = len(values) - int(np.count_nonzero(present))
+        if missing:
+            values = values[present]
+
+    summary = {'count': len(values), 'missing': missing}
+    if not len(values):
+        return {**summary, 'min': None, 'max': None, 'mean': None, 'median': None, 'std': None,
+                **{f'p{q}': None for q in PERCENTILES}}
+
+    quantiles = np.percentile(values, [0, 50, 100, *PERCENTILES]).tolist()
+    summary.update({
+        'min': quantiles[0],
+        'max': quantiles[2],
+        'mean': float(values.mean()),
+        'median': quantiles[1],
+        'std': float(values.std()),
+    })
+    summary.update({f'p{q}': value for q, value in zip(PERCENTILES, quantiles[3:])})
+    return summary
+
+def _summarize_counts(counts: np.ndarray) -> Dict[str, Any]:
+    """Summary statistics of an integer column given the number of rows holding each value"""
+    total = int(counts.sum())
+    if not total:
+        return _summarize(np.empty(0))
+
+    values = np.arange(len(counts), dtype=np.float64)
+    present = np.flatnonzero(counts)
+    mean = float((values * counts).sum() / total)
+    cumulative = np.cumsum(counts)
+
+    def percentile(q: float) -> float:
+        # Linear interpolation between order statistics, as np.percentile does
+        rank = (total - 1) * q / 100
+        below, fraction = int(np.floor(rank)), rank - np.floor(rank)
+        low = float(np.searchsorted(cumulative, below, side='right'))
+        high = float(np.searchsorted(cumulative, min(below + 1, total - 1), side='right'))
+        return low + (high - low) * fraction
+
+    summary = {
+        'count': total,
+        'missing': 0,
+        'min': float(present[0]),
+        'max': float(present[-1]),
+        'mean': mean,
+        'median': percentile(50),
+        'std': float(np.sqrt(((values - mean) ** 2 * counts).sum() / total)),
+    }
+    summary.update({f'p{q}': percentile(q) for q in PERCENTILES})
+    rated = total - int(counts[0])
+    summary['rated'] = rated
+    summary['rated_mean'] = float((values[1:] * counts[1:]).sum() / rated) if rated else None
+    return summary
+
+def merge_summaries(summaries: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """The summary of a column split across datasets, combined from each part's summary
+
+    Counts, extremes, mean and standard deviation combine exactly; the median
+    and percentiles need the values themselves, so they are left out.
+    """
+    count = sum(summary['count'] for summary in summaries)
+    merged = {'count': count, 'missing': sum(summary['missing'] for summary in summaries)}
+    present = [summary for summary in summaries if summary['count']]
+    if not present:
+        return {**merged, 'min': None, 'max': None, 'mean': None, 'std': None}
+
+    mean = sum(summary['mean'] * summary['count'] for summary in present) / count
+    # Each part's squared deviations from the overall mean: its own variance plus its mean's offset
+    squares = sum(summary['count'] * (summary['std'] ** 2 + (summary['mean'] - mean) ** 2) for summary in present)
+    merged.update({
+        'min': min(summary['min'] for summary in present),
+        'max': max(summary['max'] for summary in present),
+        'mean': mean,
+        'std': float(np.sqrt(squares / count)),
+    })
+    return merged
+
+class ColumnStats:
+    """Per-column summary statistics, computed once and kept current as ratings change
+
+    With track_ratings=False (shared mode, where other processes also write
+    the rating column) the rating distribution is recounted on each request.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], track_ratings: bool = True):
+        self.columns = columns
+        self.numeric_columns = [name for name, values in columns.items()
+                                if values.dtype.kind in 'iufb' and name != 'index']
+        self._track_ratings = track_ratings
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._rating_counts = None
+        self._rating_summary = None
+
+        if 'star_rating' in columns and track_ratings:
+            self._rating_counts = self._count_ratings()
+        for name in DEFAULT_STAT_COLUMNS:
+            if name in self.numeric_columns and name != 'star_rating':
+                self._summaries[name] = _summarize(columns[name])
+
+    def _count_ratings(self) -> np.ndarray:
+        return np.bincount(self.columns['star_rating'], minlength=MAX_RATING + 1)
+
+    def ratings_changed(self, old: np.ndarray, new: np.ndarray):
+        """Move rows from their old rating counts to their new ones; called by the single writer"""
+        if self._rating_counts is None:
+            return
+        self._rating_counts = (self._rating_counts
+                               - np.bincount(np.asarray(old, dtype=np.int64).ravel(), minlength=MAX_RATING + 1)
+                               + np.bincount(np.asarray(new, dtype=np.int64).ravel(), minlength=MAX_RATING + 1))
+
+    def resolve(self, columns: Optional[Sequence[str]] = None) -> List[str]:
+        """Expand a column selection, accepting comma-separated names, and validate it"""
+        if not columns:
+            return [name for name in DEFAULT_STAT_COLUMNS if name in self.numeric_columns]
+        names = [name.strip() for entry in columns for name in entry.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.numeric_columns]
+        if unknown:
+            raise ValueError(f"No statistics for {unknown}; choose from {self.numeric_columns}")
+        return list(dict.fromkeys(names))
+
+    def summary(self, column: str) -> Dict[str, Any]:
+        """Summary statistics of one numeric column"""
+        if column == 'star_rating':
+            if not self._track_ratings:
+                return _summarize_counts(self._count_ratings())
+            counts = self._rating_counts
+            cached = self._rating_summary
+            if cached is None or cached[0] is not counts:
+                cached = self._rating_summary = (counts, _summarize_counts(counts))
+            return cached[1]
+
+        cached = self._summaries.get(column)
+        if cached is None:
+            cached = self._summaries[column] = _summarize(self.columns[column])
+        return cached
+
+    def statistics(self, columns: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Summaries of the selected columns, or of the dashboard's default columns"""
+        return {name: self.summary(name) for name in self.resolve(columns)}
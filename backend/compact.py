@@ -0,0 +1,150 @@
+"""
+Compact in-memory layout for the normalized song columns
+
+The standard layout keeps integers as int64, floats as float64 and text as
+numpy object arrays of Python strings, roughly 300 bytes per song. The
+compact layout stores the same data in far less:
+
+- integer columns use the smallest integer type that holds their range
+  (``key``, ``mode`` and ``time_signature`` fit in one byte);
+- the 0-1 audio features are float32 when every value survives the round
+  trip, which it does for the few significant digits the source carries;
+- text columns are Arrow strings (one UTF-8 buffer plus offsets) when the
+  optional pyarrow package is installed, instead of one Python object each;
+- ``duration_s`` is derived from ``duration_ms`` on access, not stored.
+
+Values read back out of the compact layout are the same as in the standard
+layout: float32 values are converted through their shortest decimal form,
+so a source value of 0.521 is reported as 0.521, not 0.5210000276565552.
+"""
+import sys
+import numpy as np
+from typing import Any, Dict, List
+
+try:
+    import pyarrow as pa
+except ImportError:  # Text columns stay Python strings without pyarrow
+    pa = None
+
+# The audio features that lie in [0, 1] and are stored as float32
+UNIT_FEATURES = ('danceability', 'energy', 'acousticness', 'instrumentalness', 'liveness', 'valence')
+_INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+
+def smallest_int_dtype(values: np.ndarray) -> np.dtype:
+    """The narrowest signed integer dtype holding every value"""
+    if not len(values):
+        return np.dtype(np.int8)
+    low, high = int(values.min()), int(values.max())
+    for dtype in _INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return values.dtype
+
+def is_arrow_strings(values) -> bool:
+    """Whether a column is a pandas Arrow string array
+
+    Such arrays only exist once pandas is imported, so this never imports it.
+    """
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(values.dtype, pandas.StringDtype)
+
+def is_text(values) -> bool:
+    """Whether a column holds text, as Python objects or Arrow strings"""
+    return values.dtype == object or is_arrow_strings(values)
+
+def compact_columns(columns: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    """Convert parsed columns to the compact layout"""
+    compacted = {}
+    for name, values in columns.items():
+        if values.dtype.kind in 'iu':
+            values = values.astype(smallest_int_dtype(values), copy=False)
+        elif name in UNIT_FEATURES and values.dtype == np.float64:
+            narrow = values.astype(np.float32)
+            if np.array_equal(widen(narrow), values, equal_nan=True):
+                values = narrow
+        elif values.dtype == object and pa is not None:
+            import pandas as pd
+            try:
+                values = pd.array(values, dtype='string[pyarrow]')
+            except (TypeError, ValueError, pa.ArrowException):
+                pass  # Not all strings; keep the objects
+        compacted[name] = values
+    return compacted
+
+class DerivedColumn:
+    """A float64 column computed from another one on access, storing nothing itself
+
+    Indexing computes only the selected rows; numpy functions that need the
+    whole column get it through ``__array__``.
+    """
+
+    def __init__(self, source: np.ndarray, divisor: float):
+        self.source = source
+        self.divisor = divisor
+        self.dtype = np.dtype(np.float64)
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    @property
+    def shape(self):
+        return (len(self.source),)
+
+    def __getitem__(self, positions):
+        return np.asarray(self.source[positions], dtype=np.float64) / self.divisor
+
+    def __array__(self, dtype=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def astype(self, dtype, copy: bool = True) -> np.ndarray:
+        return np.asarray(self, dtype=dtype)
+
+def _shortest_decimals(values: np.ndarray) -> np.ndarray:
+    """float32 values as the float64 of their shortest round-tripping decimal, like float(str(value))
+
+    Tries 1 to 9 significant digits, all rows at once. For up to 22 decimal
+    places, dividing the rounded integer by an exact power of ten yields the
+    correctly rounded float64 of the decimal.
+    """
+    wide = values.astype(np.float64)
+    restored = wide.copy()
+    pending = np.isfinite(wide) & (wide != 0)
+    exponent = np.floor(np.log10(np.abs(wide, where=pending, out=np.ones_like(wide))))
+    for digits in range(1, 10):
+        rows = np.flatnonzero(pending)
+        if not len(rows):
+            break
+        scale = 10.0 ** (digits - 1 - exponent[rows])
+        candidate = np.round(wide[rows] * scale) / scale
+        done = candidate.astype(np.float32) == values[rows]
+        restored[rows[done]] = candidate[done]
+        pending[rows[done]] = False
+    return restored
+
+def widen(values) -> np.ndarray:
+    """A numeric column as the standard layout holds it: float32 back to the float64 it came from
+
+    The shortest decimal that round-trips a float32 is the decimal it was
+    parsed from, so its float64 is the source value exactly.
+    """
+    if isinstance(values, DerivedColumn):
+        return np.asarray(values)
+    if values.dtype == np.float32:
+        return _shortest_decimals(values)
+    return values
+
+def to_python_list(values) -> List[Any]:
+    """Column values as Python objects, equal to what the standard layout would give"""
+    if is_arrow_strings(values):
+        return values.to_numpy(dtype=object, na_value=None).tolist()
+    return widen(values).tolist()
+
+def column_nbytes(values) -> int:
+    """Bytes a column holds, counting the Python objects of object columns"""
+    if isinstance(values, DerivedColumn):
+        return 0
+    if values.dtype == object:
+        return values.nbytes + sum(sys.getsizeof(value) for value in values)
+    return int(values.nbytes)
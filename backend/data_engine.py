@@ -0,0 +1,67 @@
+"""
+Versioned, copy-on-write storage for the normalized song columns
+
+The dataset is published as an immutable ``DataSnapshot``: a dict of column
+arrays plus the ratings version they reflect. Readers take the current
+snapshot once per request and read only from it, so they never lock and
+never see a half-applied write. A rating write copies the star_rating
+column, applies every change to the copy, and publishes a new snapshot with
+a single reference assignment; readers holding the old snapshot keep using
+it until they finish.
+
+Every other column is shared, unchanged, between snapshots, so a write
+costs one copy of the one-byte-per-song rating column: O(n) in the catalog
+size, about 0.1 ms per million songs. Pass every update that is ready in
+one call to pay for one copy; PlaylistDataProcessor queues concurrent
+writers so they do.
+
+With in_place_ratings (shared mode, where other processes map the same
+rating file), the rating column is written in place instead. Each song's
+rating is still written atomically, but a concurrent reader may see only
+part of a bulk update.
+"""
+import threading
+import numpy as np
+from typing import Dict, List, NamedTuple, Tuple
+
+class DataSnapshot(NamedTuple):
+    """One consistent state of the dataset; never mutated once published"""
+    columns: Dict[str, np.ndarray]
+    ratings_version: int
+
+class DataEngine:
+    """Publishes DataSnapshots: lock-free reads, serialized copy-on-write rating writes"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], ratings_version: int = 0, in_place_ratings: bool = False):
+        self.in_place_ratings = in_place_ratings
+        # Held by writers for the whole of a write, including any logging that must follow its order
+        self.write_lock = threading.RLock()
+        self._snapshot = DataSnapshot(columns, ratings_version)
+
+    def snapshot(self) -> DataSnapshot:
+        """The current snapshot; read everything for one request from the same one"""
+        return self._snapshot
+
+    def write_ratings(self, updates: List[Tuple[object, object]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Apply (positions, ratings) updates in order and publish the result
+
+        Returns the previous and new ratings at every updated position, for
+        keeping derived statistics in step.
+        """
+        with self.write_lock:
+            current = self._snapshot
+            ratings = current.columns['star_rating']
+            if not self.in_place_ratings:
+                ratings = ratings.copy()
+
+            previous, written = [], []
+            for positions, values in updates:
+                before = np.array(ratings[positions], copy=True, ndmin=1)
+                ratings[positions] = values
+                previous.append(before)
+                written.append(np.broadcast_to(np.asarray(values, dtype=ratings.dtype), before.shape))
+
+            self._snapshot = DataSnapshot({**current.columns, 'star_rating': ratings}, current.ratings_version + 1)
+            empty = np.empty(0, dtype=ratings.dtype)
+            return (np.concatenate(previous) if previous else empty,
+                    np.concatenate(written) if written else empty)
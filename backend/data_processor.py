@@ -1,48 +1,290 @@
-
+import itertools
 import json
-import pandas as pd
-from typing import Dict, Any, List
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
 import logging
+from aggregates import ColumnAggregates
+from data_engine import DataEngine, DataSnapshot
+from column_stats import ColumnStats
+from compact import DerivedColumn, column_nbytes, compact_columns, to_python_list
+from export import iter_export, select_columns
+from id_index import HashedIdIndex
+from json_stream import stream_columns
+from parallel_ingest import ingest_columns
+from rating_store import RatingStore
+from search_index import TitleIndex
+from similarity import SimilarityIndex
+from song_query import SongQuery
+from snapshot import content_hash, load_snapshot, open_shared_ratings, snapshot_lock, write_snapshot
+
+if TYPE_CHECKING:
+    import pandas as pd  # Imported on first use, so serving can start before pandas loads
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Column dtypes for the normalized dataset, mirroring the Song model in main.py.
+# Attributes not listed here keep whatever dtype numpy infers for them.
+SONG_SCHEMA = {
+    'index': np.int64,
+    'id': object,
+    'title': object,
+    'danceability': np.float64,
+    'energy': np.float64,
+    'key': np.int64,
+    'loudness': np.float64,
+    'mode': np.int64,
+    'acousticness': np.float64,
+    'instrumentalness': np.float64,
+    'liveness': np.float64,
+    'valence': np.float64,
+    'tempo': np.float64,
+    'duration_ms': np.int64,
+    'time_signature': np.int64,
+    'num_bars': np.int64,
+    'num_sections': np.int64,
+    'num_segments': np.int64,
+    'star_rating': np.int8,
+}
+
+def _row_keys(attribute_keys: List[List[str]]) -> Tuple[List[str], np.ndarray]:
+    """Collect the row keys shared by all attributes, ordered by their integer value"""
+    keys = attribute_keys[0] if attribute_keys else []
+    
+    # Every attribute normally carries the same keys in the same order; only
+    # fall back to a union when some attribute is missing rows.
+    if any(other != keys for other in attribute_keys[1:]):
+        union = set()
+        for other in attribute_keys:
+            union.update(other)
+        keys = list(union)
+    
+    positions = np.fromiter(map(int, keys), dtype=np.int64, count=len(keys))
+    if len(positions) and not np.array_equal(positions, np.arange(len(positions))):
+        order = np.argsort(positions, kind='stable')
+        keys = [keys[i] for i in order]
+        positions = positions[order]
+    
+    return keys, positions
+
+def _typed_column(attribute: str, values: List[Any], dtype) -> np.ndarray:
+    """Convert a list of raw JSON values into a typed numpy array"""
+    if dtype is None:
+        column = np.asarray(values)
+        return column.astype(object) if column.dtype.kind in 'US' else column
+    if dtype is object:
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+    try:
+        return np.array(values, dtype=dtype)
+    except TypeError:
+        # Missing integer values become NaN, which forces a float column
+        logger.warning(f"Column '{attribute}' has missing values, storing it as float64")
+        return np.array(values, dtype=np.float64)
+
+def build_columns(data: Dict[str, Dict[str, Any]]) -> Tuple[List[str], Dict[str, np.ndarray]]:
+    """Build one typed array per attribute from column-oriented playlist JSON
+    
+    Rows are ordered by their integer key. Keys may be non-contiguous, and an
+    attribute without a value for some row gets None (strings) or NaN (numbers).
+    """
+    attribute_keys = [list(values.keys()) for values in data.values()]
+    keys, positions = _row_keys(attribute_keys)
+    columns = {'index': positions}
+    
+    for (attribute, values), own_keys in zip(data.items(), attribute_keys):
+        if own_keys == keys:
+            raw = list(values.values())
+        else:
+            raw = [values.get(key) for key in keys]
+        columns[attribute] = _typed_column(attribute, raw, SONG_SCHEMA.get(attribute))
+    
+    return keys, columns
+
+def _convert_values(attribute: str, values: List[Any]) -> np.ndarray:
+    """Convert the raw values of one attribute to its column, typed by SONG_SCHEMA"""
+    return _typed_column(attribute, values, SONG_SCHEMA.get(attribute))
+
+# Numbers each load in this process, so caches can tell reloaded data apart
+_load_generations = itertools.count(1)
+
+# 'memory' parses the whole file with json.load; 'streaming' reads it in chunks
+# straight into typed column buffers, keeping peak memory near the final size;
+# 'parallel' parses attributes and shards in worker processes (see parallel_ingest).
+# A directory of shard files is always read with parallel_ingest, in this
+# process unless the mode is 'parallel'.
+LOAD_MODES = ('memory', 'streaming', 'parallel')
+
+class _RatingWrite:
+    """One caller's rating write, queued until it is applied along with any others queued meanwhile"""
+    __slots__ = ('updates', 'records', 'done', 'forward', 'pending', 'error')
+
+    def __init__(self, updates: List[Tuple[Any, Any]], records: List[Tuple[str, int]]):
+        self.updates = updates
+        self.records = records
+        self.done = False
+        # Set when the processor was replaced first; the caller sends the write to the successor
+        self.forward = False
+        self.pending = None
+        self.error = None
+
 class PlaylistDataProcessor:
     
-    def __init__(self, json_file_path: str):
+    def __init__(self, json_file_path: str, load_mode: str = 'memory', cache_dir: Optional[str] = None,
+                 shared: bool = False, compact: bool = False, ingest_workers: Optional[int] = None):
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load mode '{load_mode}', expected one of {LOAD_MODES}")
+        if shared and not cache_dir:
+            raise ValueError("Shared mode needs a cache_dir to publish the dataset in")
         self.json_file_path = json_file_path
-        self.normalized_data = None
+        self.load_mode = load_mode
+        # Worker processes for the parallel load mode; default one per CPU
+        self.ingest_workers = ingest_workers
+        # When set, normalized columns are snapshotted here and memory-mapped on later loads
+        self.cache_dir = cache_dir
+        # Shared mode lets several worker processes map one snapshot and one rating column
+        self.shared = shared
+        # Narrow dtypes, Arrow text and a derived duration_s; see compact
+        self.compact = compact
+        # Publishes immutable snapshots of the typed columns; see data_engine
+        self.engine = None
+        # Which load of this process the data comes from; see data_version
+        self.generation = 0
+        self.title_index = None
+        # id -> row position lookup
+        self.id_index = None
+        self.query = None
+        self.aggregates = None
+        self.stats = None
+        # Nearest neighbours over the standardized audio features
+        self.similarity = None
+        # When attached, every rating write is logged here so it survives restarts
+        self.rating_store = None
+        # When set, every applied rating write is published here and pushed to live subscribers; see rating_feed
+        self.rating_feed = None
+        # Set by hand_over once a reloaded processor replaces this one; later writes go to it
+        self._successor = None
+        # In shared mode, the rating column as of loading or the last shared_rating_changes call
+        self._polled_ratings = None
+        # Rating writes waiting for the write lock; see _submit_ratings
+        self._write_queue: List[_RatingWrite] = []
+        self._queue_lock = threading.Lock()
+        # Seconds spent in each phase of loading, e.g. parse, title_index; see _timed
+        self.load_timings: Dict[str, float] = {}
+        # Set once the title and similarity indexes are built; see build_indexes
+        self.indexes_ready = threading.Event()
+        self._frame = None
+    
+    def snapshot(self) -> Optional[DataSnapshot]:
+        """The current consistent state of the dataset; read a whole request from one snapshot"""
+        return None if self.engine is None else self.engine.snapshot()
+    
+    @property
+    def columns(self) -> Optional[Dict[str, np.ndarray]]:
+        """The typed arrays of the current snapshot, for code that reads columns directly"""
+        snapshot = self.snapshot()
+        return None if snapshot is None else snapshot.columns
+    
+    @property
+    def star_ratings(self) -> Optional[np.ndarray]:
+        """The rating column of the current snapshot"""
+        columns = self.columns
+        return None if columns is None else columns['star_rating']
+    
+    @property
+    def ratings_version(self) -> int:
+        """Bumped on every rating write so caches derived from ratings know they are stale"""
+        snapshot = self.snapshot()
+        return 0 if snapshot is None else snapshot.ratings_version
+    
+    def data_version(self, snapshot: Optional[DataSnapshot] = None) -> Tuple[int, int]:
+        """Identifies the data a snapshot (default: the current one) holds; changes with every rating write and load"""
+        snapshot = snapshot or self.snapshot()
+        return self.generation, 0 if snapshot is None else snapshot.ratings_version
+    
+    @property
+    def loaded(self) -> bool:
+        """Whether the dataset is loaded; cheap, unlike building normalized_data"""
+        return self.engine is not None
+    
+    def _require_loaded(self):
+        if self.engine is None:
+            raise ValueError("Data not loaded. Run load_and_normalize() first.")
+    
+    @property
+    def normalized_data(self) -> Optional['pd.DataFrame']:
+        """A DataFrame over the current snapshot's arrays, built without copying when ratings change"""
+        import pandas as pd
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return None
+        frame = self._frame
+        if frame is None or frame[0] is not snapshot:
+            columns = {name: np.asarray(values) if isinstance(values, DerivedColumn) else values
+                       for name, values in snapshot.columns.items()}
+            frame = self._frame = (snapshot, pd.DataFrame(columns, copy=False))
+        return frame[1]
         
-    def load_and_normalize(self) -> pd.DataFrame:
+    @contextmanager
+    def _timed(self, phase: str):
+        """Record the time spent in the with block under phase in load_timings"""
+        start = time.perf_counter()
         try:
-            with open(self.json_file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-            
-            logger.info(f"Loaded JSON data with {len(data)} attributes")
-            
-            normalized_rows = []
-            
-            # Get the number of songs (assuming all attributes have same number of entries)
-            first_key = list(data.keys())[0]
-            num_songs = len(data[first_key])
-            
-            logger.info(f"Processing {num_songs} songs")
-            
-            for i in range(num_songs):
-                row = {'index': i}
-                for attribute, values in data.items():
-                    row[attribute] = values[str(i)]
-                normalized_rows.append(row)
-            
-            self.normalized_data = pd.DataFrame(normalized_rows)
+            yield
+        finally:
+            self.load_timings[phase] = time.perf_counter() - start
+    
+    def load_and_normalize(self, defer_indexes: bool = False) -> 'pd.DataFrame':
+        """Load the source into typed columns and build the indexes
+        
+        With defer_indexes, the title and similarity indexes are left for a
+        later build_indexes() call, so pages, stats and rating writes can be
+        served first; searches and similar-song lookups wait for them.
+        """
+        try:
+            self.load_timings = {}
+            self.indexes_ready.clear()
+            started = time.perf_counter()
+            star_ratings = None
+            if self.shared:
+                # The first worker to get the lock builds the snapshot; the rest attach to it
+                with snapshot_lock(self.json_file_path, self.snapshot_dir):
+                    columns = self._load_columns()
+                    star_ratings = open_shared_ratings(self.json_file_path, self.snapshot_dir,
+                                                       len(columns['index']), SONG_SCHEMA['star_rating'])
+            else:
+                columns = self._load_columns()
             
-            # Add star_rating column (initially 0 for all songs)
-            self.normalized_data['star_rating'] = 0
+            logger.info(f"Processing {len(columns['index'])} songs")
             
-            # Convert duration from ms to seconds for easier processing
-            if 'duration_ms' in self.normalized_data.columns:
-                self.normalized_data['duration_s'] = self.normalized_data['duration_ms'] / 1000
+            if star_ratings is None:
+                star_ratings = np.zeros(len(columns['index']), dtype=SONG_SCHEMA['star_rating'])
+            # Other workers write the shared rating column too, so it is written in place, not copied
+            with self._timed('finalize'):
+                self.engine = DataEngine(self._finalize_columns(columns, star_ratings), self.ratings_version + 1,
+                                         in_place_ratings=self.shared)
+            self._polled_ratings = np.array(star_ratings, copy=True) if self.shared else None
+            self.generation = next(_load_generations)
+            self.query = SongQuery(self.engine.snapshot, track_ratings=not self.shared)
+            self.aggregates = ColumnAggregates(self.engine.snapshot, track_ratings=not self.shared)
+            # For the same reason, only track the rating distribution incrementally when it is private
+            with self._timed('column_stats'):
+                self.stats = ColumnStats(self.columns, track_ratings=not self.shared)
+            with self._timed('id_index'):
+                self.id_index = HashedIdIndex(columns.get('id', np.empty(0, dtype=object)))
+                if not self.id_index.is_unique:
+                    logger.warning("Song ids are not unique; ratings apply to every row sharing an id")
+            if not defer_indexes:
+                self.build_indexes()
+            self.load_timings['total'] = time.perf_counter() - started
             
+            phases = ', '.join(f"{phase} {seconds:.3f}s" for phase, seconds in self.load_timings.items())
+            logger.info(f"Loaded {len(columns['index'])} songs{' before its indexes' if defer_indexes else ''}: {phases}")
             logger.info(f"Successfully normalized data: {self.normalized_data.shape}")
             logger.info(f"Columns: {list(self.normalized_data.columns)}")
             
@@ -52,9 +294,96 @@ class PlaylistDataProcessor:
             logger.error(f"Error processing data: {str(e)}")
             raise
     
-    def get_normalized_data(self) -> pd.DataFrame:
+    def build_indexes(self):
+        """Build the title and similarity indexes, then wake the searches waiting for them"""
+        try:
+            columns = self.columns
+            with self._timed('title_index'):
+                self.title_index = TitleIndex(to_python_list(columns['title']) if 'title' in columns else ())
+            with self._timed('similarity_index'):
+                self.similarity = SimilarityIndex(columns)
+        finally:
+            # Also on failure, so waiting requests fail instead of hanging
+            self.indexes_ready.set()
+    
+    def _wait_for_indexes(self):
+        self.indexes_ready.wait()
+        if self.title_index is None or self.similarity is None:
+            raise ValueError("The title and similarity indexes failed to build")
+    
+    @property
+    def snapshot_dir(self) -> Optional[str]:
+        """Where this processor's snapshots live; compact ones are kept apart from standard ones"""
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, 'compact') if self.compact else self.cache_dir
+    
+    def _load_columns(self) -> Dict[str, np.ndarray]:
+        """Load typed columns from a fresh snapshot if there is one, else parse and snapshot them"""
+        if not self.cache_dir:
+            return self._parse_columns()
+        
+        with self._timed('snapshot_load'):
+            columns = load_snapshot(self.json_file_path, self.snapshot_dir)
+        if columns is None:
+            source_hash = content_hash(self.json_file_path)
+            columns = self._parse_columns()
+            try:
+                with self._timed('snapshot_write'):
+                    write_snapshot(self.json_file_path, self.snapshot_dir, columns, source_hash)
+            except OSError as e:
+                if self.shared:
+                    raise
+                logger.warning(f"Could not write snapshot: {str(e)}")
+        return columns
+    
+    def _parse_columns(self) -> Dict[str, np.ndarray]:
+        """Parse the source JSON into typed columns using the configured load mode and layout"""
+        with self._timed('parse'):
+            if self.load_mode == 'parallel':
+                workers = self.ingest_workers or os.cpu_count() or 1
+                columns = ingest_columns(self.json_file_path, _convert_values, workers)
+            elif os.path.isdir(self.json_file_path):
+                columns = ingest_columns(self.json_file_path, _convert_values)
+            elif self.load_mode == 'streaming':
+                columns = stream_columns(self.json_file_path, _convert_values)
+            else:
+                with open(self.json_file_path, 'r', encoding='utf-8') as file:
+                    data = json.load(file)
+                
+                logger.info(f"Loaded JSON data with {len(data)} attributes")
+                
+                _, columns = build_columns(data)
+                del data
+        
+        if not self.compact:
+            return columns
+        with self._timed('compact'):
+            return compact_columns(columns)
+    
+    def _finalize_columns(self, columns: Dict[str, np.ndarray],
+                          star_ratings: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """Add the star_rating and duration_s columns to the parsed ones"""
+        num_songs = len(columns['index'])
+        
+        # Add star_rating column (initially 0 for all songs)
+        columns = dict(columns)
+        if star_ratings is None:
+            star_ratings = np.zeros(num_songs, dtype=SONG_SCHEMA['star_rating'])
+        columns['star_rating'] = star_ratings
+        
+        # Convert duration from ms to seconds for easier processing; compact data computes it on access
+        if 'duration_ms' in columns:
+            if self.compact:
+                columns['duration_s'] = DerivedColumn(columns['duration_ms'], 1000)
+            else:
+                columns['duration_s'] = columns['duration_ms'] / 1000
+        
+        return columns
+    
+    def get_normalized_data(self) -> 'pd.DataFrame':
         """Get the normalized DataFrame"""
-        if self.normalized_data is None:
+        if not self.loaded:
             return self.load_and_normalize()
         return self.normalized_data
     
@@ -66,37 +395,383 @@ class PlaylistDataProcessor:
         else:
             logger.warning("No data to save. Run load_and_normalize() first.")
     
-    def get_song_by_title(self, title: str) -> Dict[str, Any]:
-        """Get song by title (case-insensitive partial match)"""
-        if self.normalized_data is None:
-            raise ValueError("Data not loaded. Run load_and_normalize() first.")
+    def _save_export(self, export_format: str, output_path: str, columns: Optional[List[str]] = None):
+        """Write normalized data to output_path chunk by chunk, like the /api/export endpoint"""
+        if not self.loaded:
+            logger.warning("No data to save. Run load_and_normalize() first.")
+            return
         
-        # Case-insensitive partial match
-        matches = self.normalized_data[
-            self.normalized_data['title'].str.contains(title, case=False, na=False)
-        ]
+        chunks = iter_export(export_format, self.columns, select_columns(self.columns, columns))
+        with open(output_path, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        logger.info(f"Data saved to {output_path}")
+    
+    def save_to_parquet(self, output_path: str, columns: Optional[List[str]] = None):
+        """Save normalized data to a Parquet file (needs pyarrow)"""
+        self._save_export('parquet', output_path, columns)
+    
+    def save_to_arrow(self, output_path: str, columns: Optional[List[str]] = None):
+        """Save normalized data as an Arrow IPC stream (needs pyarrow)"""
+        self._save_export('arrow', output_path, columns)
+    
+    def save_to_ndjson(self, output_path: str, columns: Optional[List[str]] = None):
+        """Save normalized data as newline-delimited JSON"""
+        self._save_export('ndjson', output_path, columns)
+    
+    def get_song_by_title(self, title: str, snapshot: Optional[DataSnapshot] = None) -> Dict[str, Any]:
+        """Get song by title (case-insensitive partial match), read from snapshot (default: the current one)"""
+        self._require_loaded()
         
-        if len(matches) == 0:
+        # Case-insensitive partial match, first in catalog order
+        self._wait_for_indexes()
+        row = self.title_index.first_match(title)
+        
+        if row is None:
             return None
         
         # Return first match as dictionary
-        return matches.iloc[0].to_dict()
+        return self._records([row], snapshot)[0]
+    
+    def search_songs(self, title: str, limit: int = 10,
+                     snapshot: Optional[DataSnapshot] = None) -> List[Dict[str, Any]]:
+        """Get up to limit songs whose title contains title, best matches first, read from snapshot (default: the current one)"""
+        self._require_loaded()
+        
+        self._wait_for_indexes()
+        rows = self.title_index.search(title, limit)
+        return self._records(rows, snapshot)
+    
+    def search_titles(self, titles: List[str], limit: int = 1) -> List[List[int]]:
+        """Row positions of up to limit matches for each title, ranked like search_songs
+        
+        The whole batch is resolved in one pass over the title index.
+        """
+        self._require_loaded()
+        
+        self._wait_for_indexes()
+        return self.title_index.search_many(titles, limit)
+    
+    def find_songs(self, song_ids: List[str]) -> np.ndarray:
+        """Row position of each id, or -1 where there is no such song
+        
+        Unique ids are looked up with one vectorized call on the id index; a
+        duplicated id resolves to its first row.
+        """
+        self._require_loaded()
+        
+        if self.id_index.is_unique:
+            return self.id_index.get_indexer(song_ids)
+        
+        positions = np.full(len(song_ids), -1, dtype=np.int64)
+        for query, song_id in enumerate(song_ids):
+            try:
+                location = self.id_index.get_loc(song_id)
+            except KeyError:
+                continue
+            # A duplicated id gives its rows in order
+            positions[query] = location[0] if isinstance(location, np.ndarray) else location
+        return positions
+    
+    def _records(self, rows, snapshot: Optional[DataSnapshot] = None) -> List[Dict[str, Any]]:
+        """The rows at the given positions as dicts of Python values, whatever the column layout"""
+        columns = (snapshot or self.snapshot()).columns
+        values = [to_python_list(columns[name][rows]) for name in columns]
+        return [dict(zip(columns, row)) for row in zip(*values)]
+    
+    def memory_report(self) -> Dict[str, Any]:
+        """Bytes held by each column and index of the current snapshot, in total and per song
+        
+        Object columns count their Python objects too. Memory-mapped columns
+        are flagged: the OS pages them in on use and can share them between
+        processes. Derived columns hold nothing until read.
+        """
+        self._require_loaded()
+        
+        columns = {}
+        for name, values in self.columns.items():
+            columns[name] = {
+                'dtype': 'derived' if isinstance(values, DerivedColumn) else str(values.dtype),
+                'bytes': column_nbytes(values),
+                'mapped': isinstance(values, np.memmap),
+            }
+        indexes = {
+            'id': self.id_index.nbytes,
+            # Not counted until built, when they are deferred
+            'title': 0 if self.title_index is None else self.title_index.nbytes,
+            'similarity': 0 if self.similarity is None else self.similarity.nbytes,
+        }
+        
+        num_songs = len(self.columns['index'])
+        column_bytes = sum(column['bytes'] for column in columns.values())
+        index_bytes = sum(indexes.values())
+        return {
+            'layout': 'compact' if self.compact else 'standard',
+            'songs': num_songs,
+            'columns': columns,
+            'indexes': indexes,
+            'column_bytes': column_bytes,
+            'index_bytes': index_bytes,
+            'total_bytes': column_bytes + index_bytes,
+            'bytes_per_song': (column_bytes + index_bytes) / num_songs if num_songs else None,
+        }
+    
+    def similar_songs(self, song_id: str, k: int = 10) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Row positions and feature distances of the k songs most like song_id, nearest first
+        
+        Returns None if there is no song with that id. Rows sharing the id are
+        never returned as similar to it.
+        """
+        self._require_loaded()
+        
+        try:
+            location = self.id_index.get_loc(song_id)
+        except KeyError:
+            return None
+        
+        own = np.atleast_1d(location)
+        self._wait_for_indexes()
+        neighbours, distances = self.similarity.nearest(own[:1], k + len(own) - 1)
+        keep = ~np.isin(neighbours[0], own)
+        return neighbours[0][keep][:k], distances[0][keep][:k]
+    
+    def attach_rating_store(self, store: RatingStore) -> int:
+        """Apply the ratings recorded in store, then log every later rating write to it
+        
+        Returns the number of recorded ratings not applied: those whose song
+        is not in the dataset, which stay in the store and apply again if the
+        song comes back, and those outside 1-5, which are skipped.
+        """
+        self._require_loaded()
+        
+        not_found = []
+        with self._timed('ratings_replay'):
+            valid = {song_id: rating for song_id, rating in store.ratings.items() if 1 <= rating <= 5}
+            if valid:
+                song_ids, ratings = zip(*valid.items())
+                not_found = self.update_star_ratings(list(song_ids), list(ratings))
+        if len(valid) < len(store.ratings):
+            logger.warning(f"Skipped {len(store.ratings) - len(valid)} stored ratings that are not between 1 and 5")
+        if not_found:
+            logger.warning(f"{len(not_found)} stored ratings refer to songs that are not in the dataset")
+        
+        self.rating_store = store
+        logger.info(f"Restored {len(valid) - len(not_found)} ratings")
+        return len(store.ratings) - len(valid) + len(not_found)
+    
+    def build_successor(self) -> 'PlaylistDataProcessor':
+        """Load the source file again into a new processor with the same settings, indexes included
+        
+        This processor keeps serving, unaffected, while the new one is built.
+        """
+        successor = PlaylistDataProcessor(self.json_file_path, load_mode=self.load_mode,
+                                          cache_dir=self.cache_dir, shared=self.shared, compact=self.compact,
+                                          ingest_workers=self.ingest_workers)
+        successor.load_and_normalize()
+        return successor
+    
+    def hand_over(self, successor: 'PlaylistDataProcessor') -> int:
+        """Carry ratings forward to successor by song id and send every later rating write to it
+        
+        With a rating store, successor replays and takes over the store, so
+        ratings of songs missing from this dataset come back too; otherwise
+        this snapshot's ratings are copied. Readers of this processor are not
+        affected. Returns the number of ratings carried forward.
+        """
+        self._require_loaded()
+        
+        # No write can land here between copying the ratings and redirecting writes
+        with self.engine.write_lock:
+            if self._successor is not None:
+                raise ValueError("This processor has already been replaced")
+            
+            store = self.rating_store
+            if store is not None:
+                not_found = successor.attach_rating_store(store)
+                carried = len(store.ratings) - not_found
+            else:
+                columns = self.columns
+                rated = np.flatnonzero(columns['star_rating'])
+                song_ids = to_python_list(columns['id'][rated])
+                not_found = successor.update_star_ratings(song_ids, columns['star_rating'][rated].tolist())
+                carried = len(song_ids) - len(not_found)
+                if not_found:
+                    logger.warning(f"Dropping ratings of {len(not_found)} songs that are not in the reloaded dataset")
+            
+            # The reloaded data's rating writes are pushed to the same subscribers
+            successor.rating_feed = self.rating_feed
+            self.rating_store = None
+            self.rating_feed = None
+            self._successor = successor
+        
+        logger.info(f"Carried {carried} ratings forward to the reloaded dataset")
+        return carried
+    
+    def retire(self, forward_to: Any) -> Dict[str, int]:
+        """Stop taking rating writes, when this processor is unloaded, and return its ratings by song id
+        
+        Every later rating write is sent to forward_to, which has the
+        update_star_rating and update_star_ratings methods of a processor. The
+        rating store is detached but left open for whoever loads the data next.
+        Readers of this processor are not affected.
+        """
+        self._require_loaded()
+        
+        with self.engine.write_lock:
+            if self._successor is not None:
+                raise ValueError("This processor has already been replaced")
+            
+            columns = self.columns
+            rated = np.flatnonzero(columns['star_rating'])
+            ratings = dict(zip(to_python_list(columns['id'][rated]), columns['star_rating'][rated].tolist()))
+            self.rating_store = None
+            self._successor = forward_to
+        return ratings
+    
+    def _log_ratings(self, records: List[Tuple[str, int]]) -> Optional[Tuple[RatingStore, int]]:
+        """Append applied rating writes to the rating store, if any; return it and the durability ticket"""
+        if self.rating_store is None or not records:
+            return None
+        return self.rating_store, self.rating_store.append(records)
+    
+    def _publish_ratings(self, records: List[Tuple[str, int]]):
+        """Send applied rating writes to the rating feed, if any, in the order they were applied"""
+        if self.rating_feed is not None and records:
+            self.rating_feed.publish(records)
+    
+    def shared_rating_changes(self) -> List[Tuple[str, int]]:
+        """(song_id, rating) of every song whose rating changed since loading or the last call, whichever worker wrote it
+        
+        For shared mode, where other workers write the rating column without
+        this process seeing it. Each call compares the whole column with a
+        copy taken by the previous one, so it costs O(n); call it off the
+        event loop, and from one thread at a time.
+        """
+        if not self.shared or not self.loaded:
+            return []
+        columns = self.columns
+        current = np.array(columns['star_rating'], copy=True)
+        previous, self._polled_ratings = self._polled_ratings, current
+        changed = np.flatnonzero(current != previous)
+        return list(zip(to_python_list(columns['id'][changed]), current[changed].tolist()))
+    
+    def _wait_durable(self, pending: Optional[Tuple[RatingStore, int]]):
+        if pending is not None:
+            store, ticket = pending
+            store.wait_durable(ticket)
+    
+    def _write_ratings(self, updates: List[Tuple[Any, Any]]):
+        """Publish a new snapshot with the (positions, ratings) updates applied, keeping stats in step"""
+        previous, written = self.engine.write_ratings(updates)
+        self.stats.ratings_changed(previous, written)
+    
+    def _submit_ratings(self, updates: List[Tuple[Any, Any]], records: List[Tuple[str, int]]) -> _RatingWrite:
+        """Apply a rating write, logged as records, together with every write queued behind the write lock
+        
+        Each write copies the rating column (see data_engine), so writers
+        queue first and whoever takes the lock applies the whole queue with
+        one copy, in queue order. A burst of concurrent writes costs one copy
+        rather than one each, and each write is still all or nothing.
+        """
+        write = _RatingWrite(updates, records)
+        with self._queue_lock:
+            self._write_queue.append(write)
+        
+        # The write lock keeps each rating write and its log record in the same order
+        with self.engine.write_lock:
+            if not write.done:
+                self._apply_queued()
+        if write.error is not None:
+            raise write.error
+        return write
+    
+    def _apply_queued(self):
+        with self._queue_lock:
+            batch, self._write_queue = self._write_queue, []
+        
+        forward = self._successor is not None
+        pending = error = None
+        if not forward:
+            try:
+                updates = [update for write in batch for update in write.updates]
+                records = [record for write in batch for record in write.records]
+                # Logged first, so a write that cannot be logged is not applied either
+                pending = self._log_ratings(records)
+                if updates:
+                    self._write_ratings(updates)
+                self._publish_ratings(records)
+            except Exception as e:
+                error = e
+        for write in batch:
+            write.forward, write.pending, write.error, write.done = forward, pending, error, True
     
     def update_star_rating(self, song_id: str, rating: int) -> bool:
         """Update star rating for a song"""
-        if self.normalized_data is None:
-            raise ValueError("Data not loaded. Run load_and_normalize() first.")
+        self._require_loaded()
         
         if not (1 <= rating <= 5):
             raise ValueError("Rating must be between 1 and 5")
         
-        # Find song by ID
-        mask = self.normalized_data['id'] == song_id
-        if not mask.any():
-            return False
+        # Find song by ID; a position, or an array of them when the id is duplicated
+        try:
+            positions = self.id_index.get_loc(song_id)
+        except KeyError:
+            positions = None
+        
+        if positions is None:
+            write = self._submit_ratings([], [])
+        else:
+            write = self._submit_ratings([(positions, rating)], [(song_id, rating)])
+        
+        if write.forward:
+            return self._successor.update_star_rating(song_id, rating)
+        
+        # Wait for the disk outside the lock so concurrent writers can share one sync
+        self._wait_durable(write.pending)
+        return positions is not None
+    
+    def update_star_ratings(self, song_ids: List[str], ratings: List[int]) -> List[str]:
+        """Update star ratings for many songs at once, returning the ids that were not found
+        
+        When an id appears more than once, its last rating wins. Nothing is
+        written if any rating is out of range, and readers see either none or
+        all of the update.
+        """
+        self._require_loaded()
+        
+        if len(song_ids) != len(ratings):
+            raise ValueError("song_ids and ratings must have the same length")
+        
+        ratings = np.asarray(ratings, dtype=np.int64)
+        if ((ratings < 1) | (ratings > 5)).any():
+            raise ValueError("Rating must be between 1 and 5")
+        
+        if not self.id_index.is_unique:
+            updates, found = [], []
+            for song_id, rating in zip(song_ids, ratings.tolist()):
+                try:
+                    updates.append((self.id_index.get_loc(song_id), rating))
+                    found.append(True)
+                except KeyError:
+                    found.append(False)
+        else:
+            positions = self.id_index.get_indexer(song_ids)
+            found_mask = positions >= 0
+            found = found_mask.tolist()
+            
+            # Keep only the last rating for each position
+            positions, last_ratings = positions[found_mask][::-1], ratings[found_mask][::-1]
+            positions, last = np.unique(positions, return_index=True)
+            updates = [(positions, last_ratings[last])] if len(positions) else []
+        
+        records = [(song_id, rating) for song_id, rating, ok in zip(song_ids, ratings.tolist(), found) if ok]
+        write = self._submit_ratings(updates, records)
+        
+        if write.forward:
+            return self._successor.update_star_ratings(song_ids, ratings)
         
-        self.normalized_data.loc[mask, 'star_rating'] = rating
-        return True
+        self._wait_durable(write.pending)
+        return [song_id for song_id, ok in zip(song_ids, found) if not ok]
 
 if __name__ == "__main__":
     # Test the processor
@@ -0,0 +1,179 @@
+"""
+Chunked encoders for exporting the normalized song columns
+
+Exports are produced as an iterator of byte chunks, each covering a fixed
+number of rows sliced straight from the column arrays, so memory use stays
+constant whatever the catalog size and the first bytes can be sent while
+the rest is still being encoded. Each export owns its iterator and writes
+no files, so concurrent exports never interfere.
+
+CSV and NDJSON are encoded with pandas, imported on the first such export. Arrow IPC streams and Parquet files
+are built from record batches with the optional pyarrow package, and keep
+each column's dtype.
+"""
+import zlib
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Sequence
+from compact import is_text, widen
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow and Parquet exports are unavailable without pyarrow
+    pa = pq = None
+
+EXPORT_CHUNK_ROWS = 10_000
+# Arrow batches and Parquet row groups are worth making larger than text chunks
+ARROW_CHUNK_ROWS = 65_536
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# format -> (file extension, media type, needs pyarrow)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv', False),
+    'ndjson': ('ndjson', 'application/x-ndjson', False),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream', True),
+    'parquet': ('parquet', 'application/vnd.apache.parquet', True),
+}
+
+def select_columns(columns: Dict[str, np.ndarray], names: Optional[Sequence[str]] = None) -> List[str]:
+    """Expand a column selection, accepting comma-separated names, and validate it"""
+    if not names:
+        return list(columns)
+    selected = [name.strip() for entry in names for name in entry.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in columns]
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}; choose from {list(columns)}")
+    return list(dict.fromkeys(selected))
+
+def iter_row_chunks(num_rows: int, positions: Optional[np.ndarray] = None,
+                    chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator:
+    """Yield slices (all rows) or position arrays (selected rows) of at most chunk_rows rows"""
+    if positions is None:
+        for start in range(0, num_rows, chunk_rows):
+            yield slice(start, min(start + chunk_rows, num_rows))
+    else:
+        for start in range(0, len(positions), chunk_rows):
+            yield positions[start:start + chunk_rows]
+
+def iter_csv(columns: Dict[str, np.ndarray], names: List[str], positions: Optional[np.ndarray] = None,
+             chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode the selected rows and columns as CSV, chunk by chunk
+
+    The output is identical to ``DataFrame.to_csv(index=False)`` on the same
+    rows and columns.
+    """
+    import pandas as pd
+    header = True
+    for rows in iter_row_chunks(len(columns['index']), positions, chunk_rows):
+        frame = pd.DataFrame({name: columns[name][rows] for name in names}, columns=names, copy=False)
+        yield frame.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+    if header:
+        # No rows selected: still send the header line
+        yield pd.DataFrame(columns=names).to_csv(index=False).encode('utf-8')
+
+def iter_ndjson(columns: Dict[str, np.ndarray], names: List[str], positions: Optional[np.ndarray] = None,
+                chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode the selected rows and columns as newline-delimited JSON objects, chunk by chunk"""
+    import pandas as pd
+    for rows in iter_row_chunks(len(columns['index']), positions, chunk_rows):
+        # to_json prints float32 values with float64 noise; widen them back first
+        frame = pd.DataFrame({name: widen(columns[name][rows]) for name in names}, columns=names, copy=False)
+        yield frame.to_json(orient='records', lines=True).encode('utf-8')
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        """Return and forget everything written since the last call"""
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+def arrow_schema(columns: Dict[str, np.ndarray], names: List[str]):
+    """Arrow schema keeping each column's numpy dtype; text columns become strings"""
+    return pa.schema([
+        (name, pa.string() if is_text(columns[name]) else pa.from_numpy_dtype(columns[name].dtype))
+        for name in names
+    ])
+
+def _record_batches(columns: Dict[str, np.ndarray], names: List[str], schema,
+                    positions: Optional[np.ndarray], chunk_rows: int):
+    for rows in iter_row_chunks(len(columns['index']), positions, chunk_rows):
+        arrays = [pa.array(columns[name][rows], type=field.type) for name, field in zip(names, schema)]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def iter_arrow(columns: Dict[str, np.ndarray], names: List[str], positions: Optional[np.ndarray] = None,
+               chunk_rows: int = ARROW_CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode the selected rows and columns as an Arrow IPC stream, one record batch at a time"""
+    schema = arrow_schema(columns, names)
+    sink = _ChunkSink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for batch in _record_batches(columns, names, schema, positions, chunk_rows):
+            writer.write_batch(batch)
+            yield sink.take()
+    yield sink.take()
+
+def iter_parquet(columns: Dict[str, np.ndarray], names: List[str], positions: Optional[np.ndarray] = None,
+                 chunk_rows: int = ARROW_CHUNK_ROWS) -> Iterator[bytes]:
+    """Encode the selected rows and columns as a Parquet file, one row group at a time
+
+    The file metadata goes in the footer, so it is written after the last row group.
+    """
+    schema = arrow_schema(columns, names)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in _record_batches(columns, names, schema, positions, chunk_rows):
+            writer.write_batch(batch)
+            data = sink.take()
+            if data:
+                yield data
+    yield sink.take()
+
+_ENCODERS = {'csv': iter_csv, 'ndjson': iter_ndjson, 'arrow': iter_arrow, 'parquet': iter_parquet}
+
+def iter_export(export_format: str, columns: Dict[str, np.ndarray], names: List[str],
+                positions: Optional[np.ndarray] = None) -> Iterator[bytes]:
+    """Encode the selected rows and columns in one of EXPORT_FORMATS
+
+    Raises ValueError for an unknown format and ImportError when the format
+    needs pyarrow and it is not installed.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{export_format}', expected one of {list(EXPORT_FORMATS)}")
+    if EXPORT_FORMATS[export_format][2] and pa is None:
+        raise ImportError(f"{export_format} export needs the optional pyarrow package")
+    return _ENCODERS[export_format](columns, names, positions)
+
+def gzip_chunks(chunks: Iterator[bytes], level: int = 1) -> Iterator[bytes]:
+    """Compress a stream of byte chunks into one gzip stream
+
+    The default level favours speed, since compression runs while the
+    response is being sent.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,71 @@
+"""
+Song id lookup that keeps no copy of the ids
+
+A pandas Index over the id column builds a hash table of Python string
+objects, and for Arrow-backed strings first materializes every id as one.
+HashedIdIndex instead keeps each id's hash in a sorted int64 array next to
+the row it came from, 12 bytes per song, and confirms a lookup against the
+id column itself, so a hash collision can never return the wrong song.
+"""
+import numpy as np
+from typing import Any, Iterable, Union
+from compact import to_python_list
+
+class HashedIdIndex:
+    """id -> row position lookup over an id column, answering like a pandas Index"""
+
+    def __init__(self, ids):
+        self._ids = ids
+        hashes = np.fromiter((hash(song_id) for song_id in to_python_list(ids)), dtype=np.int64, count=len(ids))
+        self._order = np.argsort(hashes, kind='stable').astype(np.int32 if len(ids) < 2 ** 31 else np.int64)
+        self._hashes = hashes[self._order]
+
+        # Ids are unique unless two rows with equal hashes hold equal ids
+        repeated = np.flatnonzero(self._hashes[1:] == self._hashes[:-1])
+        rows = np.unique(np.concatenate([self._order[repeated], self._order[repeated + 1]]))
+        candidates = to_python_list(ids[rows]) if len(rows) else []
+        self.is_unique = len(set(candidates)) == len(candidates)
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._hashes.nbytes + self._order.nbytes)
+
+    def get_loc(self, song_id: Any) -> Union[int, np.ndarray]:
+        """The row of song_id, or an array of rows if it is duplicated; KeyError if absent"""
+        try:
+            key = hash(song_id)
+        except TypeError:
+            raise KeyError(song_id)
+        start = np.searchsorted(self._hashes, key, side='left')
+        stop = np.searchsorted(self._hashes, key, side='right')
+        rows = np.sort(self._order[start:stop])
+        rows = rows[[value == song_id for value in to_python_list(self._ids[rows])]] if len(rows) else rows
+        if not len(rows):
+            raise KeyError(song_id)
+        return int(rows[0]) if len(rows) == 1 else rows.astype(np.int64)
+
+    def get_indexer(self, song_ids: Iterable[Any]) -> np.ndarray:
+        """The row of each id, or -1 where it is absent; ids must be unique, as for pandas"""
+        song_ids = list(song_ids)
+        positions = np.full(len(song_ids), -1, dtype=np.int64)
+        if not song_ids or not len(self._hashes):
+            return positions
+
+        keys = np.fromiter((hash(song_id) for song_id in song_ids), dtype=np.int64, count=len(song_ids))
+        slots = np.minimum(np.searchsorted(self._hashes, keys), len(self._hashes) - 1)
+        hit = np.flatnonzero(self._hashes[slots] == keys)
+        rows = self._order[slots[hit]].astype(np.int64)
+        stored = to_python_list(self._ids[rows]) if len(rows) else []
+        for query, row, value in zip(hit.tolist(), rows.tolist(), stored):
+            if value == song_ids[query]:
+                positions[query] = row
+            else:
+                # Another id shares the hash; look past it
+                try:
+                    positions[query] = self.get_loc(song_ids[query])
+                except KeyError:
+                    pass
+        return positions
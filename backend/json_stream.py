@@ -0,0 +1,192 @@
+"""
+Incremental parser for column-oriented playlist JSON files
+
+Reads ``{"attr": {"0": value, "1": value, ...}, ...}`` files in fixed-size
+text chunks and appends each chunk's values straight into typed column
+buffers, so the full parsed object tree never exists in memory at once.
+Only scalar values (strings, numbers, booleans and null) are supported.
+"""
+import json
+import re
+import logging
+import numpy as np
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1 << 18  # characters per read
+
+# One `"key": value` pair. A value is either `{` (the start of an attribute's
+# row mapping), a JSON string, or a bare scalar that must be followed by a
+# separator so a number cut off at the end of a chunk is never matched.
+_ENTRY = re.compile(
+    r'"((?:[^"\\]|\\.)*)"\s*:\s*'
+    r'(\{|"(?:[^"\\]|\\.)*"|[^\s,{}\[\]"]+(?=\s*[,}]))'
+)
+_SEPARATOR_CHARS = ' \t\r\n,{}'
+
+class ColumnBuffer:
+    """Append-only typed buffer backing a single column
+
+    The dtype is taken from the first appended chunk and widened if a later
+    chunk needs it (e.g. an integer column that turns out to contain nulls).
+    """
+
+    def __init__(self, capacity: int = 0):
+        self.size = 0
+        self._capacity = capacity
+        self._data = None
+
+    def append(self, values: np.ndarray):
+        """Copy a chunk of values onto the end of the buffer"""
+        if self._data is None:
+            self._data = np.empty(max(self._capacity, len(values), 1024), dtype=values.dtype)
+        elif not np.can_cast(values.dtype, self._data.dtype, casting='safe'):
+            self._data = self._data.astype(np.result_type(self._data.dtype, values.dtype))
+
+        end = self.size + len(values)
+        if end > len(self._data):
+            # Only the first column grows; later ones are preallocated to its length
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:end] = values
+        self.size = end
+
+    def finish(self) -> np.ndarray:
+        """Return the filled part of the buffer, trimmed to its exact length"""
+        if self._data is None:
+            return np.empty(0, dtype=object)
+        if self.size == len(self._data):
+            return self._data
+        return self._data[:self.size].copy()
+
+def _decode_key(raw: str) -> str:
+    return json.loads(f'"{raw}"') if '\\' in raw else raw
+
+def _iter_entries(file, chunk_size: int) -> Iterator[Tuple[List[str], List[str]]]:
+    """Yield (keys, raw values) for every complete entry read so far, chunk by chunk"""
+    leftover = ''
+    while True:
+        chunk = file.read(chunk_size)
+        text = leftover + chunk
+        parts = _ENTRY.split(text)
+
+        gaps = parts[0:-1:3]
+        bad_gaps = {gap for gap in set(gaps) if gap.strip(_SEPARATOR_CHARS)}
+        if bad_gaps:
+            # Text that is not a separator can only be a value cut off at the
+            # chunk boundary; everything from there on is re-read next time.
+            first_bad = min(gaps.index(gap) for gap in bad_gaps)
+            consumed = 3 * first_bad
+            rest = [parts[consumed]]
+            for i in range(consumed + 1, len(parts) - 1, 3):
+                rest.append(f'"{parts[i]}":{parts[i + 1]}')
+                rest.append(parts[i + 2])
+            leftover = ''.join(rest) + parts[-1]
+            parts = parts[:consumed] + ['']
+        else:
+            leftover = parts[-1]
+
+        yield parts[1::3], parts[2::3]
+
+        if not chunk:
+            if leftover.strip(_SEPARATOR_CHARS):
+                raise ValueError(f"Unexpected or unsupported JSON near: {leftover[:80]!r}")
+            return
+
+def _realign(attribute: str, values: np.ndarray, own_keys: np.ndarray, all_keys: np.ndarray) -> np.ndarray:
+    """Spread a column over the union of row keys, leaving gaps as None/NaN"""
+    if values.dtype == object:
+        aligned = np.full(len(all_keys), None, dtype=object)
+    else:
+        if values.dtype.kind in 'iub':
+            logger.warning(f"Column '{attribute}' has missing values, storing it as float64")
+        aligned = np.full(len(all_keys), np.nan, dtype=np.float64)
+    aligned[np.searchsorted(all_keys, own_keys)] = values
+    return aligned
+
+def align_columns(columns: Dict[str, np.ndarray], column_keys: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Order columns by their integer row keys, spreading a column that lacks some rows over the union of keys
+
+    ``column_keys`` holds each column's keys in the column's order. The
+    result has the layout of ``data_processor.build_columns``.
+    """
+    keys = list(column_keys.values())
+    positions = keys[0]
+    if any(other is not positions and not np.array_equal(other, positions) for other in keys[1:]):
+        all_keys = np.unique(np.concatenate(keys))
+        for attribute, values in columns.items():
+            own_keys = column_keys[attribute]
+            if not np.array_equal(own_keys, all_keys):
+                order = np.argsort(own_keys, kind='stable')
+                columns[attribute] = _realign(attribute, values[order], own_keys[order], all_keys)
+        positions = all_keys
+    elif len(positions) and not np.array_equal(positions, np.arange(len(positions))):
+        order = np.argsort(positions, kind='stable')
+        columns = {attribute: values[order] for attribute, values in columns.items()}
+        positions = positions[order]
+    return {'index': positions, **columns}
+
+def stream_columns(json_file_path: str, convert: Callable[[str, List[Any]], np.ndarray],
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, np.ndarray]:
+    """Parse a playlist file incrementally into typed columns
+
+    ``convert(attribute, values)`` turns one chunk of decoded JSON values into
+    a typed array. The first attribute determines the row count and every later
+    column is preallocated to that length. The result has the same layout as
+    ``data_processor.build_columns``: an ``index`` column with the integer row
+    keys in ascending order, then one array per attribute in file order.
+    """
+    buffers: Dict[str, ColumnBuffer] = {}
+    own_keys: Dict[str, ColumnBuffer] = {}
+    first_keys = ColumnBuffer()
+    positions = None
+    attribute = None
+
+    def append(keys: List[str], values: List[str]):
+        key_array = np.fromiter(map(int, keys), dtype=np.int64, count=len(keys))
+        decoded = json.loads('[' + ','.join(values) + ']')
+        buffer = buffers[attribute]
+        offset = buffer.size
+        buffer.append(convert(attribute, decoded))
+
+        if positions is None:
+            first_keys.append(key_array)
+            return
+        if attribute not in own_keys:
+            if np.array_equal(positions[offset:offset + len(key_array)], key_array):
+                return
+            # Keys diverge from the first attribute's; track them separately from here on
+            own_keys[attribute] = ColumnBuffer()
+            own_keys[attribute].append(positions[:offset])
+        own_keys[attribute].append(key_array)
+
+    with open(json_file_path, 'r', encoding='utf-8') as file:
+        for keys, values in _iter_entries(file, chunk_size):
+            start = 0
+            while start < len(values):
+                try:
+                    header = values.index('{', start)
+                except ValueError:
+                    header = len(values)
+                if header > start:
+                    if attribute is None:
+                        raise ValueError("Playlist JSON must map attributes to row objects")
+                    append(keys[start:header], values[start:header])
+                if header < len(values):
+                    if attribute is not None and positions is None:
+                        positions = first_keys.finish()
+                    attribute = _decode_key(keys[header])
+                    buffers[attribute] = ColumnBuffer(0 if positions is None else len(positions))
+                start = header + 1
+
+    if positions is None:
+        positions = first_keys.finish().astype(np.int64)
+
+    columns = {attribute: buffer.finish() for attribute, buffer in buffers.items()}
+    logger.info(f"Streamed {len(columns)} attributes with {len(positions)} rows")
+
+    column_keys = {attribute: own_keys[attribute].finish() if attribute in own_keys else positions
+                   for attribute in columns}
+    return align_columns(columns, column_keys) if columns else {'index': positions}
@@ -2,16 +2,38 @@
 """
 FastAPI backend for playlist data API
 """
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
-import pandas as pd
-import uvicorn
-import os
-import logging
-from data_processor import PlaylistDataProcessor
+import time
+# Startup is timed from here, before the heavy imports below; they follow this
+# statement on purpose, hence their noqa: E402
+IMPORTS_STARTED = time.perf_counter()
+
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Request, WebSocket, WebSocketDisconnect  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
+from fastapi.responses import JSONResponse, Response, StreamingResponse  # noqa: E402
+from pydantic import BaseModel, Field  # noqa: E402
+from typing import Callable, Iterator, List, Dict, Any, Optional, Tuple  # noqa: E402
+import numpy as np  # noqa: E402
+import asyncio  # noqa: E402
+import json  # noqa: E402
+import hmac  # noqa: E402
+import os  # noqa: E402
+import logging  # noqa: E402
+import threading  # noqa: E402
+from column_stats import merge_summaries  # noqa: E402
+from compact import to_python_list  # noqa: E402
+from data_processor import PlaylistDataProcessor  # noqa: E402
+from metrics import SIZE_BUCKETS, HTTPMetricsMiddleware, MetricFamily, MetricsRegistry, process_metrics  # noqa: E402
+from playlist_registry import PlaylistRegistry  # noqa: E402
+from profiler import SamplingProfiler  # noqa: E402
+from rating_feed import RatingFeed  # noqa: E402
+from rating_store import RatingStore  # noqa: E402
+from reloader import PlaylistReloader  # noqa: E402
+from response_cache import MIN_COMPRESS_BYTES, ResponseCache, negotiate_encoding  # noqa: E402
+from export import EXPORT_FORMATS, gzip_chunks, iter_export, select_columns  # noqa: E402
+from song_query import parse_filter  # noqa: E402
+
+IMPORTS_FINISHED = time.perf_counter()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -29,9 +51,151 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global data processor instance
+# Global data processor instance; a reload replaces it with a single assignment
 processor = None
 
+# Rebuilds the processor when asked or when playlist.json changes
+reloader = None
+
+# Serves the playlists of PLAYLIST_DIR under /api/playlists/{name}, when it is set
+registry = None
+
+# 'loading' until the dataset is served, then 'ready'; 'failed' if loading it raised, with the error here
+startup_status = 'loading'
+startup_error = None
+# Seconds spent in each startup phase; 'ready' is the time from the first import to serving the dataset
+startup_timings: Dict[str, float] = {}
+
+# The playlist to serve: a playlist.json-shaped file, or a directory of such shard files
+PLAYLIST_SOURCE = os.environ.get('PLAYLIST_SOURCE', os.path.join(os.path.dirname(__file__), '..', 'assets', 'playlist.json'))
+
+# How startup reads playlist.json: 'memory' (json.load), 'streaming' (chunked parser) or 'parallel' (process pool)
+PLAYLIST_LOAD_MODE = os.environ.get('PLAYLIST_LOAD_MODE', 'memory')
+
+# Worker processes of the parallel load mode; 0 starts one per CPU
+PLAYLIST_INGEST_WORKERS = int(os.environ.get('PLAYLIST_INGEST_WORKERS', '0'))
+
+# Accept requests right away and load the dataset on a background thread, building the search indexes last
+PLAYLIST_BACKGROUND_LOAD = os.environ.get('PLAYLIST_BACKGROUND_LOAD', '0') == '1'
+
+# Where normalized binary snapshots are cached between starts; set to an empty string to disable
+PLAYLIST_CACHE_DIR = os.environ.get('PLAYLIST_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache'))
+
+# With several workers, map one published snapshot and one shared rating column instead of a copy each
+PLAYLIST_SHARED = os.environ.get('PLAYLIST_SHARED', '0') == '1'
+
+# Hold the dataset in narrow dtypes and Arrow strings (see compact.py) to cut its memory severalfold
+PLAYLIST_COMPACT = os.environ.get('PLAYLIST_COMPACT', '0') == '1'
+
+# Where rating writes are logged so they survive restarts; set to an empty string to keep ratings in memory only
+PLAYLIST_RATINGS_DIR = os.environ.get('PLAYLIST_RATINGS_DIR', os.path.join(os.path.dirname(__file__), 'ratings'))
+
+# How long a rating write waits for the disk: 'none', 'batch' (background fsync) or 'sync' (group commit)
+PLAYLIST_RATINGS_DURABILITY = os.environ.get('PLAYLIST_RATINGS_DURABILITY', 'batch')
+
+# Seconds between checks of playlist.json for changes to reload; 0 disables watching
+PLAYLIST_RELOAD_INTERVAL = float(os.environ.get('PLAYLIST_RELOAD_INTERVAL', '0'))
+
+# When set, the admin endpoints require this value in the X-Admin-Token header
+PLAYLIST_ADMIN_TOKEN = os.environ.get('PLAYLIST_ADMIN_TOKEN', '')
+
+# Most encoded GET responses kept for reuse, and the memory they may take; 0 entries disables the cache
+PLAYLIST_RESPONSE_CACHE_ENTRIES = int(os.environ.get('PLAYLIST_RESPONSE_CACHE_ENTRIES', '1024'))
+PLAYLIST_RESPONSE_CACHE_MB = float(os.environ.get('PLAYLIST_RESPONSE_CACHE_MB', '64'))
+
+# Encoded responses of the read endpoints, reused until a rating write or reload changes the data
+response_cache = (ResponseCache(PLAYLIST_RESPONSE_CACHE_ENTRIES, int(PLAYLIST_RESPONSE_CACHE_MB * 1024 * 1024))
+                  if PLAYLIST_RESPONSE_CACHE_ENTRIES > 0 else None)
+
+# Directory of <name>.json playlists served under /api/playlists/{name}, loaded on first use; unset disables them
+PLAYLIST_DIR = os.environ.get('PLAYLIST_DIR', '')
+
+# Memory the loaded playlists of PLAYLIST_DIR may hold before the least recently used are unloaded
+PLAYLIST_MEMORY_BUDGET_MB = float(os.environ.get('PLAYLIST_MEMORY_BUDGET_MB', '1024'))
+
+# Milliseconds of rating writes coalesced into one batch pushed to live subscribers
+PLAYLIST_RATING_FEED_WINDOW_MS = float(os.environ.get('PLAYLIST_RATING_FEED_WINDOW_MS', '100'))
+
+# In shared mode, milliseconds between checks of the shared rating column for every worker's writes
+PLAYLIST_RATING_FEED_POLL_MS = float(os.environ.get('PLAYLIST_RATING_FEED_POLL_MS', '100'))
+
+# Allow admins to run the sampling profiler over a time window; off by default
+PLAYLIST_PROFILING = os.environ.get('PLAYLIST_PROFILING', '0') == '1'
+
+# The profiler currently sampling, if any; only one runs at a time
+active_profiler = None
+
+# Served at /metrics in the Prometheus text format
+metrics_registry = MetricsRegistry()
+http_requests = metrics_registry.counter(
+    'playlist_http_requests_total', 'HTTP requests by method, route and status.', ['method', 'path', 'status'])
+http_latency = metrics_registry.histogram(
+    'playlist_http_request_duration_seconds', 'Time to serve a request, until its last byte is sent.', ['method', 'path'])
+http_response_sizes = metrics_registry.histogram(
+    'playlist_http_response_size_bytes', 'Bytes of response body sent.', ['method', 'path'], buckets=SIZE_BUCKETS)
+
+# Outermost, so the time spent in the other middleware counts too
+app.add_middleware(HTTPMetricsMiddleware, requests=http_requests, latency=http_latency, sizes=http_response_sizes)
+
+def collect_playlist_metrics() -> List[MetricFamily]:
+    """Dataset, load, reload and response cache metrics, read from where they are kept"""
+    families = []
+    if processor is not None and processor.columns is not None:
+        families.append(MetricFamily('playlist_songs', 'gauge', 'Songs in the served dataset.')
+                        .add(len(processor.columns['index'])))
+        phases = MetricFamily('playlist_load_phase_seconds', 'gauge',
+                              'Seconds spent in each phase of loading the served dataset.')
+        for phase, seconds in processor.load_timings.items():
+            phases.add(seconds, phase=phase)
+        families.append(phases)
+    if startup_timings:
+        startup = MetricFamily('playlist_startup_phase_seconds', 'gauge',
+                               'Seconds spent in each phase of starting the server; ready is the total to serving.')
+        for phase, seconds in list(startup_timings.items()):
+            startup.add(seconds, phase=phase)
+        families.append(startup)
+    if reloader is not None:
+        status = reloader.status
+        families.append(MetricFamily('playlist_reloads_total', 'counter', 'Completed reloads of the dataset.')
+                        .add(status['reloads']))
+        if status['duration_s'] is not None:
+            families.append(MetricFamily('playlist_last_reload_seconds', 'gauge', 'Duration of the last completed reload.')
+                            .add(status['duration_s']))
+    if response_cache is not None:
+        stats = response_cache.stats()
+        for name, help in (('hits', 'Response cache lookups that found an entry.'),
+                           ('misses', 'Response cache lookups that found no entry.'),
+                           ('not_modified', 'Conditional requests answered with 304 Not Modified.'),
+                           ('evictions', 'Response cache entries evicted to stay within its limits.')):
+            families.append(MetricFamily(f'playlist_response_cache_{name}_total', 'counter', help).add(stats[name]))
+        families.append(MetricFamily('playlist_response_cache_entries', 'gauge', 'Responses in the cache.')
+                        .add(stats['entries']))
+        families.append(MetricFamily('playlist_response_cache_bytes', 'gauge', 'Bytes of responses in the cache.')
+                        .add(stats['bytes']))
+        if stats['hit_ratio'] is not None:
+            families.append(MetricFamily('playlist_response_cache_hit_ratio', 'gauge',
+                                         'Fraction of response cache lookups that were hits.').add(stats['hit_ratio']))
+    if registry is not None:
+        status = registry.status()
+        families.append(MetricFamily('playlist_registry_loaded', 'gauge', 'Playlists of PLAYLIST_DIR held in memory.')
+                        .add(len(status['loaded'])))
+        families.append(MetricFamily('playlist_registry_bytes', 'gauge', 'Bytes held by the loaded playlists.')
+                        .add(status['bytes']))
+        families.append(MetricFamily('playlist_registry_loads_total', 'counter', 'Playlists loaded on first use.')
+                        .add(status['loads']))
+        families.append(MetricFamily('playlist_registry_evictions_total', 'counter',
+                                     'Playlists unloaded to stay within the memory budget.').add(status['evictions']))
+    families.append(MetricFamily('playlist_rating_feed_subscribers', 'gauge', 'Clients subscribed to live rating updates.')
+                    .add(rating_feed.subscribers))
+    families.append(MetricFamily('playlist_rating_feed_batches_total', 'counter', 'Batches of rating updates pushed.')
+                    .add(rating_feed.batches))
+    families.append(MetricFamily('playlist_rating_feed_updates_total', 'counter',
+                                 'Song ratings pushed, after coalescing repeated writes within a batch.').add(rating_feed.updates))
+    return families
+
+metrics_registry.add_collector(collect_playlist_metrics)
+metrics_registry.add_collector(process_metrics)
+
 # Pydantic models
 class Song(BaseModel):
     index: int
@@ -55,89 +219,331 @@ class Song(BaseModel):
     star_rating: int = 0
     duration_s: Optional[float] = None
 
+SONG_FIELDS = list(Song.model_fields)
+_INT_SONG_FIELDS = {name for name, field in Song.model_fields.items() if field.annotation is int}
+
+def dumps_json(content: Any) -> bytes:
+    """Encode content exactly like FastAPI's default JSONResponse"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def encode_song_records(columns: Dict[str, Any], positions) -> List[Dict[str, Any]]:
+    """Build Song-shaped dicts for the rows at positions (an array or slice), without pydantic"""
+    num_rows = len(columns['index'][positions])
+    values = []
+    for name in SONG_FIELDS:
+        if name in columns:
+            column = columns[name][positions]
+            if name in _INT_SONG_FIELDS and column.dtype.kind == 'f':
+                if np.isnan(column).any():
+                    raise ValueError(f"Column '{name}' has missing values")
+                column = column.astype(np.int64)
+            values.append(to_python_list(column))
+        elif not Song.model_fields[name].is_required():
+            values.append([Song.model_fields[name].default] * num_rows)
+        else:
+            raise ValueError(f"Column '{name}' is missing from the dataset")
+    return [dict(zip(SONG_FIELDS, row)) for row in zip(*values)]
+
 class RatingUpdate(BaseModel):
     song_id: str
     rating: int
 
+class BulkRatingUpdate(BaseModel):
+    ratings: List[RatingUpdate] = Field(..., max_length=10000)
+
+class BatchSongLookup(BaseModel):
+    ids: List[str] = Field(..., max_length=10000)
+
+class BatchTitleSearch(BaseModel):
+    titles: List[str] = Field(..., max_length=10000)
+    limit: int = Field(1, ge=1, le=100)
+
 class PaginatedResponse(BaseModel):
     songs: List[Song]
     total: int
     page: int
     size: int
     total_pages: int
+    next_cursor: Optional[str] = None
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize data processor on startup"""
+def cached_json_response(request: Request, processor: PlaylistDataProcessor, snapshot, build: Callable[[], Any]) -> Response:
+    """Serve build()'s JSON from the response cache, answering conditional GETs and compressing when accepted
+    
+    The cache entry is tagged with the data version of snapshot, which
+    build must read from. In shared mode other workers write ratings without
+    bumping this one's version, so nothing is cached.
+    """
+    if response_cache is None or processor.shared:
+        return Response(content=dumps_json(build()), media_type="application/json")
+    
+    key = ResponseCache.make_key(request.url.path, request.query_params.multi_items())
+    version = processor.data_version(snapshot)
+    entry = response_cache.get(key, version)
+    if entry is None:
+        entry = response_cache.put(key, version, dumps_json(build()))
+    
+    headers = entry.headers()
+    if entry.not_modified(request.headers.get('if-none-match'), request.headers.get('if-modified-since')):
+        response_cache.count_not_modified()
+        return Response(status_code=304, headers=headers)
+    
+    encoding = negotiate_encoding(request.headers.get('accept-encoding')) if len(entry.body) >= MIN_COMPRESS_BYTES else None
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return Response(content=response_cache.encode(entry, encoding), media_type="application/json", headers=headers)
+
+def current_processor() -> PlaylistDataProcessor:
+    """The processor a request uses from start to finish, even if a reload publishes a new one meanwhile"""
+    return processor
+
+def publish_processor(new_processor: PlaylistDataProcessor):
+    """Serve new requests from new_processor"""
     global processor
+    processor = new_processor
+
+def playlist_processor(name: str) -> PlaylistDataProcessor:
+    """The processor of playlist name from PLAYLIST_DIR, loading it if needed"""
+    if registry is None:
+        raise HTTPException(status_code=404, detail="Multiple playlists are not enabled; set PLAYLIST_DIR")
     try:
-        json_path = os.path.join(os.path.dirname(__file__), '..', 'assets', 'playlist.json')
-        processor = PlaylistDataProcessor(json_path)
-        processor.load_and_normalize()
-        logger.info("Data processor initialized successfully")
+        return registry.get(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Playlist '{name}' not found")
     except Exception as e:
+        logger.error(f"Error loading playlist '{name}': {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to load playlist '{name}': {str(e)}")
+
+# A playlist's first request loads it, so this runs in the thread pool
+def request_processor(request: Request) -> PlaylistDataProcessor:
+    """The playlist a dataset route serves: the default one under /api, or the named one under /api/playlists/{name}"""
+    name = request.path_params.get('name')
+    if name is None:
+        loaded = current_processor()
+        if loaded is None:
+            raise HTTPException(status_code=503, detail="The dataset is still loading", headers={'Retry-After': '1'})
+        return loaded
+    return playlist_processor(name)
+
+async def indexes_built(processor: PlaylistDataProcessor):
+    """Wait, off the event loop, for indexes a background load builds after serving starts"""
+    if not processor.indexes_ready.is_set():
+        await asyncio.to_thread(processor.indexes_ready.wait)
+
+def live_rating_stats() -> Optional[Dict[str, Any]]:
+    """What a live rating batch carries besides ratings: the song count and rating statistics, shaped like /api/stats"""
+    loaded = current_processor()
+    if loaded is None:
+        return None
+    return {'total_songs': len(loaded.columns['index']), 'statistics': {'star_rating': loaded.stats.summary('star_rating')}}
+
+def shared_rating_changes() -> List[Tuple[str, int]]:
+    """Rating writes to the default playlist's shared rating column, by any worker, since the last call"""
+    loaded = current_processor()
+    return [] if loaded is None else loaded.shared_rating_changes()
+
+# Pushes the default playlist's rating writes to WebSocket subscribers; see /api/songs/ratings/live
+rating_feed = RatingFeed(PLAYLIST_RATING_FEED_WINDOW_MS / 1000, stats=live_rating_stats)
+
+# The dataset routes, served for the default playlist under /api and for each playlist under /api/playlists/{name}
+playlist_router = APIRouter()
+
+def load_dataset():
+    """Load the dataset, replay its ratings and serve it, then start the reloader, timing each phase
+    
+    In background mode the title and similarity indexes are built once
+    everything else is being served.
+    """
+    global reloader, registry, startup_status, startup_error
+    mark = time.perf_counter()
+    
+    def phase_done(phase: str):
+        nonlocal mark
+        now = time.perf_counter()
+        startup_timings[phase] = now - mark
+        mark = now
+    
+    try:
+        if PLAYLIST_DIR:
+            registry = PlaylistRegistry(
+                PLAYLIST_DIR, int(PLAYLIST_MEMORY_BUDGET_MB * 1024 * 1024),
+                ratings_dir=os.path.join(PLAYLIST_RATINGS_DIR, 'playlists') if PLAYLIST_RATINGS_DIR else None,
+                ratings_durability=PLAYLIST_RATINGS_DURABILITY, load_mode=PLAYLIST_LOAD_MODE,
+                cache_dir=PLAYLIST_CACHE_DIR or None, compact=PLAYLIST_COMPACT,
+                ingest_workers=PLAYLIST_INGEST_WORKERS or None)
+            logger.info(f"Serving {len(registry.names())} playlists from {PLAYLIST_DIR}")
+        
+        loaded = PlaylistDataProcessor(PLAYLIST_SOURCE, load_mode=PLAYLIST_LOAD_MODE,
+                                       cache_dir=PLAYLIST_CACHE_DIR or None, shared=PLAYLIST_SHARED,
+                                       compact=PLAYLIST_COMPACT, ingest_workers=PLAYLIST_INGEST_WORKERS or None)
+        loaded.load_and_normalize(defer_indexes=PLAYLIST_BACKGROUND_LOAD)
+        phase_done('dataset')
+        
+        if PLAYLIST_RATINGS_DIR and PLAYLIST_SHARED:
+            logger.warning("Rating log disabled in shared mode; ratings live in the shared rating column")
+        elif PLAYLIST_RATINGS_DIR:
+            # Replay logged ratings before serving, then log every new rating write
+            store = RatingStore(PLAYLIST_RATINGS_DIR, durability=PLAYLIST_RATINGS_DURABILITY)
+            loaded.attach_rating_store(store)
+            phase_done('ratings')
+        
+        # In shared mode the feed polls the shared rating column instead, which has every worker's writes
+        if not PLAYLIST_SHARED:
+            loaded.rating_feed = rating_feed
+        publish_processor(loaded)
+        reloader = PlaylistReloader(current_processor, publish_processor)
+        if PLAYLIST_RELOAD_INTERVAL > 0:
+            reloader.watch(PLAYLIST_RELOAD_INTERVAL)
+        startup_status = 'ready'
+        startup_timings['ready'] = time.perf_counter() - IMPORTS_STARTED
+        
+        phases = ', '.join(f"{phase} {seconds:.3f}s" for phase, seconds in startup_timings.items())
+        logger.info(f"Serving {len(loaded.columns['index'])} songs; startup: {phases}")
+        
+        if PLAYLIST_BACKGROUND_LOAD:
+            loaded.build_indexes()
+            phase_done('indexes')
+            logger.info(f"Built the title and similarity indexes in {startup_timings['indexes']:.3f}s")
+    except Exception as e:
+        if startup_status != 'ready':
+            startup_status, startup_error = 'failed', str(e)
         logger.error(f"Failed to initialize data processor: {str(e)}")
         raise
 
+def load_dataset_in_background():
+    try:
+        load_dataset()
+    except Exception:
+        pass  # Logged by load_dataset and reported by /health/ready
+
+@app.on_event("startup")
+async def startup_event():
+    """Load the dataset before serving, or start loading it in the background with PLAYLIST_BACKGROUND_LOAD"""
+    startup_timings['imports'] = IMPORTS_FINISHED - IMPORTS_STARTED
+    startup_timings['app'] = time.perf_counter() - IMPORTS_FINISHED
+    rating_feed.start(asyncio.get_running_loop())
+    if PLAYLIST_SHARED:
+        rating_feed.poll(shared_rating_changes, PLAYLIST_RATING_FEED_POLL_MS / 1000)
+    if PLAYLIST_BACKGROUND_LOAD:
+        threading.Thread(target=load_dataset_in_background, name='dataset-loader', daemon=True).start()
+    else:
+        load_dataset()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """End live rating subscriptions and stop watching for changes, then flush and close the rating logs"""
+    rating_feed.close()
+    if reloader is not None:
+        reloader.close()
+    if registry is not None:
+        registry.close()
+    if processor is not None and processor.rating_store is not None:
+        processor.rating_store.close()
+
 @app.get("/")
 async def root():
     """Root endpoint"""
     return {"message": "Playlist API is running", "version": "1.0.0"}
 
-@app.get("/api/songs", response_model=PaginatedResponse)
+@app.get("/health/live")
+async def liveness():
+    """Whether the process is serving; fails only once loading the dataset has failed, as a restart is needed"""
+    if startup_status == 'failed':
+        return JSONResponse({'status': 'failed', 'error': startup_error}, status_code=503)
+    return {'status': 'alive'}
+
+@app.get("/health/ready")
+async def readiness():
+    """Whether the dataset is served, with the time each startup phase took so far"""
+    body = {'status': startup_status, 'timings': startup_timings}
+    if startup_status == 'failed':
+        body['error'] = startup_error
+    loaded = current_processor()
+    if loaded is not None:
+        body['indexes'] = 'ready' if loaded.indexes_ready.is_set() else 'building'
+    if startup_status == 'ready':
+        return body
+    return JSONResponse(body, status_code=503, headers={'Retry-After': '1'} if startup_status == 'loading' else None)
+
+@playlist_router.get("/songs", response_model=PaginatedResponse)
 async def get_all_songs(
+    request: Request,
     page: int = Query(1, ge=1, description="Page number (1-indexed)"),
-    size: int = Query(10, ge=1, le=100, description="Number of items per page")
+    size: int = Query(10, ge=1, le=100, description="Number of items per page"),
+    sort_by: Optional[str] = Query(None, description="Column to sort by, e.g. 'energy' or 'title'"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="Sort direction"),
+    filter: Optional[List[str]] = Query(None, description="Numeric range filters such as 'energy>0.7'; repeat to combine"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; takes precedence over page"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
 ):
-    """Get all songs with pagination"""
+    """Get all songs with pagination, optional sorting, filtering and keyset cursors"""
     try:
-        df = processor.get_normalized_data()
-        total = len(df)
+        # One snapshot for the whole request, so concurrent rating writes never show up half-applied
+        snapshot = processor.snapshot()
+        columns = snapshot.columns
         
-        # Calculate pagination
-        start_idx = (page - 1) * size
-        end_idx = start_idx + size
-        
-        # Get paginated data
-        paginated_df = df.iloc[start_idx:end_idx]
-        
-        # Convert to list of dictionaries
-        songs = []
-        for _, row in paginated_df.iterrows():
-            song_dict = row.to_dict()
-            # Ensure all required fields are present
-            if 'duration_s' not in song_dict:
-                song_dict['duration_s'] = song_dict.get('duration_ms', 0) / 1000
-            songs.append(Song(**song_dict))
-        
-        total_pages = (total + size - 1) // size  # Ceiling division
+        def build():
+            try:
+                filters = [parse_filter(expression) for expression in filter or []]
+                
+                # Calculate pagination
+                start_idx = (page - 1) * size
+                
+                positions, total, next_cursor = processor.query.page(
+                    sort_by, order == "desc", filters, start_idx, size, cursor, snapshot
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            total_pages = (total + size - 1) // size  # Ceiling division
+            
+            # Encode the page straight from the column arrays; the output matches
+            # what response_model=PaginatedResponse would produce for the same rows
+            return {
+                'songs': encode_song_records(columns, positions),
+                'total': total,
+                'page': page,
+                'size': size,
+                'total_pages': total_pages,
+                'next_cursor': next_cursor
+            }
         
-        return PaginatedResponse(
-            songs=songs,
-            total=total,
-            page=page,
-            size=size,
-            total_pages=total_pages
-        )
+        return cached_json_response(request, processor, snapshot, build)
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving songs: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/songs/search")
-async def search_song_by_title(title: str = Query(..., description="Song title to search for")):
+@playlist_router.get("/songs/search")
+async def search_song_by_title(
+    request: Request,
+    title: str = Query(..., description="Song title to search for"),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Return up to this many ranked matches instead of the first one"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
     """Search for a song by title"""
     try:
-        song = processor.get_song_by_title(title)
-        
-        if song is None:
-            raise HTTPException(status_code=404, detail=f"No song found with title containing '{title}'")
+        await indexes_built(processor)
+        snapshot = processor.snapshot()
         
-        # Ensure duration_s field exists
-        if 'duration_s' not in song:
-            song['duration_s'] = song.get('duration_ms', 0) / 1000
+        def build():
+            if limit is not None:
+                songs = processor.search_songs(title, limit, snapshot)
+                return jsonable_encoder([Song(**song) for song in songs])
+            
+            song = processor.get_song_by_title(title, snapshot)
             
-        return Song(**song)
+            if song is None:
+                raise HTTPException(status_code=404, detail=f"No song found with title containing '{title}'")
+            
+            # Ensure duration_s field exists
+            if 'duration_s' not in song:
+                song['duration_s'] = song.get('duration_ms', 0) / 1000
+                
+            return jsonable_encoder(Song(**song))
+        
+        return cached_json_response(request, processor, snapshot, build)
     
     except HTTPException:
         raise
@@ -145,8 +551,118 @@ async def search_song_by_title(title: str = Query(..., description="Song title t
         logger.error(f"Error searching for song: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/songs/rating")
-async def update_song_rating(rating_update: RatingUpdate):
+@playlist_router.get("/songs/{song_id}/similar")
+async def get_similar_songs(
+    request: Request,
+    song_id: str,
+    k: int = Query(10, ge=1, le=100, description="Number of similar songs to return"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Get the k songs with the closest audio features, nearest first"""
+    try:
+        await indexes_built(processor)
+        snapshot = processor.snapshot()
+        
+        def build():
+            try:
+                result = processor.similar_songs(song_id, k)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            if result is None:
+                raise HTTPException(status_code=404, detail=f"Song with ID '{song_id}' not found")
+            
+            positions, distances = result
+            songs = encode_song_records(snapshot.columns, positions)
+            for song, distance in zip(songs, distances.tolist()):
+                song['distance'] = distance
+            
+            return {'song_id': song_id, 'features': processor.similarity.features, 'songs': songs}
+        
+        return cached_json_response(request, processor, snapshot, build)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error finding similar songs: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch results are encoded this many queries at a time, so a streamed batch starts sending early
+BATCH_CHUNK_SIZE = 1000
+
+def iter_id_results(columns: Dict[str, Any], song_ids: List[str], positions: np.ndarray) -> Iterator[List[Dict[str, Any]]]:
+    """One {id, song} result per requested id, song null when it is not found, in chunks"""
+    for start in range(0, len(song_ids), BATCH_CHUNK_SIZE):
+        chunk = positions[start:start + BATCH_CHUNK_SIZE]
+        found = chunk >= 0
+        songs = iter(encode_song_records(columns, chunk[found]))
+        yield [{'id': song_id, 'song': next(songs) if ok else None}
+               for song_id, ok in zip(song_ids[start:start + BATCH_CHUNK_SIZE], found.tolist())]
+
+def iter_title_results(columns: Dict[str, Any], titles: List[str], matches: List[List[int]]) -> Iterator[List[Dict[str, Any]]]:
+    """One {title, songs} result per requested title, best matches first, in chunks"""
+    for start in range(0, len(titles), BATCH_CHUNK_SIZE):
+        chunk = matches[start:start + BATCH_CHUNK_SIZE]
+        rows = np.fromiter((row for rows in chunk for row in rows), dtype=np.int64)
+        songs = iter(encode_song_records(columns, rows))
+        yield [{'title': title, 'songs': [next(songs) for _ in rows]}
+               for title, rows in zip(titles[start:start + BATCH_CHUNK_SIZE], chunk)]
+
+def batch_response(request: Request, chunks: Iterator[List[Dict[str, Any]]], response_format: Optional[str]) -> Response:
+    """All results in one JSON object, or streamed one per line as NDJSON when asked for
+    
+    NDJSON is chosen with format=ndjson or an Accept header naming application/x-ndjson.
+    """
+    if response_format is None:
+        response_format = 'ndjson' if 'application/x-ndjson' in request.headers.get('accept', '') else 'json'
+    if response_format == 'ndjson':
+        lines = (b''.join(dumps_json(result) + b'\n' for result in chunk) for chunk in chunks)
+        return StreamingResponse(lines, media_type='application/x-ndjson')
+    return Response(dumps_json({'results': [result for chunk in chunks for result in chunk]}),
+                    media_type='application/json')
+
+# Batches are resolved and encoded in the thread pool, keeping the event loop free for other requests
+@playlist_router.post("/songs/batch")
+def get_songs_batch(
+    request: Request,
+    lookup: BatchSongLookup,
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$", description="json, or ndjson to stream one result per line"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Fetch many songs by id in one call"""
+    try:
+        snapshot = processor.snapshot()
+        positions = processor.find_songs(lookup.ids)
+        return batch_response(request, iter_id_results(snapshot.columns, lookup.ids, positions), format)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error fetching songs: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@playlist_router.post("/songs/search/batch")
+def search_songs_batch(
+    request: Request,
+    search: BatchTitleSearch,
+    format: Optional[str] = Query(None, pattern="^(json|ndjson)$", description="json, or ndjson to stream one result per line"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Search for many titles in one call, like /api/songs/search with limit for each"""
+    try:
+        snapshot = processor.snapshot()
+        matches = processor.search_titles(search.titles, search.limit)
+        return batch_response(request, iter_title_results(snapshot.columns, search.titles, matches), format)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching for songs: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Rating writes may wait for an fsync, so they run in the thread pool rather than on the event loop
+@playlist_router.post("/songs/rating")
+def update_song_rating(rating_update: RatingUpdate, processor: PlaylistDataProcessor = Depends(request_processor)):
     """Update star rating for a song"""
     try:
         if not (1 <= rating_update.rating <= 5):
@@ -165,55 +681,405 @@ async def update_song_rating(rating_update: RatingUpdate):
         logger.error(f"Error updating rating: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/export/csv")
-async def export_to_csv():
-    """Export all data to CSV file"""
+@playlist_router.post("/songs/ratings")
+def update_song_ratings(bulk_update: BulkRatingUpdate, processor: PlaylistDataProcessor = Depends(request_processor)):
+    """Update star ratings for many songs in one call"""
     try:
-        df = processor.get_normalized_data()
+        song_ids = [update.song_id for update in bulk_update.ratings]
+        ratings = [update.rating for update in bulk_update.ratings]
+        
+        try:
+            not_found = processor.update_star_ratings(song_ids, ratings)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Create temp directory if it doesn't exist
-        temp_dir = os.path.join(os.path.dirname(__file__), 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
+        return {"message": "Ratings updated successfully", "updated": len(song_ids) - len(not_found), "not_found": not_found}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error updating ratings: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def current_ratings(loaded: PlaylistDataProcessor, song_ids: List[str]) -> Dict[str, int]:
+    """The rating of each of song_ids that is in the dataset"""
+    snapshot = loaded.snapshot()
+    positions = loaded.find_songs(song_ids)
+    found = positions >= 0
+    found_ids = [song_id for song_id, ok in zip(song_ids, found.tolist()) if ok]
+    return dict(zip(found_ids, snapshot.columns['star_rating'][positions[found]].tolist()))
+
+def parse_subscription(text: str) -> Tuple[Optional[List[str]], bool]:
+    """The song ids, or None for every song, and the stats flag of a subscribe message"""
+    try:
+        message = json.loads(text)
+    except ValueError:
+        raise ValueError("Messages must be JSON")
+    if not isinstance(message, dict) or 'subscribe' not in message:
+        raise ValueError('Expected {"subscribe": [song ids] or null, "stats": true or false}')
+    song_ids, stats = message['subscribe'], message.get('stats', True)
+    if song_ids is not None and not (isinstance(song_ids, list) and all(isinstance(song_id, str) for song_id in song_ids)):
+        raise ValueError("subscribe must be a list of song ids, or null for every song")
+    if not isinstance(stats, bool):
+        raise ValueError("stats must be true or false")
+    return song_ids, stats
+
+@app.websocket("/api/songs/ratings/live")
+async def live_ratings(websocket: WebSocket):
+    """Push rating changes of the subscribed songs, and the rating statistics, in batches as they happen"""
+    await websocket.accept()
+    if current_processor() is None:
+        await websocket.close(code=1013, reason="The dataset is still loading")
+        return
+    
+    # Watches nothing until the client says which songs it shows
+    subscription = rating_feed.subscribe([], stats=False)
+    receiving = asyncio.ensure_future(websocket.receive_text())
+    updating = asyncio.ensure_future(subscription.next())
+    try:
+        # One task both reads and writes the socket, so messages go out in the order they are made
+        while True:
+            done, _ = await asyncio.wait({receiving, updating}, return_when=asyncio.FIRST_COMPLETED)
+            if updating in done:
+                message = updating.result()
+                if message is None:
+                    # The feed was closed: the server is shutting down
+                    await websocket.close(code=1001)
+                    break
+                await websocket.send_text(message)
+                updating = asyncio.ensure_future(subscription.next())
+            if receiving in done:
+                text = receiving.result()
+                receiving = asyncio.ensure_future(websocket.receive_text())
+                try:
+                    song_ids, stats = parse_subscription(text)
+                    rating_feed.watch(subscription, song_ids, stats)
+                except ValueError as e:
+                    await websocket.send_text(json.dumps({'type': 'error', 'detail': str(e)}))
+                    continue
+                # Read after watching, so no write falls between the two
+                if song_ids:
+                    subscription.include(current_ratings(current_processor(), song_ids))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiving.cancel()
+        updating.cancel()
+        rating_feed.unsubscribe(subscription)
+
+@playlist_router.get("/charts/histogram")
+async def get_histogram(
+    request: Request,
+    column: str = Query(..., description="Numeric column to bin, e.g. 'duration_s'"),
+    edges: Optional[List[float]] = Query(None, description="Bin edges in increasing order; repeat for each edge"),
+    bins: int = Query(10, ge=1, le=1000, description="Number of equal-width bins when no edges are given"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Get a histogram of a numeric column"""
+    try:
+        snapshot = processor.snapshot()
+        
+        def build():
+            try:
+                return processor.aggregates.histogram(column, edges, bins, snapshot)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        return cached_json_response(request, processor, snapshot, build)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error computing histogram: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@playlist_router.get("/charts/scatter")
+async def get_scatter(
+    request: Request,
+    x: str = Query("index", description="Numeric column for the x axis"),
+    y: str = Query(..., description="Numeric column for the y axis"),
+    method: str = Query("lttb", pattern="^(lttb|grid)$", description="'lttb' downsampling or 'grid' density counts"),
+    max_points: int = Query(200, ge=3, le=5000, description="Upper bound on the number of points returned"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Get a scatter plot of two numeric columns reduced to at most max_points points"""
+    try:
+        snapshot = processor.snapshot()
         
-        csv_path = os.path.join(temp_dir, 'playlist_export.csv')
-        df.to_csv(csv_path, index=False)
+        def build():
+            try:
+                return processor.aggregates.scatter(x, y, max_points, method, snapshot)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
-        return FileResponse(
-            path=csv_path,
-            filename="playlist_data.csv",
-            media_type="text/csv"
-        )
+        return cached_json_response(request, processor, snapshot, build)
     
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error computing scatter: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def export_response(processor: PlaylistDataProcessor, export_format: str, columns: Optional[List[str]], filter: Optional[List[str]],
+                    compression: Optional[str]) -> StreamingResponse:
+    """Stream the normalized data in export_format, encoded chunk by chunk while it is sent"""
+    # The export streams from one snapshot, unaffected by rating writes made while it runs
+    snapshot = processor.snapshot()
+    data = snapshot.columns
+    
+    try:
+        names = select_columns(data, columns)
+        filters = [parse_filter(expression) for expression in filter or []]
+        positions = processor.query.positions(None, filters, snapshot)[0] if filters else None
+        chunks = iter_export(export_format, data, names, positions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    
+    extension, media_type, binary = EXPORT_FORMATS[export_format]
+    filename = f"playlist_data.{extension}"
+    if compression == "gzip":
+        if binary:
+            raise HTTPException(status_code=400, detail=f"{export_format} export is already compressed")
+        chunks = gzip_chunks(chunks)
+        filename, media_type = f"{filename}.gz", "application/gzip"
+    
+    # Nothing is written to disk, so concurrent exports never share state
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@playlist_router.get("/export")
+async def export_data(
+    format: str = Query("csv", pattern="^(csv|ndjson|arrow|parquet)$", description="csv, ndjson, arrow (IPC stream) or parquet"),
+    columns: Optional[List[str]] = Query(None, description="Columns to export, repeated or comma-separated; defaults to all"),
+    filter: Optional[List[str]] = Query(None, description="Numeric range filters such as 'energy>0.7'; repeat to combine"),
+    compression: Optional[str] = Query(None, pattern="^gzip$", description="Set to 'gzip' to compress csv or ndjson"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Export all data in a bulk format"""
+    try:
+        return export_response(processor, format, columns, filter, compression)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error exporting {format}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@playlist_router.get("/export/csv")
+async def export_to_csv(
+    columns: Optional[List[str]] = Query(None, description="Columns to export, repeated or comma-separated; defaults to all"),
+    filter: Optional[List[str]] = Query(None, description="Numeric range filters such as 'energy>0.7'; repeat to combine"),
+    compression: Optional[str] = Query(None, pattern="^gzip$", description="Set to 'gzip' for a .csv.gz download"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
+    """Export all data to CSV file"""
+    try:
+        return export_response(processor, "csv", columns, filter, compression)
+    
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error exporting CSV: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/stats")
-async def get_statistics():
+@playlist_router.get("/stats")
+async def get_statistics(
+    request: Request,
+    columns: Optional[List[str]] = Query(None, description="Numeric columns to summarize, repeated or comma-separated; defaults to the dashboard's columns"),
+    processor: PlaylistDataProcessor = Depends(request_processor)
+):
     """Get basic statistics about the dataset"""
     try:
-        df = processor.get_normalized_data()
+        snapshot = processor.snapshot()
         
-        numeric_columns = ['danceability', 'energy', 'acousticness', 'tempo', 'duration_s', 'valence']
-        stats = {}
+        def build():
+            try:
+                stats = processor.stats.statistics(columns)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            
+            return {
+                'total_songs': len(snapshot.columns['index']),
+                'statistics': stats
+            }
         
-        for col in numeric_columns:
-            if col in df.columns:
-                stats[col] = {
-                    'min': float(df[col].min()),
-                    'max': float(df[col].max()),
-                    'mean': float(df[col].mean()),
-                    'median': float(df[col].median())
-                }
+        return cached_json_response(request, processor, snapshot, build)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting statistics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def playlist_names(playlists: Optional[List[str]]) -> List[str]:
+    """The playlists a cross-playlist query covers: those named, repeated or comma-separated, or else all of them"""
+    if registry is None:
+        raise HTTPException(status_code=404, detail="Multiple playlists are not enabled; set PLAYLIST_DIR")
+    if not playlists:
+        return registry.names()
+    names = list(dict.fromkeys(name.strip() for entry in playlists for name in entry.split(',') if name.strip()))
+    missing = [name for name in names if name not in registry]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Playlists not found: {missing}")
+    return names
+
+@app.get("/api/playlists")
+def list_playlists():
+    """List the playlists of PLAYLIST_DIR, and the memory held by those loaded"""
+    names = playlist_names(None)
+    return {'playlists': names, **registry.status()}
+
+# Fan-out queries wait for every playlist, loading those not in memory, so they run in the thread pool
+@app.get("/api/playlists/search")
+def search_playlists(
+    title: str = Query(..., description="Song title to search for"),
+    limit: int = Query(10, ge=1, le=100, description="Most matches to return from each playlist"),
+    playlists: Optional[List[str]] = Query(None, description="Playlists to search, repeated or comma-separated; defaults to all")
+):
+    """Search song titles in many playlists in parallel; each playlist's matches are ranked as by /api/songs/search"""
+    try:
+        names = playlist_names(playlists)
+        matches = registry.map(lambda name, processor: processor.search_songs(title, limit), names)
+        return {'results': [{'playlist': name, 'songs': jsonable_encoder([Song(**song) for song in songs])}
+                            for name, songs in matches.items() if songs]}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error searching playlists: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/playlists/stats")
+def get_playlists_statistics(
+    columns: Optional[List[str]] = Query(None, description="Numeric columns to summarize, repeated or comma-separated; defaults to the dashboard's columns"),
+    playlists: Optional[List[str]] = Query(None, description="Playlists to summarize, repeated or comma-separated; defaults to all")
+):
+    """Get statistics of many playlists, computed in parallel, per playlist and combined
+    
+    The combined statistics have count, missing, min, max, mean and std; the
+    median and percentiles are only given per playlist.
+    """
+    def summarize(name: str, processor: PlaylistDataProcessor) -> Dict[str, Any]:
+        return {'total_songs': len(processor.columns['index']), 'statistics': processor.stats.statistics(columns)}
+    
+    try:
+        names = playlist_names(playlists)
+        try:
+            results = registry.map(summarize, names)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
+        summaries = [result['statistics'] for result in results.values()]
+        # Only the columns every playlist has can be combined
+        shared = [column for column in (summaries[0] if summaries else {})
+                  if all(column in statistics for statistics in summaries)]
         return {
-            'total_songs': len(df),
-            'statistics': stats
+            'total_songs': sum(result['total_songs'] for result in results.values()),
+            'statistics': {column: merge_summaries([statistics[column] for statistics in summaries]) for column in shared},
+            'playlists': results,
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error getting statistics: {str(e)}")
+        logger.error(f"Error getting playlist statistics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def check_admin_token(x_admin_token: Optional[str] = Header(None)):
+    """Reject admin requests without the configured token, when one is configured"""
+    if PLAYLIST_ADMIN_TOKEN and not hmac.compare_digest(x_admin_token or '', PLAYLIST_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Missing or invalid X-Admin-Token")
+
+# A waiting reload blocks until the new data is published, so it runs in the thread pool
+@app.post("/api/admin/reload", status_code=202, dependencies=[Depends(check_admin_token)])
+def reload_data(
+    response: Response,
+    wait: bool = Query(False, description="Respond only once the reload has finished")
+):
+    """Reload playlist.json in the background and swap it in, keeping star ratings"""
+    try:
+        if reloader is None:
+            raise HTTPException(status_code=503, detail="Data processor is not initialized")
+        
+        if wait:
+            status = reloader.reload()
+            if status['state'] == 'failed':
+                raise HTTPException(status_code=500, detail=f"Reload failed: {status['error']}")
+            response.status_code = 200
+            return status
+        
+        if not reloader.start():
+            raise HTTPException(status_code=409, detail="A reload is already running")
+        return reloader.status
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error reloading data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/admin/reload", dependencies=[Depends(check_admin_token)])
+async def get_reload_status():
+    """Get the state of the running or last reload"""
+    if reloader is None:
+        raise HTTPException(status_code=503, detail="Data processor is not initialized")
+    return reloader.status
+
+@app.get("/api/admin/cache", dependencies=[Depends(check_admin_token)])
+async def get_cache_stats():
+    """Get response cache size and hit/miss counters, for sizing it"""
+    if response_cache is None:
+        return {'enabled': False}
+    return {'enabled': True, **response_cache.stats()}
+
+@app.get("/api/admin/memory", dependencies=[Depends(check_admin_token)])
+async def get_memory_report(processor: PlaylistDataProcessor = Depends(request_processor)):
+    """Get the bytes held by each column and index of the dataset"""
+    try:
+        return processor.memory_report()
+    except Exception as e:
+        logger.error(f"Error building memory report: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request, load, cache and process metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.get("/api/admin/profile", dependencies=[Depends(check_admin_token)])
+async def profile(
+    seconds: float = Query(10.0, gt=0, le=300, description="How long to sample for"),
+    interval_ms: float = Query(5.0, ge=1, le=1000, description="Milliseconds between samples")
+):
+    """Sample every thread's stack for a time window and return them as collapsed stacks for a flamegraph"""
+    global active_profiler
+    if not PLAYLIST_PROFILING:
+        raise HTTPException(status_code=404, detail="Profiling is disabled; set PLAYLIST_PROFILING=1 to enable it")
+    if active_profiler is not None:
+        raise HTTPException(status_code=409, detail="A profile is already being recorded")
+    
+    recorder = active_profiler = SamplingProfiler(interval_ms / 1000)
+    try:
+        recorder.start()
+        await asyncio.sleep(seconds)
+    finally:
+        recorder.stop()
+        active_profiler = None
+    
+    logger.info(f"Recorded {recorder.samples} profile samples over {recorder.duration:.1f}s")
+    return Response(recorder.collapsed(), media_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename="profile.folded"'})
+
+# Included last, once every dataset route is defined
+app.include_router(playlist_router, prefix="/api")
+app.include_router(playlist_router, prefix="/api/playlists/{name}")
+
 if __name__ == "__main__":
+    # Only needed when run as a script, so importing the app stays lighter
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
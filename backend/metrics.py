@@ -0,0 +1,278 @@
+"""
+Prometheus metrics for the playlist API, without a client library
+
+Instruments (counters, gauges and histograms, each with optional labels)
+are registered on a MetricsRegistry and updated in place, under a lock per
+instrument. Values that already live elsewhere, such as the response cache
+counters or the process's memory, are read by collector functions when the
+registry is rendered instead of being copied on every change.
+
+``render`` produces the Prometheus text exposition format (version 0.0.4).
+HTTPMetricsMiddleware times every request and counts the bytes it sends,
+streamed bodies included, labelled by route template rather than raw path
+so the number of series stays bounded.
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows: CPU time and peak memory are not reported
+    resource = None
+
+# Request latencies, from a cached response (about a millisecond) up to a large export
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Response sizes, from an empty 304 up to a full export
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+Sample = Tuple[str, Dict[str, str], float]
+_START_TIME = time.time()
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    if float(value).is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        return f'{name}{{{label_text}}} {_format_value(value)}'
+    return f'{name} {_format_value(value)}'
+
+class MetricFamily:
+    """One metric's help, type and samples, as rendered"""
+
+    def __init__(self, name: str, kind: str, help: str, samples: Optional[List[Sample]] = None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples: List[Sample] = samples if samples is not None else []
+
+    def add(self, value: float, suffix: str = '', **labels):
+        self.samples.append((self.name + suffix, {key: str(label) for key, label in labels.items()}, value))
+        return self
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(_format_sample(name, labels, value) for name, labels, value in self.samples)
+        return lines
+
+class _Instrument:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {list(self.labelnames)}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+class Counter(_Instrument):
+    """A value that only goes up; its name should end in _total"""
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.kind, self.help)
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            family.add(value, **dict(zip(self.labelnames, key)))
+        return family
+
+class Gauge(_Instrument):
+    """A value that is set to whatever it currently is"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.kind, self.help)
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            family.add(value, **dict(zip(self.labelnames, key)))
+        return family
+
+class Histogram(_Instrument):
+    """Observations counted into cumulative buckets, with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        # Bucket i counts values <= buckets[i]; the last slot is +Inf
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][slot] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return 0 if state is None else state[2]
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.kind, self.help)
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                family.add(cumulative, '_bucket', **labels, le=_format_value(bound))
+            family.add(total, '_sum', **labels)
+            family.add(count, '_count', **labels)
+        return family
+
+class MetricsRegistry:
+    """The instruments and collectors rendered together at /metrics"""
+
+    def __init__(self):
+        self._instruments: List[_Instrument] = []
+        self._collectors: List[Callable[[], Iterable[MetricFamily]]] = []
+
+    def _register(self, instrument):
+        self._instruments.append(instrument)
+        return instrument
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[MetricFamily]]):
+        """Call collector at every render for families whose values are read on demand"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        families = [instrument.collect() for instrument in self._instruments]
+        for collector in self._collectors:
+            families.extend(collector())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+def process_metrics() -> List[MetricFamily]:
+    """Resident memory, CPU time and start time of this process, under the standard process_ names"""
+    families = []
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            virtual_pages, resident_pages = (int(field) for field in file.read().split()[:2])
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        families.append(MetricFamily('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.')
+                        .add(resident_pages * page_size))
+        families.append(MetricFamily('process_virtual_memory_bytes', 'gauge', 'Virtual memory size in bytes.')
+                        .add(virtual_pages * page_size))
+    except (OSError, ValueError, AttributeError):
+        pass  # No procfs: only what getrusage reports
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        # ru_maxrss is in kilobytes on Linux
+        families.append(MetricFamily('process_max_resident_memory_bytes', 'gauge',
+                                     'Peak resident memory size in bytes.').add(usage.ru_maxrss * 1024))
+        families.append(MetricFamily('process_cpu_seconds_total', 'counter', 'Total user and system CPU time spent in seconds.')
+                        .add(usage.ru_utime + usage.ru_stime))
+    families.append(MetricFamily('process_start_time_seconds', 'gauge',
+                                 'Start time of the process since unix epoch in seconds.').add(_START_TIME))
+    return families
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware recording each request's count, latency and response size by route template
+
+    Latency runs until the last body chunk is sent, so streamed responses
+    are timed and sized in full. Paths that match no route share one label.
+    """
+
+    def __init__(self, app, requests: Counter, latency: Histogram, sizes: Histogram):
+        self.app = app
+        self.requests = requests
+        self.latency = latency
+        self.sizes = sizes
+        self._routes: Dict[Any, List[Any]] = {}
+
+    def _template(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        routes = self._routes.get(endpoint)
+        if routes is None:
+            routes = self._routes[endpoint] = [route for route in getattr(scope.get('app'), 'routes', ())
+                                               if getattr(route, 'endpoint', None) is endpoint]
+        if len(routes) == 1:
+            return routes[0].path
+        # One endpoint mounted under several prefixes
+        for route in routes:
+            if route.path_regex.match(scope['path']):
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status, size = 500, 0
+
+        async def send_and_measure(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            path, method = self._template(scope), scope['method']
+            self.requests.inc(method=method, path=path, status=status)
+            self.latency.observe(time.perf_counter() - start, method=method, path=path)
+            self.sizes.observe(size, method=method, path=path)
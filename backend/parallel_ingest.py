@@ -0,0 +1,237 @@
+"""
+Parallel ingestion of playlist JSON across processes
+
+A source is one column-oriented playlist file, or a directory of shard
+files shaped the same way whose row keys together make up the catalog. A
+vectorized scan of each file finds the byte range of every attribute's row
+object. With several workers, ranges are then cut at entry boundaries into
+chunks of about equal size, several per worker, so one large file keeps
+every worker busy and no single column sets the wall time. Each chunk is
+decoded and typed in a pool of worker processes, largest first. The parent
+then joins each attribute's parts, one copy per column, and orders rows by
+key exactly as ``build_columns`` does for a single file, so the result does
+not depend on how many workers ran or how the catalog was sharded.
+
+The scan tells structural braces and commas from those inside strings by
+the parity of the unescaped quotes before them, so it reads the file at
+numpy speed without decoding it. Like json_stream, it expects row values to
+be scalars, so every comma outside a string inside a row object separates
+two entries.
+
+Starting the workers is a fixed cost of about a second, so a process pool
+only pays off for catalogs that take several seconds to parse serially.
+"""
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from json_stream import align_columns
+from snapshot import source_files
+
+logger = logging.getLogger(__name__)
+
+SCAN_BLOCK_SIZE = 1 << 24  # bytes scanned at a time
+# Chunks per worker, so chunks that parse slower than their size suggests even out
+CHUNKS_PER_WORKER = 4
+# Smallest chunk worth a task of its own; below it, scheduling and pickling dominate
+MIN_CHUNK_BYTES = 1 << 20
+_SEPARATOR_WINDOW = 1 << 16  # bytes searched at a time for the next entry boundary
+_QUOTE, _BACKSLASH, _OPEN, _CLOSE, _COMMA = b'"'[0], b'\\'[0], b'{'[0], b'}'[0], b','[0]
+
+AttributeRange = Tuple[str, int, int]
+
+def _escaped(data: np.ndarray, position: int) -> bool:
+    """Whether the quote at position follows an odd number of backslashes"""
+    count = 0
+    while position - count > 0 and data[position - count - 1] == _BACKSLASH:
+        count += 1
+    return count % 2 == 1
+
+def _unescaped_quotes(data: np.ndarray, low: int, high: int) -> np.ndarray:
+    """Offsets from low of the quotes in data[low:high] that are not escaped"""
+    quotes = np.flatnonzero(data[low:high] == _QUOTE)
+    # Escaped quotes need a backslash right before them, which is rare; check just those
+    if len(quotes):
+        candidates = quotes[data[np.maximum(low + quotes - 1, 0)] == _BACKSLASH]
+        if len(candidates):
+            escaped = [q for q in candidates.tolist() if _escaped(data, low + q)]
+            quotes = np.setdiff1d(quotes, escaped, assume_unique=True)
+    return quotes
+
+def attribute_ranges(path: str, block_size: int = SCAN_BLOCK_SIZE) -> List[AttributeRange]:
+    """(attribute, start, end) byte offsets of each attribute's row object in a playlist file, in file order"""
+    if os.path.getsize(path) == 0:
+        raise ValueError(f"Playlist file {path} is empty")
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    structural = []
+    quotes_before = 0
+    for block_start in range(0, len(data), block_size):
+        block = data[block_start:block_start + block_size]
+        quotes = _unescaped_quotes(data, block_start, block_start + block_size)
+        braces = np.flatnonzero((block == _OPEN) | (block == _CLOSE))
+        outside = (quotes_before + np.searchsorted(quotes, braces)) % 2 == 0
+        structural.extend((block_start + braces[outside]).tolist())
+        quotes_before += len(quotes)
+
+    ranges, depth, previous_end = [], 0, None
+    for position in structural:
+        if data[position] == _OPEN:
+            depth += 1
+            if depth == 1:
+                previous_end = position + 1
+            elif depth == 2:
+                start = position
+        else:
+            depth -= 1
+            if depth == 1:
+                # Between the previous row object and this one: `, "attribute" :`
+                header = bytes(data[previous_end:start]).decode('utf-8').strip().lstrip(',').rstrip().rstrip(':')
+                ranges.append((json.loads(header), start, position + 1))
+                previous_end = position + 1
+    if depth != 0:
+        raise ValueError(f"Unbalanced braces in playlist file {path}")
+    return ranges
+
+def _next_separator(data: np.ndarray, position: int, limit: int, in_string: bool) -> int:
+    """Offset of the first comma outside a string in data[position:limit], or limit if there is none"""
+    while position < limit:
+        high = min(position + _SEPARATOR_WINDOW, limit)
+        quotes = _unescaped_quotes(data, position, high)
+        commas = np.flatnonzero(data[position:high] == _COMMA)
+        outside = (np.searchsorted(quotes, commas) + in_string) % 2 == 0
+        if outside.any():
+            return position + int(commas[outside][0])
+        in_string ^= len(quotes) % 2 == 1
+        position = high
+    return limit
+
+def split_range(data: np.ndarray, start: int, end: int, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """Cut the row object data[start:end] into chunks of whole entries, each about chunk_bytes long
+
+    Returns (first, last) byte offsets of the text between the braces of each
+    chunk, so ``{`` + data[first:last] + ``}`` is a row object of its own.
+    """
+    chunks, first = [], start + 1
+    while end - 1 - first > chunk_bytes:
+        target = first + chunk_bytes
+        # The row object's brace is outside any string, and so is every cut made after it
+        in_string = len(_unescaped_quotes(data, first, target)) % 2 == 1
+        cut = _next_separator(data, target, end - 1, in_string)
+        if cut >= end - 1:
+            break
+        chunks.append((first, cut))
+        first = cut + 1
+    chunks.append((first, end - 1))
+    return chunks
+
+def _parse_range(path: str, attribute: str, first: int, last: int,
+                 convert: Callable[[str, List[Any]], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode and type the entries data[first:last] of one attribute's row object; return their integer row keys and values"""
+    with open(path, 'rb') as file:
+        file.seek(first)
+        rows = json.loads(b'{' + file.read(last - first) + b'}')
+    if not isinstance(rows, dict):
+        raise ValueError("Playlist JSON must map attributes to row objects")
+    keys = np.fromiter(map(int, rows), dtype=np.int64, count=len(rows))
+    return keys, convert(attribute, list(rows.values()))
+
+def _timed_parse(path: str, attribute: str, first: int, last: int,
+                 convert: Callable[[str, List[Any]], np.ndarray]) -> Tuple[int, float, Tuple[np.ndarray, np.ndarray]]:
+    """_parse_range in a worker, with the worker's pid and the seconds it took"""
+    started = time.perf_counter()
+    result = _parse_range(path, attribute, first, last, convert)
+    return os.getpid(), time.perf_counter() - started, result
+
+def _join(attribute: str, parts: List[np.ndarray], convert: Callable[[str, List[Any]], np.ndarray]) -> np.ndarray:
+    """One column from its parts, one per shard and chunk, typed as if it had been converted whole"""
+    if len(parts) == 1:
+        return parts[0]
+    kinds = {part.dtype.kind for part in parts}
+    if len({part.dtype for part in parts}) == 1 or kinds <= set('biuf'):
+        # Numbers promote as they would have in one array: ints with missing values become floats
+        return np.concatenate(parts)
+    # Text in some shards and numbers in others: infer the type from all the values together
+    return convert(attribute, [value for part in parts for value in part.tolist()])
+
+def _worker_context(convert: Callable):
+    """Workers forked from a fork server that has already imported convert's module
+
+    Not forked from this process: the server's threads may hold locks a
+    forked child would inherit. Spawned workers would each import numpy and
+    pandas again; the fork server imports them once per process, and every
+    later ingest, such as a reload, reuses it.
+    """
+    if 'forkserver' not in get_all_start_methods():
+        return get_context('spawn')
+    context = get_context('forkserver')
+    context.set_forkserver_preload([convert.__module__])
+    return context
+
+def _plan_tasks(files: List[str], workers: int) -> List[Tuple[str, str, int, int]]:
+    """(path, attribute, first, last) chunks of every file's row objects, in file and row order"""
+    ranges = [(path, attribute_ranges(path)) for path in files]
+    total = sum(end - start for _, file_ranges in ranges for _, start, end in file_ranges)
+    chunk_bytes = max(total // (workers * CHUNKS_PER_WORKER), MIN_CHUNK_BYTES) if workers > 1 else total
+    tasks = []
+    for path, file_ranges in ranges:
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        for attribute, start, end in file_ranges:
+            tasks.extend((path, attribute, first, last) for first, last in split_range(data, start, end, chunk_bytes))
+        del data
+    return tasks
+
+def ingest_columns(source: str, convert: Callable[[str, List[Any]], np.ndarray], workers: int = 1,
+                   worker_seconds: Optional[Dict[int, float]] = None) -> Dict[str, np.ndarray]:
+    """Parse a playlist file or shard directory into typed columns, using up to workers processes
+
+    With one worker everything runs in this process. ``convert`` must be a
+    module-level function so worker processes can import it, and, as with
+    any process pool, a script calling this must guard its entry point with
+    ``if __name__ == '__main__'`` because workers import the main module.
+    When given, worker_seconds is filled with the seconds each worker
+    process, by pid, spent parsing, to show how evenly the work was spread.
+    """
+    files = source_files(source)
+    if not files:
+        raise ValueError(f"No .json shard files in {source}")
+
+    tasks = _plan_tasks(files, workers)
+    if workers > 1 and len(tasks) > 1:
+        busy: Dict[int, float] = {} if worker_seconds is None else worker_seconds
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=_worker_context(convert)) as pool:
+            futures = {}
+            # Largest first, so a big chunk does not start last and hold up the rest
+            for task in sorted(tasks, key=lambda task: task[3] - task[2], reverse=True):
+                futures[task] = pool.submit(_timed_parse, *task, convert)
+            results = []
+            for task in tasks:
+                pid, seconds, result = futures[task].result()
+                busy[pid] = busy.get(pid, 0.0) + seconds
+                results.append(result)
+        logger.info(f"Worker parse seconds: {', '.join(f'{seconds:.3f}' for seconds in sorted(busy.values()))}")
+    else:
+        results = [_parse_range(*task, convert) for task in tasks]
+
+    parts: Dict[str, List[np.ndarray]] = {}
+    key_parts: Dict[str, List[np.ndarray]] = {}
+    for (_, attribute, _, _), (keys, values) in zip(tasks, results):
+        parts.setdefault(attribute, []).append(values)
+        key_parts.setdefault(attribute, []).append(keys)
+    del results
+
+    columns = {attribute: _join(attribute, values, convert) for attribute, values in parts.items()}
+    column_keys = {attribute: keys[0] if len(keys) == 1 else np.concatenate(keys) for attribute, keys in key_parts.items()}
+    for attribute, keys in column_keys.items():
+        if len(files) > 1 and len(np.unique(keys)) != len(keys):
+            raise ValueError(f"Attribute '{attribute}' has the same row key in more than one shard")
+
+    logger.info(f"Ingested {len(columns)} attributes from {len(files)} files with {len(tasks)} tasks "
+                f"on {max(min(workers, len(tasks)), 1)} processes")
+    if not columns:
+        return {'index': np.empty(0, dtype=np.int64)}
+    return align_columns(columns, column_keys)
@@ -0,0 +1,204 @@
+"""
+Many playlists served from one process, each loaded on first use
+
+Every ``<name>.json`` file in the playlists directory is a playlist. A
+playlist is loaded the first time it is asked for; requests for it made
+while it loads wait for that load instead of starting their own, and other
+playlists load alongside it. Once the loaded playlists hold more than the
+memory budget, as memory_report counts it, the least recently used ones
+are unloaded until they fit again. The playlist just loaded always stays,
+even if it alone is over budget.
+
+Unloading keeps ratings. With a ratings directory, each playlist logs to
+its own rating store, which is closed on unloading and replayed on the next
+load; without one, the playlist's ratings are set aside in memory and
+applied again on the next load. A request that still holds an unloaded
+processor keeps reading from it, and its rating writes are sent to the
+playlist as loaded again.
+
+``map`` runs a function over many playlists at once on a thread pool, for
+queries such as search and stats that span playlists.
+"""
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from data_processor import PlaylistDataProcessor
+from rating_store import RatingStore
+
+logger = logging.getLogger(__name__)
+
+# Playlist names are file stems that are safe to use in paths and URLs
+_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$')
+
+class _LoadedAgain:
+    """Takes the rating writes made through an unloaded processor and applies them to the playlist as loaded now"""
+
+    def __init__(self, registry: 'PlaylistRegistry', name: str):
+        self._registry = registry
+        self._name = name
+
+    def update_star_rating(self, song_id: str, rating: int) -> bool:
+        return self._registry.get(self._name).update_star_rating(song_id, rating)
+
+    def update_star_ratings(self, song_ids: List[str], ratings: List[int]) -> List[str]:
+        return self._registry.get(self._name).update_star_ratings(song_ids, ratings)
+
+class PlaylistRegistry:
+    """The playlists in a directory, loaded lazily and kept under a memory budget, least recently used out first"""
+
+    def __init__(self, directory: str, memory_budget: int, ratings_dir: Optional[str] = None,
+                 ratings_durability: str = 'batch', max_workers: Optional[int] = None, **processor_options):
+        if not os.path.isdir(directory):
+            raise ValueError(f"Playlist directory '{directory}' does not exist")
+        self.directory = directory
+        self.memory_budget = memory_budget
+        self.ratings_dir = ratings_dir
+        self.ratings_durability = ratings_durability
+        # Passed on to every PlaylistDataProcessor, e.g. load_mode, cache_dir, compact
+        self.processor_options = processor_options
+        self.loads = 0
+        self.evictions = 0
+
+        # Guards the fields below; never held while loading or unloading
+        self._lock = threading.Lock()
+        # Loaded processors and the bytes each holds, least recently used first
+        self._loaded: 'OrderedDict[str, Tuple[PlaylistDataProcessor, int]]' = OrderedDict()
+        # Held while a playlist loads, so concurrent first requests share one load
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # Set once an unloaded playlist's ratings are set aside and its rating store is closed
+        self._unloading: Dict[str, threading.Event] = {}
+        # Ratings of unloaded playlists, when there is no ratings directory to keep them
+        self._set_aside: Dict[str, Dict[str, int]] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1),
+                                        thread_name_prefix='playlist-fan-out')
+
+    def path(self, name: str) -> str:
+        """The source file of playlist name; KeyError if the name is not a valid playlist name"""
+        if not _NAME_PATTERN.match(name):
+            raise KeyError(name)
+        return os.path.join(self.directory, f'{name}.json')
+
+    def names(self) -> List[str]:
+        """Every playlist in the directory, sorted"""
+        return sorted(entry[:-len('.json')] for entry in os.listdir(self.directory)
+                      if entry.endswith('.json') and _NAME_PATTERN.match(entry[:-len('.json')]))
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            return os.path.isfile(self.path(name))
+        except KeyError:
+            return False
+
+    def get(self, name: str) -> PlaylistDataProcessor:
+        """The loaded processor of playlist name, loading it first if needed; KeyError if there is no such playlist"""
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                self._loaded.move_to_end(name)
+                return entry[0]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                # Loaded by the request this one waited for
+                entry = self._loaded.get(name)
+                if entry is not None:
+                    self._loaded.move_to_end(name)
+                    return entry[0]
+                unloading = self._unloading.get(name)
+            if unloading is not None:
+                unloading.wait()
+
+            processor, size = self._load(name)
+            with self._lock:
+                self._loaded[name] = (processor, size)
+                self.loads += 1
+                victims = self._over_budget()
+                for victim in victims:
+                    self._unloading[victim[0]] = threading.Event()
+
+        for victim_name, victim in victims:
+            self._unload(victim_name, victim)
+        return processor
+
+    def _load(self, name: str) -> Tuple[PlaylistDataProcessor, int]:
+        path = self.path(name)
+        if not os.path.isfile(path):
+            raise KeyError(name)
+
+        processor = PlaylistDataProcessor(path, **self.processor_options)
+        processor.load_and_normalize()
+        if self.ratings_dir:
+            processor.attach_rating_store(RatingStore(os.path.join(self.ratings_dir, name),
+                                                      durability=self.ratings_durability))
+        else:
+            with self._lock:
+                ratings = self._set_aside.pop(name, {})
+            if ratings:
+                processor.update_star_ratings(list(ratings), list(ratings.values()))
+
+        size = processor.memory_report()['total_bytes']
+        logger.info(f"Loaded playlist '{name}': {len(processor.columns['index'])} songs, {size / 2**20:.1f} MB")
+        return processor, size
+
+    def _over_budget(self) -> List[Tuple[str, PlaylistDataProcessor]]:
+        """Remove least recently used playlists, never the most recent, until the rest fit the budget"""
+        victims = []
+        used = sum(size for _, size in self._loaded.values())
+        while used > self.memory_budget and len(self._loaded) > 1:
+            name, (processor, size) = self._loaded.popitem(last=False)
+            victims.append((name, processor))
+            used -= size
+            self.evictions += 1
+        return victims
+
+    def _unload(self, name: str, processor: PlaylistDataProcessor):
+        store = processor.rating_store
+        try:
+            ratings = processor.retire(_LoadedAgain(self, name))
+            if store is not None:
+                store.close()
+            elif ratings:
+                with self._lock:
+                    self._set_aside[name] = ratings
+            logger.info(f"Unloaded playlist '{name}' to stay within the memory budget")
+        finally:
+            with self._lock:
+                self._unloading.pop(name).set()
+
+    def map(self, func: Callable[[str, PlaylistDataProcessor], Any], names: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """func(name, processor) for each playlist in names (default: all), run in parallel, by name
+
+        Raises the first exception any call raised, KeyError for an unknown playlist.
+        """
+        names = self.names() if names is None else list(names)
+        futures = [self._pool.submit(lambda name=name: func(name, self.get(name))) for name in names]
+        return {name: future.result() for name, future in zip(names, futures)}
+
+    def status(self) -> Dict[str, Any]:
+        """Memory use, load and eviction counts, and the loaded playlists, least recently used first"""
+        with self._lock:
+            loaded = [{'name': name, 'songs': len(processor.columns['index']), 'bytes': size}
+                      for name, (processor, size) in self._loaded.items()]
+        return {
+            'memory_budget': self.memory_budget,
+            'bytes': sum(entry['bytes'] for entry in loaded),
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'loaded': loaded,
+        }
+
+    def close(self):
+        """Stop the fan-out pool and close the rating stores of the loaded playlists"""
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            loaded = list(self._loaded.values())
+            self._loaded.clear()
+        for processor, _ in loaded:
+            if processor.rating_store is not None:
+                processor.rating_store.close()
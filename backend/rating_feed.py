@@ -0,0 +1,252 @@
+"""
+Live rating updates pushed to subscribers in coalesced batches
+
+Rating writes are published from whichever thread applies them, in the
+order they are applied. The first write of a quiet period starts a window
+of ``window`` seconds on the event loop; writes during it are coalesced per
+song, the last rating winning, and the window is then flushed as one batch.
+A flush costs one pass over the batch and one delivery per subscriber: each
+song of the batch is looked up in an index of the subscriptions watching
+it, and subscribers to every song share one copy of the batch and its
+encoding.
+
+A subscriber that reads slower than batches arrive does not queue them.
+Batches it has not read yet are merged into one, so what it holds is bounded
+by the songs it watches, and its next read brings it up to date.
+
+Subscriptions are created and read on the event loop the feed was started
+with; ``publish`` may be called from any thread.
+
+Writes the process does not apply itself, such as other workers' writes to
+a shared rating column, reach the feed through ``poll``: a source called
+every interval while anyone listens, whose changes are published like any
+other write. The source runs in the loop's default executor, so a slow one
+(comparing a whole rating column, say) never blocks requests or sockets;
+the next poll is only scheduled once it returns.
+"""
+import asyncio
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds of rating writes coalesced into one batch
+DEFAULT_WINDOW = 0.1
+# Most songs one subscription may watch; a dashboard page shows at most 100
+MAX_WATCHED_SONGS = 1000
+
+class Subscription:
+    """One subscriber's watched songs and the updates it has not read yet"""
+
+    def __init__(self, feed: 'RatingFeed'):
+        self._feed = feed
+        # None watches every song
+        self.song_ids: Optional[Set[str]] = None
+        # Whether batches carry the rating statistics too
+        self.stats = True
+        self.closed = False
+        # Not yet read; _ratings may be a batch shared with other subscribers, so it is replaced, never changed
+        self._ratings: Optional[Dict[str, int]] = None
+        self._stats: Optional[Any] = None
+        self._batch = 0
+        self._ready = asyncio.Event()
+
+    def _deliver(self, ratings: Optional[Dict[str, int]], stats: Optional[Any], batch: int):
+        if ratings:
+            self._ratings = ratings if self._ratings is None else {**self._ratings, **ratings}
+        if stats is not None:
+            self._stats = stats
+        self._batch = batch
+        self._ready.set()
+
+    def include(self, ratings: Dict[str, int]):
+        """Add ratings read from the dataset, such as those of songs just watched, to the next message
+
+        Batches flushed later are merged over them, so a write that lands
+        after the read still wins.
+        """
+        if ratings:
+            self._deliver(ratings, None, self._batch)
+
+    async def next(self) -> Optional[str]:
+        """The JSON message of every update since the last call, once there is one; None once closed"""
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if self.closed:
+                return None
+            if self._ratings is None and self._stats is None:
+                continue
+            ratings, stats = self._ratings, self._stats
+            self._ratings = self._stats = None
+            return self._feed._encode(ratings or {}, stats, self._batch)
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+class RatingFeed:
+    """Fans rating writes out to subscribers, coalesced into batches of window seconds"""
+
+    def __init__(self, window: float = DEFAULT_WINDOW, stats: Optional[Callable[[], Any]] = None):
+        if window < 0:
+            raise ValueError("The batching window cannot be negative")
+        self.window = window
+        # Called once per batch for the statistics it carries, e.g. the rating distribution
+        self._stats = stats
+        self.batches = 0
+        self.updates = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # Guards the pending batch, which writer threads add to
+        self._lock = threading.Lock()
+        self._pending: Dict[str, int] = {}
+        self._flush_scheduled = False
+        # Read without the lock by writers, so they skip the feed while nobody listens
+        self._listening = 0
+
+        # Only touched on the event loop; _watchers indexes the subscriptions that watch some songs by song id
+        self._subscriptions: Set[Subscription] = set()
+        self._watchers: Dict[str, Set[Subscription]] = {}
+        self._encoded: Tuple[Any, ...] = (None, None, None, None)
+        self._poll_source: Optional[Callable[[], List[Tuple[str, int]]]] = None
+        self._poll_interval = 0.0
+        self._poll_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Flush batches and serve subscriptions on loop"""
+        self._loop = loop
+
+    def poll(self, source: Callable[[], List[Tuple[str, int]]], interval: float):
+        """Also publish the (song_id, rating) changes source returns, calling it every interval seconds while anyone listens"""
+        if interval <= 0:
+            raise ValueError("The polling interval must be positive")
+        if self._loop is None:
+            raise ValueError("Start the feed before polling")
+        self._poll_source, self._poll_interval = source, interval
+        self._loop.call_soon_threadsafe(self._schedule_poll)
+
+    def _schedule_poll(self, *_):
+        if self._poll_source is not None:
+            self._poll_handle = self._loop.call_later(self._poll_interval, self._poll)
+
+    def _poll(self):
+        self._poll_handle = None
+        if not self._listening:
+            self._schedule_poll()
+            return
+        self._loop.run_in_executor(None, self._poll_once, self._poll_source).add_done_callback(self._schedule_poll)
+
+    def _poll_once(self, source: Callable[[], List[Tuple[str, int]]]):
+        try:
+            self.publish(source())
+        except Exception as e:
+            logger.error(f"Error polling for rating changes: {str(e)}")
+
+    @property
+    def subscribers(self) -> int:
+        return self._listening
+
+    def publish(self, records: List[Tuple[str, int]]):
+        """Add applied (song_id, rating) writes, in the order applied, to the current batch"""
+        if not self._listening or not records or self._loop is None:
+            return
+        with self._lock:
+            self._pending.update(records)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        try:
+            self._loop.call_soon_threadsafe(self._loop.call_later, self.window, self._flush)
+        except RuntimeError:
+            pass  # The loop has closed: the server is shutting down
+
+    def subscribe(self, song_ids: Optional[Iterable[str]] = None, stats: bool = True) -> Subscription:
+        """A subscription to the ratings of song_ids, or of every song when None"""
+        subscription = Subscription(self)
+        self._listening += 1
+        self._subscriptions.add(subscription)
+        self.watch(subscription, song_ids, stats)
+        return subscription
+
+    def watch(self, subscription: Subscription, song_ids: Optional[Iterable[str]] = None, stats: bool = True):
+        """Replace the songs subscription watches, e.g. when the dashboard turns a page"""
+        song_ids = None if song_ids is None else set(song_ids)
+        if song_ids is not None and len(song_ids) > MAX_WATCHED_SONGS:
+            raise ValueError(f"A subscription can watch at most {MAX_WATCHED_SONGS} songs")
+        self._forget(subscription)
+        subscription.song_ids, subscription.stats = song_ids, stats
+        if song_ids is not None:
+            for song_id in song_ids:
+                self._watchers.setdefault(song_id, set()).add(subscription)
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.closed:
+            return
+        self._forget(subscription)
+        self._subscriptions.discard(subscription)
+        self._listening -= 1
+        subscription.close()
+
+    def _forget(self, subscription: Subscription):
+        for song_id in subscription.song_ids or ():
+            watchers = self._watchers.get(song_id)
+            if watchers is not None:
+                watchers.discard(subscription)
+                if not watchers:
+                    del self._watchers[song_id]
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._flush_scheduled = False
+        if not batch:
+            return
+        self.batches += 1
+        self.updates += len(batch)
+
+        stats = None
+        if self._stats is not None and any(subscription.stats for subscription in self._subscriptions):
+            try:
+                stats = self._stats()
+            except Exception as e:
+                logger.error(f"Error computing rating feed statistics: {str(e)}")
+
+        # Walk the smaller side: the batch's songs or the watched songs
+        watched: Dict[Subscription, Dict[str, int]] = {}
+        if len(batch) <= len(self._watchers):
+            for song_id, rating in batch.items():
+                for subscription in self._watchers.get(song_id, ()):
+                    watched.setdefault(subscription, {})[song_id] = rating
+        else:
+            for song_id, watchers in self._watchers.items():
+                if song_id in batch:
+                    for subscription in watchers:
+                        watched.setdefault(subscription, {})[song_id] = batch[song_id]
+        for subscription in self._subscriptions:
+            ratings = batch if subscription.song_ids is None else watched.get(subscription)
+            if ratings or (subscription.stats and stats is not None):
+                subscription._deliver(ratings, stats if subscription.stats else None, self.batches)
+
+    def _encode(self, ratings: Dict[str, int], stats: Optional[Any], batch: int) -> str:
+        """The message for one read; subscribers reading the same shared batch share its encoding"""
+        cached_ratings, cached_stats, cached_batch, text = self._encoded
+        if ratings is cached_ratings and stats is cached_stats and batch == cached_batch:
+            return text
+        message = {'type': 'ratings', 'batch': batch, 'ratings': ratings}
+        if stats is not None:
+            message['stats'] = stats
+        text = json.dumps(message)
+        self._encoded = (ratings, stats, batch, text)
+        return text
+
+    def close(self):
+        """Stop polling and end every subscription"""
+        self._poll_source = None
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+        for subscription in list(self._subscriptions):
+            self.unsubscribe(subscription)
@@ -0,0 +1,294 @@
+"""
+Durable star ratings: an append-only log compacted into periodic snapshots
+
+Every rating write appends one line per song to the current log file,
+``ratings-<generation>.log``, as ``<crc32> ["song id", rating]``. On startup
+the latest snapshot is loaded and the logs from its generation on are
+replayed in order, so the last rating written for a song wins. A torn or
+corrupt line ends a log's replay; it can only be the tail of an interrupted
+write, and it is truncated away before new records are appended.
+
+How long a write waits for the disk depends on the durability level:
+
+- ``none``: records reach the OS before the write returns, so they survive
+  a crash of the process but not of the machine.
+- ``batch``: as ``none``, plus a background thread fsyncs the log every
+  ``sync_interval`` seconds, bounding what a power loss can take.
+- ``sync``: a write returns only once its record is fsynced. Concurrent
+  writers share fsyncs (group commit): one of them syncs everything written
+  so far while the others wait for it.
+
+After ``compact_after`` records the log is sealed, a new generation is
+started, and the ratings are written to ``ratings.snapshot.json`` in the
+background. Sealed logs are deleted only once the snapshot covering them has
+been published, so a crash at any point leaves a replayable state.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_LEVELS = ('none', 'batch', 'sync')
+SNAPSHOT_FILE = 'ratings.snapshot.json'
+_SNAPSHOT_FORMAT_VERSION = 1
+_LOG_PATTERN = re.compile(r'^ratings-(\d{8})\.log$')
+
+def _encode(song_id: str, rating: int) -> bytes:
+    payload = json.dumps([song_id, int(rating)], ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+def _decode(line: bytes) -> Optional[Tuple[str, int]]:
+    """Parse one log line, or return None if it is damaged"""
+    checksum, _, payload = line.partition(b' ')
+    try:
+        if int(checksum, 16) != zlib.crc32(payload):
+            return None
+        song_id, rating = json.loads(payload)
+        return str(song_id), int(rating)
+    except (ValueError, TypeError):
+        return None
+
+def _fsync_directory(directory: str):
+    """Make renames and new files in directory durable, where the platform allows it"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class RatingStore:
+    """Write-ahead log of star ratings, keyed by song id
+
+    ``ratings`` holds the latest rating of every song ever rated, including
+    songs missing from the current dataset, so their ratings carry forward.
+    """
+
+    def __init__(self, directory: str, durability: str = 'batch', sync_interval: float = 0.05,
+                 compact_after: int = 100_000):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability '{durability}', expected one of {DURABILITY_LEVELS}")
+        self.directory = directory
+        self.durability = durability
+        self.sync_interval = sync_interval
+        self.compact_after = compact_after
+        os.makedirs(directory, exist_ok=True)
+
+        # Serializes appends and log rotation
+        self._lock = threading.Lock()
+        # Guards the fsync bookkeeping; _syncing marks that one thread is syncing for everyone
+        self._sync_condition = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._compaction = None
+        self._closed = threading.Event()
+
+        self.ratings: Dict[str, int] = {}
+        self._since_compaction = 0
+        self.generation = self._recover()
+        self._fd = self._open_log(self.generation)
+
+        self._flusher = None
+        if durability == 'batch':
+            self._flusher = threading.Thread(target=self._flush_periodically, name='rating-log-flusher', daemon=True)
+            self._flusher.start()
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f'ratings-{generation:08d}.log')
+
+    def _open_log(self, generation: int) -> int:
+        fd = os.open(self._log_path(generation), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        _fsync_directory(self.directory)
+        return fd
+
+    def _log_generations(self) -> List[int]:
+        generations = []
+        for entry in os.listdir(self.directory):
+            match = _LOG_PATTERN.match(entry)
+            if match:
+                generations.append(int(match.group(1)))
+        return sorted(generations)
+
+    def _recover(self) -> int:
+        """Load the snapshot and replay the logs after it; return the generation to append to"""
+        snapshot_generation = 0
+        try:
+            with open(os.path.join(self.directory, SNAPSHOT_FILE), 'r', encoding='utf-8') as file:
+                snapshot = json.load(file)
+            if snapshot.get('format') == _SNAPSHOT_FORMAT_VERSION:
+                snapshot_generation = snapshot['generation']
+                self.ratings = {str(song_id): int(rating) for song_id, rating in snapshot['ratings'].items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable rating snapshot: {str(e)}")
+
+        generations = [generation for generation in self._log_generations() if generation >= snapshot_generation]
+        for generation in generations:
+            self._since_compaction += self._replay(self._log_path(generation))
+
+        logger.info(f"Recovered {len(self.ratings)} ratings from {self.directory} "
+                    f"(snapshot generation {snapshot_generation}, {len(generations)} logs replayed)")
+        return generations[-1] if generations else max(snapshot_generation, 1)
+
+    def _replay(self, path: str) -> int:
+        """Apply the intact records of one log, truncating a damaged tail; return the record count"""
+        with open(path, 'rb') as file:
+            data = file.read()
+
+        valid_length = 0
+        count = 0
+        for line in data.split(b'\n')[:-1]:  # The last piece never ends in a newline
+            record = _decode(line)
+            if record is None:
+                break
+            self.ratings[record[0]] = record[1]
+            valid_length += len(line) + 1
+            count += 1
+
+        if valid_length < len(data):
+            logger.warning(f"Discarding {len(data) - valid_length} damaged bytes at the end of {path}")
+            with open(path, 'r+b') as file:
+                file.truncate(valid_length)
+                os.fsync(file.fileno())
+        return count
+
+    def append(self, records: Iterable[Tuple[str, int]]) -> int:
+        """Log rating writes, in order, and return a ticket for wait_durable"""
+        records = list(records)
+        data = b''.join(_encode(song_id, rating) for song_id, rating in records)
+
+        with self._lock:
+            if self._closed.is_set():
+                raise RuntimeError("Rating store is closed")
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            for song_id, rating in records:
+                self.ratings[song_id] = int(rating)
+            self._written += 1
+            ticket = self._written
+
+            self._since_compaction += len(records)
+            if self._since_compaction >= self.compact_after and self._compaction is None:
+                self._compaction = threading.Thread(target=self.compact, name='rating-log-compaction', daemon=True)
+                self._compaction.start()
+        return ticket
+
+    def wait_durable(self, ticket: int):
+        """Block until the append with this ticket is as durable as the configured level promises"""
+        if self.durability == 'sync':
+            self.sync(ticket)
+
+    def sync(self, ticket: Optional[int] = None):
+        """Fsync the log up to ticket (default: everything appended so far)
+
+        Only one thread fsyncs at a time, and its fsync covers every append
+        made before it started, so concurrent callers mostly just wait.
+        """
+        with self._sync_condition:
+            if ticket is None:
+                ticket = self._written
+            while self._synced < ticket:
+                if not self._syncing:
+                    break
+                self._sync_condition.wait()
+            else:
+                return
+            self._syncing = True
+
+        try:
+            with self._lock:
+                target, fd = self._written, self._fd
+            os.fsync(fd)
+        finally:
+            with self._sync_condition:
+                self._syncing = False
+                if self._synced < target:
+                    self._synced = target
+                self._sync_condition.notify_all()
+
+    def _flush_periodically(self):
+        while not self._closed.wait(self.sync_interval):
+            if self._synced < self._written:
+                try:
+                    self.sync()
+                except OSError as e:
+                    logger.error(f"Failed to sync rating log: {str(e)}")
+
+    def _rotate(self) -> Tuple[int, Dict[str, int]]:
+        """Seal the current log and start the next generation; return it and the ratings it starts from"""
+        with self._sync_condition:
+            while self._syncing:
+                self._sync_condition.wait()
+            self._syncing = True
+        try:
+            with self._lock:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self.generation += 1
+                self._fd = self._open_log(self.generation)
+                self._since_compaction = 0
+                with self._sync_condition:
+                    self._synced = self._written
+                return self.generation, dict(self.ratings)
+        finally:
+            with self._sync_condition:
+                self._syncing = False
+                self._sync_condition.notify_all()
+
+    def _write_snapshot(self, generation: int, ratings: Dict[str, int]):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump({'format': _SNAPSHOT_FORMAT_VERSION, 'generation': generation, 'ratings': ratings},
+                          file, ensure_ascii=False, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, os.path.join(self.directory, SNAPSHOT_FILE))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        _fsync_directory(self.directory)
+
+    def compact(self):
+        """Fold every sealed log into a new snapshot and delete the logs it covers"""
+        try:
+            generation, ratings = self._rotate()
+            self._write_snapshot(generation, ratings)
+            for old in self._log_generations():
+                if old < generation:
+                    os.remove(self._log_path(old))
+            logger.info(f"Compacted {len(ratings)} ratings into snapshot generation {generation}")
+        except OSError as e:
+            logger.error(f"Rating log compaction failed: {str(e)}")
+        finally:
+            with self._lock:
+                if self._compaction is threading.current_thread():
+                    self._compaction = None
+
+    def close(self):
+        """Stop accepting writes, sync outstanding records and release the log"""
+        with self._lock:
+            if self._closed.is_set():
+                return
+            self._closed.set()
+            compaction = self._compaction
+        if self._flusher is not None:
+            self._flusher.join()
+        if compaction is not None:
+            compaction.join()
+        self.sync()
+        os.close(self._fd)
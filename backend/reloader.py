@@ -0,0 +1,126 @@
+"""
+Hot reload of the playlist data without restarting the server
+
+A reload builds a complete new PlaylistDataProcessor (columns, indexes and
+caches) in the background while the current one keeps serving. The current
+processor then hands its ratings over by song id, and the new one is
+published with a single reference assignment. Requests that already hold the
+old processor finish on it; rating writes that reach it afterwards are
+forwarded to the new one, so none are lost.
+
+Reloads run one at a time. They are started explicitly, or by a watcher
+thread that polls the source file and reloads once a change has settled,
+that is, once two polls in a row see the same new size and mtime.
+"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from data_processor import PlaylistDataProcessor
+from snapshot import source_stat
+
+logger = logging.getLogger(__name__)
+
+def source_signature(path: str) -> Optional[Tuple[int, int]]:
+    """The (mtime, size) of path, a file or shard directory, or None if it cannot be read"""
+    try:
+        stat = source_stat(path)
+    except OSError:
+        return None
+    return stat['mtime_ns'], stat['size']
+
+class PlaylistReloader:
+    """Rebuilds the processor off the request path and publishes it atomically"""
+
+    def __init__(self, current: Callable[[], PlaylistDataProcessor],
+                 publish: Callable[[PlaylistDataProcessor], None]):
+        self._current = current
+        self._publish = publish
+        # Held for the whole of a reload; a Lock, so the reload thread can release it
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watcher = None
+        self._loaded_signature = source_signature(current().json_file_path)
+        self._status: Dict[str, Any] = {'state': 'idle', 'reloads': 0, 'songs': len(current().columns['index']),
+                                        'carried_ratings': None, 'duration_s': None, 'finished_at': None,
+                                        'error': None}
+
+    @property
+    def status(self) -> Dict[str, Any]:
+        """State of the running or last reload"""
+        return dict(self._status)
+
+    def reload(self) -> Dict[str, Any]:
+        """Reload now, waiting for any reload already running first; return the resulting status"""
+        with self._lock:
+            self._reload()
+        return self.status
+
+    def start(self) -> bool:
+        """Reload in a background thread; False if a reload is already running"""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            self._status['state'] = 'running'
+            threading.Thread(target=self._reload_and_release, name='playlist-reload', daemon=True).start()
+        except BaseException:
+            self._lock.release()
+            raise
+        return True
+
+    def _reload_and_release(self):
+        try:
+            self._reload()
+        finally:
+            self._lock.release()
+
+    def _reload(self):
+        """Build, hand over and publish a new processor; on failure the current one stays"""
+        current = self._current()
+        self._status['state'] = 'running'
+        # Taken before reading, so a change made while the file is being read triggers another reload
+        self._loaded_signature = source_signature(current.json_file_path)
+        started = time.perf_counter()
+        try:
+            successor = current.build_successor()
+            carried = current.hand_over(successor)
+            self._publish(successor)
+        except Exception as e:
+            logger.error(f"Reload of {current.json_file_path} failed, still serving the previous data: {str(e)}")
+            self._status.update(state='failed', error=str(e), finished_at=time.time())
+            return
+
+        duration = time.perf_counter() - started
+        self._status.update(state='idle', reloads=self._status['reloads'] + 1,
+                            songs=len(successor.columns['index']), carried_ratings=carried,
+                            duration_s=round(duration, 3), finished_at=time.time(), error=None)
+        logger.info(f"Reloaded {self._status['songs']} songs in {duration:.2f}s")
+
+    def watch(self, interval: float):
+        """Poll the source file every interval seconds and reload after it changes"""
+        if self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_source, args=(interval,),
+                                         name='playlist-watcher', daemon=True)
+        self._watcher.start()
+
+    def _watch_source(self, interval: float):
+        pending = None
+        while not self._stopped.wait(interval):
+            signature = source_signature(self._current().json_file_path)
+            if signature is None or signature == self._loaded_signature:
+                pending = None
+                continue
+            if signature != pending:
+                # Changed since the last poll; it may still be being written
+                pending = signature
+                continue
+            pending = None
+            self.reload()
+
+    def close(self):
+        """Stop watching the source file"""
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,194 @@
+"""
+Bounded LRU cache of encoded API responses, with conditional GET support
+
+Responses are cached as encoded JSON bytes, keyed by endpoint path and query
+parameters, and tagged with the data version they were built from: the
+processor's load generation and the ratings version of its snapshot. A
+lookup with any other version is a miss, so every rating write and every
+reload invalidates what it may have changed without scanning the cache.
+
+Each entry carries a weak ETag (a hash of the body) and a Last-Modified
+time that only moves when the body actually changes. Compressed variants
+(gzip, and brotli when the optional package is installed) are made on first
+request and kept with the entry. The cache is bounded both by entry count
+and by the bytes it holds, evicting least recently used entries first.
+"""
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Responses are only gzipped without the brotli package
+    brotli = None
+
+# Smaller bodies are sent uncompressed; compression would barely shrink them
+MIN_COMPRESS_BYTES = 1024
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+def _gzip(body: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+def _brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=5)
+
+_COMPRESSORS = {'br': _brotli, 'gzip': _gzip}
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The best supported content coding the client accepts ('br' or 'gzip'), or None"""
+    if not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    if 'br' in accepted and brotli is not None:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+class CachedResponse:
+    """One cached response body, its validators and its compressed variants"""
+
+    def __init__(self, key: Hashable, version: Hashable, body: bytes, last_modified: float):
+        self.key = key
+        self.version = version
+        self.body = body
+        self.etag = f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.last_modified = last_modified
+        self.encoded: Dict[str, bytes] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+    def headers(self) -> Dict[str, str]:
+        """Validators and caching headers sent with both full and 304 responses"""
+        return {
+            'ETag': self.etag,
+            'Last-Modified': formatdate(self.last_modified, usegmt=True),
+            # Let browsers keep the body but revalidate it on every use
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+
+    def not_modified(self, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+        """Whether a conditional request's validators still match this response"""
+        if if_none_match is not None:
+            # Weak comparison, as for GET; If-Modified-Since is ignored when If-None-Match is present
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            own = self.etag[2:]
+            return any(tag == '*' or tag.removeprefix('W/') == own for tag in tags)
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.last_modified) <= since
+        return False
+
+class ResponseCache:
+    """LRU of CachedResponses bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: 'OrderedDict[Hashable, CachedResponse]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(path: str, query: List[Tuple[str, str]]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        """Key for a request; parameter order is ignored except between repeats of one parameter"""
+        return path, tuple(sorted(query, key=lambda item: item[0]))
+
+    def get(self, key: Hashable, version: Hashable) -> Optional[CachedResponse]:
+        """The entry for key if it was built from data at version, counting the hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, version: Hashable, body: bytes) -> CachedResponse:
+        """Cache body for key at version, keeping Last-Modified if the body did not change"""
+        now = time.time()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            entry = CachedResponse(key, version, body, now)
+            if previous is not None and previous.etag == entry.etag:
+                entry.last_modified = previous.last_modified
+                entry.encoded = previous.encoded
+            if entry.size <= self.max_bytes:
+                self._entries[key] = entry
+                self._bytes += entry.size
+                self._evict()
+        return entry
+
+    def encode(self, entry: CachedResponse, encoding: Optional[str]) -> bytes:
+        """The entry's body in the given content coding, compressing it once on first use"""
+        if encoding is None:
+            return entry.body
+        data = entry.encoded.get(encoding)
+        if data is None:
+            data = _COMPRESSORS[encoding](entry.body)
+            with self._lock:
+                if encoding not in entry.encoded:
+                    entry.encoded[encoding] = data
+                    if self._entries.get(entry.key) is entry:
+                        self._bytes += len(data)
+                        self._evict()
+        return data
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,244 @@
+"""
+Case-folded substring index over song titles
+
+All titles are case-folded and joined into one NUL-separated string. A
+trigram inverted index over that string narrows a query down to a few
+candidate rows, which are then confirmed with a bounded ``str.find`` on the
+joined text. Two-character queries use a bigram index built the same way.
+One-character queries first check a table of the characters present, so a
+miss costs nothing; a hit scans the joined text directly, which is a single
+C-level search that stops at the first match.
+
+Grams are hashed into 32-bit buckets and packed with the row number into
+one uint64 per occurrence, so each index is built with one in-place sort.
+A hash collision only adds a candidate that fails confirmation.
+"""
+import logging
+import sys
+import numpy as np
+from typing import List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+_SEPARATOR = '\x00'
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_FIRST_BLOCK_SIZE = 256
+
+def _code_points(text: str) -> np.ndarray:
+    """The code points of text, lone surrogates (e.g. from \\udcxx escapes in the JSON) included"""
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+def _gram_buckets(codes: np.ndarray, size: int) -> np.ndarray:
+    """Hash each run of size (two or three) code points into a 32-bit bucket"""
+    codes = codes.astype(np.uint64)
+    if size == 2:
+        grams = (codes[:-1] << np.uint64(21)) | codes[1:]
+    else:
+        grams = (codes[:-2] << np.uint64(42)) | (codes[1:-1] << np.uint64(21)) | codes[2:]
+    return (grams * _HASH_MULTIPLIER) >> np.uint64(32)
+
+class _GramPostings:
+    """Ascending rows per hashed gram bucket, for the grams lying entirely inside one title"""
+
+    def __init__(self, codes: np.ndarray, row_of_char: np.ndarray, size: int):
+        self.size = size
+        if len(codes) < size:
+            self.buckets = np.empty(0, dtype=np.uint64)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.rows = np.empty(0, dtype=np.uint32)
+            return
+
+        valid = codes[:len(codes) - size + 1] != 0
+        for shift in range(1, size):
+            valid &= codes[shift:len(codes) - size + 1 + shift] != 0
+
+        keys = (_gram_buckets(codes, size)[valid] << np.uint64(32)) | row_of_char[:len(valid)][valid]
+        del valid
+        keys.sort()
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+        buckets = keys >> np.uint64(32)
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        self.buckets = buckets[starts]
+        self.offsets = np.append(starts, len(keys)).astype(np.int64)
+        self.rows = (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.buckets.nbytes + self.offsets.nbytes + self.rows.nbytes)
+
+    def lists(self, needle: str) -> Optional[List[np.ndarray]]:
+        """The posting list of each distinct gram of needle, or None if one is absent"""
+        codes = _code_points(needle)
+        postings = []
+        for bucket in np.unique(_gram_buckets(codes, self.size)):
+            position = np.searchsorted(self.buckets, bucket)
+            if position == len(self.buckets) or self.buckets[position] != bucket:
+                return None
+            postings.append(self.rows[self.offsets[position]:self.offsets[position + 1]])
+        return postings
+
+class TitleIndex:
+    """Substring index over a column of titles, matching case-insensitively"""
+
+    def __init__(self, titles: Sequence[Optional[str]]):
+        folded = ['' if title is None else str(title).casefold().replace(_SEPARATOR, ' ') for title in titles]
+        lengths = np.fromiter(map(len, folded), dtype=np.int64, count=len(folded))
+
+        self._text = _SEPARATOR.join(folded) + _SEPARATOR
+        self._starts = np.zeros(len(folded) + 1, dtype=np.int64)
+        np.cumsum(lengths + 1, out=self._starts[1:])
+        self._size = len(folded)
+
+        # Rows ordered by folded title, for exact and prefix lookups by bisection
+        self._sorted_rows = np.argsort(np.array(folded, dtype=object), kind='stable')
+
+        codes = _code_points(self._text)
+        # Whether each code point occurs in some title
+        self._present = np.bincount(codes).astype(bool)
+        self._present[0] = False
+        row_of_char = np.repeat(np.arange(self._size, dtype=np.uint64), lengths + 1)
+        self._bigrams = _GramPostings(codes, row_of_char, 2)
+        self._trigrams = _GramPostings(codes, row_of_char, 3)
+        del codes, row_of_char
+        logger.info(f"Built title index over {self._size} titles "
+                    f"({len(self._trigrams.rows)} trigram and {len(self._bigrams.rows)} bigram postings)")
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self._starts, self._sorted_rows, self._present)
+        return (sys.getsizeof(self._text) + sum(int(array.nbytes) for array in arrays)
+                + self._bigrams.nbytes + self._trigrams.nbytes)
+
+    def _title(self, row: int) -> str:
+        return self._text[self._starts[row]:self._starts[row + 1] - 1]
+
+    def _contains(self, row: int, needle: str) -> bool:
+        return self._text.find(needle, self._starts[row], self._starts[row + 1] - 1) != -1
+
+    def _candidate_blocks(self, needle: str):
+        """Yield ascending blocks of rows whose titles contain every gram of needle
+
+        The shortest posting list is walked in growing blocks and each block is
+        intersected with the matching range of the other lists, so a query that
+        matches early stops after touching only a small part of the index.
+        """
+        postings = (self._bigrams if len(needle) == 2 else self._trigrams).lists(needle)
+        if postings is None:
+            return
+
+        postings.sort(key=len)
+        shortest, others = postings[0], postings[1:]
+        start, block_size = 0, _FIRST_BLOCK_SIZE
+        while start < len(shortest):
+            block = shortest[start:start + block_size]
+            for posting in others:
+                low = np.searchsorted(posting, block[0])
+                high = np.searchsorted(posting, block[-1], side='right')
+                block = np.intersect1d(block, posting[low:high], assume_unique=True)
+                if not len(block):
+                    break
+            if len(block):
+                yield block
+            start += block_size
+            block_size *= 2
+
+    def _iter_matches(self, needle: str):
+        """Yield matching rows in catalog order"""
+        if len(needle) >= 2:
+            for block in self._candidate_blocks(needle):
+                for row in block.tolist():
+                    if self._contains(row, needle):
+                        yield row
+            return
+
+        code = ord(needle) if needle else 0
+        if needle and (code >= len(self._present) or not self._present[code]):
+            return
+        position = self._text.find(needle)
+        while position != -1 and position < len(self._text) - 1:
+            row = int(np.searchsorted(self._starts, position, side='right')) - 1
+            end = self._starts[row + 1] - 1
+            if position + len(needle) <= end:
+                yield row
+            # Continue from the next title
+            position = self._text.find(needle, self._starts[row + 1])
+
+    def _lower_bound(self, needle: str, low: int = 0) -> int:
+        """First position in the sorted order, from low on, whose title is >= needle"""
+        # Gallop from low first, so a sweep of sorted needles only bisects the gap between neighbours
+        high, step = self._size, 1
+        while low + step <= high:
+            probe = low + step - 1
+            if self._title(self._sorted_rows[probe]) >= needle:
+                high = probe
+                break
+            low, step = probe + 1, step * 2
+        while low < high:
+            middle = (low + high) // 2
+            if self._title(self._sorted_rows[middle]) < needle:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def first_match(self, title: str) -> Optional[int]:
+        """Row of the first title in catalog order that contains title, or None"""
+        needle = title.casefold()
+        if _SEPARATOR in needle:
+            return None
+        return next(self._iter_matches(needle), None)
+
+    def search(self, title: str, limit: int = 10) -> List[int]:
+        """Rows of up to limit titles containing title, best matches first
+
+        Exact matches rank first, then titles starting with the query, then
+        any other title containing it; ties keep catalog order.
+        """
+        return self.search_many([title], limit)[0]
+
+    def search_many(self, titles: Sequence[str], limit: int = 10) -> List[List[int]]:
+        """search() for each of many titles, resolved together
+
+        Distinct queries are ranked in sorted order, so their exact and prefix
+        matches are found in one forward sweep over the sorted titles, each
+        bisection starting where the previous query's ended. A title repeated
+        in the batch is only searched once.
+        """
+        needles = [title.casefold() for title in titles]
+        ranked, low = {}, 0
+        for needle in sorted(set(needles)):
+            if limit <= 0 or _SEPARATOR in needle:
+                ranked[needle] = []
+                continue
+            low = self._lower_bound(needle, low)
+            ranked[needle] = self._ranked(needle, limit, low)
+        return [list(ranked[needle]) for needle in needles]
+
+    def _ranked(self, needle: str, limit: int, exact_start: int) -> List[int]:
+        """Up to limit rows containing needle, best first, given where needle sorts among the titles"""
+        prefix_end = self._lower_bound(needle + '\U0010FFFF', exact_start)
+        exact_end = exact_start
+        while exact_end < prefix_end and self._title(self._sorted_rows[exact_end]) == needle:
+            exact_end += 1
+
+        results = []
+        for start, end in ((exact_start, exact_end), (exact_end, prefix_end)):
+            rows = self._sorted_rows[start:end]
+            wanted = limit - len(results)
+            if len(rows) > wanted:
+                rows = np.partition(rows, wanted - 1)[:wanted]
+            results.extend(np.sort(rows).tolist())
+            if len(results) >= limit:
+                return results[:limit]
+
+        for row in self._iter_matches(needle):
+            if self._text.startswith(needle, self._starts[row]):
+                continue  # Already ranked as an exact or prefix match
+            results.append(row)
+            if len(results) == limit:
+                break
+        return results
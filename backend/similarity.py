@@ -0,0 +1,106 @@
+"""
+Nearest-neighbour search over the songs' audio features
+
+Each song is a point in the space of its audio features, each feature
+standardized to zero mean and unit variance so tempo and loudness do not
+drown out the 0-1 features. The standardized matrix is built once, as
+float32 with every row's squared norm precomputed, so a query is a series
+of matrix products:
+
+    |q - x|^2 = |x|^2 - 2 q.x + |q|^2
+
+taken over fixed-size blocks of rows. Each block keeps only its k best
+candidates (np.argpartition), which are merged with the running best, so
+memory stays bounded by the block size whatever the catalog size, and many
+queries share each pass over the matrix.
+"""
+import numpy as np
+from typing import Dict, Optional, Sequence, Tuple
+from compact import widen
+
+# The audio features similarity is measured over, when the dataset has them
+SIMILARITY_FEATURES = ('danceability', 'energy', 'loudness', 'acousticness', 'instrumentalness', 'liveness',
+                       'valence', 'tempo')
+SIMILARITY_BLOCK_ROWS = 65_536
+
+class SimilarityIndex:
+    """Exact k-nearest-neighbour search by Euclidean distance over standardized features"""
+
+    def __init__(self, columns: Dict[str, np.ndarray], features: Sequence[str] = SIMILARITY_FEATURES,
+                 block_rows: int = SIMILARITY_BLOCK_ROWS):
+        self.features = [name for name in features if name in columns and columns[name].dtype.kind in 'iuf']
+        self.block_rows = block_rows
+        num_rows = len(columns['index'])
+
+        matrix = np.empty((num_rows, len(self.features)), dtype=np.float32)
+        self.means = np.zeros(len(self.features))
+        self.scales = np.ones(len(self.features))
+        for column, name in enumerate(self.features):
+            values = widen(columns[name]).astype(np.float64)
+            present = ~np.isnan(values)
+            if present.any():
+                self.means[column] = values[present].mean()
+                scale = values[present].std()
+                self.scales[column] = scale if scale > 0 else 1.0
+            # A missing value sits at the feature's mean, so it neither attracts nor repels
+            matrix[:, column] = np.where(present, (values - self.means[column]) / self.scales[column], 0.0)
+
+        self.matrix = matrix
+        self._norms = np.einsum('ij,ij->i', matrix, matrix)
+
+    def __len__(self) -> int:
+        return len(self.matrix)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes + self._norms.nbytes)
+
+    def nearest(self, positions: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The k nearest rows to each row in positions, excluding the row itself
+
+        Returns (neighbours, distances), each shaped (len(positions), k) and
+        ordered nearest first; k is capped at the number of other rows.
+        """
+        if not self.features:
+            raise ValueError(f"The dataset has none of the similarity features {list(SIMILARITY_FEATURES)}")
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        k = min(k, len(self.matrix) - 1)
+        if k < 1 or not len(positions):
+            return (np.empty((len(positions), 0), dtype=np.int64),
+                    np.empty((len(positions), 0), dtype=np.float32))
+        return self.search(self.matrix[positions], k, exclude=positions)
+
+    def search(self, queries: np.ndarray, k: int,
+               exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """The k nearest rows to each standardized query vector, skipping exclude[i] for query i"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, len(self.features))
+        num_queries = len(queries)
+        rows = np.arange(num_queries)
+        best_rows = np.empty((num_queries, 0), dtype=np.int64)
+        best_scores = np.empty((num_queries, 0), dtype=np.float32)
+
+        for start in range(0, len(self.matrix), self.block_rows):
+            block = self.matrix[start:start + self.block_rows]
+            # |x|^2 - 2 q.x ranks rows like the squared distance; |q|^2 is added at the end
+            scores = self._norms[start:start + len(block)] - 2 * (queries @ block.T)
+            if exclude is not None:
+                inside = (exclude >= start) & (exclude < start + len(block))
+                scores[rows[inside], exclude[inside] - start] = np.inf
+
+            if len(block) > k:
+                keep = np.argpartition(scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+            else:
+                keep = np.broadcast_to(np.arange(len(block)), scores.shape)
+            best_rows = np.concatenate([best_rows, keep + start], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+
+            if best_rows.shape[1] > k:
+                keep = np.argpartition(best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        order = np.argsort(best_scores, axis=1, kind='stable')
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        squared = np.take_along_axis(best_scores, order, axis=1) + np.einsum('ij,ij->i', queries, queries)[:, None]
+        return best_rows, np.sqrt(np.maximum(squared, 0))
@@ -0,0 +1,284 @@
+"""
+Binary columnar snapshots of the normalized playlist data
+
+A snapshot is a directory of ``.npy`` files, one per column, described by a
+``current.json`` file next to it. Numeric columns are memory-mapped on load, so
+a warm start only pays for the pages it touches. String columns are stored
+as one UTF-8 blob joined on NUL characters and decoded with a single split,
+passing through the lone surrogates that \\udcxx escapes in the source leave;
+Arrow string columns (the compact layout) are stored as their offsets and
+UTF-8 data buffers and mapped back without decoding anything.
+
+Snapshots are keyed by the source's path, size, mtime and content hash; a
+source is a playlist file or a directory of shard files (see
+parallel_ingest). Size and mtime are checked first; the content hash is only
+recomputed when they differ, so touching the source without changing it
+still reuses the snapshot, while any real change triggers a rebuild.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+from typing import Dict, List, Optional
+from compact import is_arrow_strings
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots still work, but without cross-process locking
+    fcntl = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Only needed for snapshots of compact columns
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT_VERSION = 2
+SHARED_RATINGS_FILE = 'star_rating.shared.npy'
+_HASH_BLOCK_SIZE = 1 << 20
+_STRING_SEPARATOR = '\x00'
+
+def source_files(source_path: str) -> List[str]:
+    """The files a playlist source consists of: the file itself, or a directory's .json shards by name"""
+    if not os.path.isdir(source_path):
+        return [source_path]
+    return [os.path.join(source_path, entry) for entry in sorted(os.listdir(source_path))
+            if entry.endswith('.json') and os.path.isfile(os.path.join(source_path, entry))]
+
+def content_hash(path: str) -> str:
+    """Return the BLAKE2b digest of a file, or of a shard directory's shard names and contents, read in fixed-size blocks"""
+    digest = hashlib.blake2b(digest_size=20)
+    for file_path in source_files(path):
+        if file_path != path:
+            digest.update(os.path.basename(file_path).encode('utf-8') + b'\0')
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def snapshot_root(source_path: str, cache_dir: str) -> str:
+    """Directory holding every snapshot generation for one source file"""
+    source_path = os.path.abspath(source_path)
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    path_key = hashlib.blake2b(source_path.encode('utf-8'), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, f'{stem}-{path_key}')
+
+def source_stat(source_path: str) -> Dict[str, int]:
+    """Size and mtime of a source file; for a shard directory, the shards' total size and the latest mtime"""
+    stat = os.stat(source_path)
+    if not os.path.isdir(source_path):
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    # The directory's own mtime changes when shards are added, removed or renamed
+    shards = [os.stat(path) for path in source_files(source_path)]
+    return {'size': sum(shard.st_size for shard in shards),
+            'mtime_ns': max([stat.st_mtime_ns] + [shard.st_mtime_ns for shard in shards])}
+
+def _read_current(root: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(root, 'current.json'), 'r', encoding='utf-8') as file:
+            current = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if current.get('format') != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return current
+
+def _write_json_atomic(path: str, payload: dict):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+        json.dump(payload, file)
+    os.replace(tmp_path, path)
+
+def _save_strings(directory: str, name: str, values: np.ndarray) -> dict:
+    nulls = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    texts = values.copy()
+    texts[nulls] = ''
+    try:
+        joined = _STRING_SEPARATOR.join(texts)
+    except TypeError:
+        joined = None
+    if joined is None or joined.count(_STRING_SEPARATOR) != max(len(values) - 1, 0):
+        # Non-string values, or strings containing the separator, are pickled instead
+        np.save(os.path.join(directory, f'{name}.npy'), values, allow_pickle=True)
+        return {'kind': 'objects', 'file': f'{name}.npy'}
+
+    np.save(os.path.join(directory, f'{name}.npy'), np.frombuffer(joined.encode('utf-8', 'surrogatepass'), dtype=np.uint8))
+    spec = {'kind': 'strings', 'file': f'{name}.npy', 'length': len(values)}
+    if nulls.any():
+        np.save(os.path.join(directory, f'{name}.nulls.npy'), nulls)
+        spec['nulls'] = f'{name}.nulls.npy'
+    return spec
+
+def _save_arrow_strings(directory: str, name: str, values) -> dict:
+    array = pa.array(values, type=pa.string())
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32)[array.offset:array.offset + len(array) + 1]
+    data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.empty(0, dtype=np.uint8)
+    np.save(os.path.join(directory, f'{name}.npy'), offsets - offsets[0])
+    np.save(os.path.join(directory, f'{name}.data.npy'), data[offsets[0]:offsets[-1]])
+    spec = {'kind': 'arrow_strings', 'file': f'{name}.npy', 'data': f'{name}.data.npy', 'length': len(array)}
+    if array.null_count:
+        np.save(os.path.join(directory, f'{name}.nulls.npy'), array.is_null().to_numpy(zero_copy_only=False))
+        spec['nulls'] = f'{name}.nulls.npy'
+    return spec
+
+def _load_arrow_strings(directory: str, spec: dict):
+    if pa is None:
+        raise ValueError("Reading compact string columns needs pyarrow")
+    offsets = np.load(os.path.join(directory, spec['file']), mmap_mode='r')
+    data = np.load(os.path.join(directory, spec['data']), mmap_mode='r')
+    validity, null_count = None, 0
+    if 'nulls' in spec:
+        nulls = np.load(os.path.join(directory, spec['nulls']))
+        validity, null_count = pa.py_buffer(np.packbits(~nulls, bitorder='little')), int(nulls.sum())
+    # The mapped files back the Arrow buffers directly
+    array = pa.StringArray.from_buffers(spec['length'], pa.py_buffer(offsets), pa.py_buffer(data),
+                                        validity, null_count)
+    import pandas as pd
+    return pd.arrays.ArrowStringArray(pa.chunked_array([array]))
+
+def _load_strings(directory: str, spec: dict) -> np.ndarray:
+    blob = np.load(os.path.join(directory, spec['file']), mmap_mode='r')
+    values = np.empty(spec['length'], dtype=object)
+    if spec['length']:
+        values[:] = blob.tobytes().decode('utf-8', 'surrogatepass').split(_STRING_SEPARATOR)
+    if 'nulls' in spec:
+        values[np.load(os.path.join(directory, spec['nulls']))] = None
+    return values
+
+def write_snapshot(source_path: str, cache_dir: str, columns: Dict[str, np.ndarray],
+                   source_hash: Optional[str] = None) -> str:
+    """Write the normalized columns for source_path and mark them current
+
+    Each generation is written to a temporary directory and renamed into
+    place, and ``current.json`` is replaced atomically last, so concurrent
+    readers never see a partial snapshot. Older generations are removed.
+    """
+    root = snapshot_root(source_path, cache_dir)
+    os.makedirs(root, exist_ok=True)
+    stat = source_stat(source_path)
+    source_hash = source_hash or content_hash(source_path)
+
+    tmp_dir = tempfile.mkdtemp(dir=root, prefix='.building-')
+    try:
+        specs = {}
+        for position, (name, values) in enumerate(columns.items()):
+            file_name = f'{position:03d}'
+            if is_arrow_strings(values):
+                specs[name] = _save_arrow_strings(tmp_dir, file_name, values)
+            elif values.dtype == object:
+                specs[name] = _save_strings(tmp_dir, file_name, values)
+            else:
+                np.save(os.path.join(tmp_dir, f'{file_name}.npy'), values)
+                specs[name] = {'kind': 'array', 'file': f'{file_name}.npy'}
+
+        generation = os.path.join(root, source_hash)
+        if os.path.exists(generation):
+            shutil.rmtree(tmp_dir)
+        else:
+            os.rename(tmp_dir, generation)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    _write_json_atomic(os.path.join(root, 'current.json'), {
+        'format': SNAPSHOT_FORMAT_VERSION,
+        'source': os.path.abspath(source_path),
+        'size': stat['size'],
+        'mtime_ns': stat['mtime_ns'],
+        'hash': source_hash,
+        'columns': specs,
+    })
+
+    for entry in os.listdir(root):
+        entry_path = os.path.join(root, entry)
+        if os.path.isdir(entry_path) and entry != source_hash and not entry.startswith('.building-'):
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+    logger.info(f"Wrote snapshot {generation}")
+    return generation
+
+def load_snapshot(source_path: str, cache_dir: str) -> Optional[Dict[str, np.ndarray]]:
+    """Return memory-mapped columns for source_path, or None if no fresh snapshot exists"""
+    root = snapshot_root(source_path, cache_dir)
+    current = _read_current(root)
+    if current is None:
+        return None
+
+    stat = source_stat(source_path)
+    if stat['size'] != current['size']:
+        return None
+    if stat['mtime_ns'] != current['mtime_ns']:
+        if content_hash(source_path) != current['hash']:
+            return None
+        # Same content under a new mtime: keep the snapshot, remember the new stat
+        _write_json_atomic(os.path.join(root, 'current.json'), {**current, **stat})
+
+    generation = os.path.join(root, current['hash'])
+    try:
+        columns = {}
+        for name, spec in current['columns'].items():
+            if spec['kind'] == 'strings':
+                columns[name] = _load_strings(generation, spec)
+            elif spec['kind'] == 'arrow_strings':
+                columns[name] = _load_arrow_strings(generation, spec)
+            elif spec['kind'] == 'objects':
+                columns[name] = np.load(os.path.join(generation, spec['file']), allow_pickle=True)
+            else:
+                columns[name] = np.load(os.path.join(generation, spec['file']), mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable snapshot {generation}: {str(e)}")
+        return None
+
+    logger.info(f"Loaded snapshot {generation}")
+    return columns
+
+@contextmanager
+def snapshot_lock(source_path: str, cache_dir: str):
+    """Hold an exclusive cross-process lock on the snapshots of one source file
+
+    Worker processes that start together take this lock around load-or-build,
+    so exactly one of them parses the source and publishes the snapshot while
+    the others wait and then attach to it.
+    """
+    root = snapshot_root(source_path, cache_dir)
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+def open_shared_ratings(source_path: str, cache_dir: str, length: int, dtype) -> np.memmap:
+    """Map the writable rating column shared by every process using the current snapshot
+
+    The file lives inside the snapshot generation, so its row positions always
+    match the mapped columns. It is created zero-filled on first use; writes
+    through the returned map are visible to all processes mapping it.
+    """
+    root = snapshot_root(source_path, cache_dir)
+    current = _read_current(root)
+    if current is None:
+        raise FileNotFoundError(f"No snapshot published for {source_path}")
+
+    path = os.path.join(root, current['hash'], SHARED_RATINGS_FILE)
+    if not os.path.exists(path):
+        ratings = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=dtype, shape=(length,))
+        ratings.flush()
+        del ratings
+        os.replace(path + '.tmp', path)
+
+    ratings = np.load(path, mmap_mode='r+')
+    if ratings.shape != (length,) or ratings.dtype != np.dtype(dtype):
+        raise ValueError(f"Shared ratings file {path} does not match the dataset")
+    return ratings
@@ -0,0 +1,254 @@
+"""
+Sorted, filtered views over the normalized song columns
+
+Each sort key's ordering is computed once with a stable argsort and cached,
+as is the result of each recent (sort, filters) combination, so paging deep
+into a sorted or filtered listing only slices a precomputed position array.
+Orderings that depend on star_rating are keyed by the ratings version of
+the snapshot they were computed from and recomputed after ratings change.
+With track_ratings=False (shared mode, where other processes write the
+rating column without bumping this process's version) they are never
+cached.
+Every query reads one DataSnapshot throughout, so results stay consistent
+while ratings are being written. Missing ids and titles sort after every
+other value, as NaN does in numeric columns.
+
+Keyset cursors name the last row of a page by its sort value and row
+position; resolving one is a binary search over the cached ordering. A
+cursor also carries a digest of the filters it was made under, and is
+rejected by a query with other filters or a sort value of the wrong type.
+"""
+import base64
+import hashlib
+import json
+import re
+from collections import OrderedDict
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+from compact import to_python_list
+from data_engine import DataSnapshot
+
+FILTER_OPERATORS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '=': np.equal,
+    '==': np.equal,
+}
+_FILTER_PATTERN = re.compile(r'^\s*(\w+)\s*(>=|<=|==|=|>|<)\s*(\S+)\s*$')
+_MAX_CACHED_QUERIES = 32
+
+Filter = Tuple[str, str, float]
+
+def parse_filter(expression: str) -> Filter:
+    """Parse a filter such as 'energy>0.7' into (column, operator, value)"""
+    match = _FILTER_PATTERN.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter '{expression}', expected e.g. 'energy>0.7'")
+    column, operator, value = match.groups()
+    try:
+        return column, operator, float(value)
+    except ValueError:
+        raise ValueError(f"Invalid filter value in '{expression}'")
+
+def _filters_digest(filters: List[Filter]) -> str:
+    """A short digest identifying a set of filters, whatever their order"""
+    return hashlib.sha1(json.dumps(sorted(filters)).encode('utf-8')).hexdigest()[:16]
+
+def _fits(value, values: np.ndarray) -> bool:
+    """Whether a decoded cursor value can be compared with sort values of this dtype"""
+    kind = values.dtype.kind
+    if kind == 'O':
+        return value is None or isinstance(value, str)
+    if kind == 'b' or isinstance(value, bool):
+        return kind == 'b' and isinstance(value, bool)
+    if kind in 'iu':
+        return isinstance(value, int)
+    return kind == 'f' and isinstance(value, (int, float))
+
+def _text_ordering(values) -> np.ndarray:
+    """Stable ascending order of a text column, missing values (None or NA) last"""
+    if isinstance(values, np.ndarray):
+        present = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+    else:
+        present = ~np.asarray(values.isna(), dtype=bool)
+    rows = np.flatnonzero(present)
+    return np.concatenate((rows[np.argsort(values[rows], kind='stable')], np.flatnonzero(~present)))
+
+def _argsort(values) -> np.ndarray:
+    """Stable ascending order of a column"""
+    if values.dtype.kind == 'O':
+        return _text_ordering(values)
+    return np.argsort(values, kind='stable')
+
+def _present_count(values) -> int:
+    """How many of text values, sorted with missing values last, are present"""
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if isinstance(values[middle], str):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+class SongQuery:
+    """Cached orderings and filtered position lists over the published dataset snapshots"""
+
+    def __init__(self, snapshot: Callable[[], DataSnapshot], track_ratings: bool = True):
+        self._snapshot = snapshot
+        self._track_ratings = track_ratings
+        self._orderings: Dict[str, Tuple[int, np.ndarray]] = {}
+        self._results: 'OrderedDict[tuple, Tuple[int, np.ndarray, np.ndarray]]' = OrderedDict()
+        columns = snapshot().columns
+        self.numeric_columns = [name for name, values in columns.items() if values.dtype.kind in 'iufb']
+        self.sortable_columns = self.numeric_columns + [name for name in ('id', 'title') if name in columns]
+
+    def _version_for(self, names, snapshot: DataSnapshot) -> Optional[int]:
+        """The version a result over names is cached under; None when it must not be cached"""
+        if 'star_rating' not in names:
+            return 0
+        return snapshot.ratings_version if self._track_ratings else None
+
+    def _ordering(self, sort_by: str, snapshot: DataSnapshot) -> np.ndarray:
+        version = self._version_for((sort_by,), snapshot)
+        if version is None:
+            return _argsort(snapshot.columns[sort_by])
+        cached = self._orderings.get(sort_by)
+        if cached is None or cached[0] != version:
+            cached = (version, _argsort(snapshot.columns[sort_by]))
+            self._orderings[sort_by] = cached
+        return cached[1]
+
+    def validate(self, sort_by: Optional[str], filters: List[Filter]):
+        """Raise ValueError for unknown sort keys, filter columns or operators"""
+        if sort_by is not None and sort_by not in self.sortable_columns:
+            raise ValueError(f"Cannot sort by '{sort_by}'; choose one of {self.sortable_columns}")
+        for column, operator, _ in filters:
+            if column not in self.numeric_columns:
+                raise ValueError(f"Cannot filter on '{column}'; choose one of {self.numeric_columns}")
+            if operator not in FILTER_OPERATORS:
+                raise ValueError(f"Unknown filter operator '{operator}'")
+
+    def positions(self, sort_by: Optional[str], filters: List[Filter],
+                  snapshot: Optional[DataSnapshot] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions matching every filter in ascending sort order, with their sort values
+
+        Without a sort key, rows stay in catalog order and the row positions
+        double as the sort values. Reads the current snapshot unless one is given.
+        """
+        self.validate(sort_by, filters)
+        snapshot = snapshot or self._snapshot()
+        columns = snapshot.columns
+        filters = tuple(sorted(filters))
+        names = {column for column, _, _ in filters} | {sort_by}
+        key = (sort_by, filters)
+        version = self._version_for(names, snapshot)
+
+        # Cache bookkeeping tolerates concurrent callers: a racing eviction is just a miss
+        cached = self._results.get(key) if version is not None else None
+        if cached is not None and cached[0] == version:
+            try:
+                self._results.move_to_end(key)
+            except KeyError:
+                pass
+            return cached[1], cached[2]
+
+        mask = None
+        for column, operator, value in filters:
+            condition = FILTER_OPERATORS[operator](columns[column], value)
+            mask = condition if mask is None else mask & condition
+
+        if sort_by is None:
+            positions = np.arange(len(columns['index'])) if mask is None else np.flatnonzero(mask)
+            values = positions
+        else:
+            positions = self._ordering(sort_by, snapshot)
+            if mask is not None:
+                positions = positions[mask[positions]]
+            values = columns[sort_by][positions]
+
+        if version is None:
+            return positions, values
+        self._results[key] = (version, positions, values)
+        while len(self._results) > _MAX_CACHED_QUERIES:
+            try:
+                self._results.popitem(last=False)
+            except KeyError:
+                break
+        return positions, values
+
+    def page(self, sort_by: Optional[str], descending: bool, filters: List[Filter],
+             start: int, size: int, cursor: Optional[str] = None,
+             snapshot: Optional[DataSnapshot] = None) -> Tuple[np.ndarray, int, Optional[str]]:
+        """Return (row positions for one page, total matches, cursor for the next page)
+
+        With a cursor, the page starts right after the row the cursor names and
+        start is ignored.
+        """
+        positions, values = self.positions(sort_by, filters, snapshot)
+        total = len(positions)
+
+        if cursor is not None:
+            start = self._seek(positions, values, sort_by, descending, filters, cursor)
+
+        if descending:
+            # The descending order is the ascending one reversed
+            end = max(total - start, 0)
+            page_positions = positions[max(end - size, 0):end][::-1]
+        else:
+            page_positions = positions[start:start + size]
+        next_start = start + len(page_positions)
+
+        next_cursor = None
+        if len(page_positions) and next_start < total:
+            last = len(positions) - next_start if descending else next_start - 1
+            # Float32 sort values are encoded as the decimal they were parsed from
+            value = to_python_list(values[last:last + 1])[0]
+            next_cursor = self._encode_cursor(sort_by, descending, filters, value, positions[last])
+        return page_positions, total, next_cursor
+
+    def _seek(self, positions: np.ndarray, values: np.ndarray, sort_by: Optional[str],
+              descending: bool, filters: List[Filter], cursor: str) -> int:
+        """Offset, in the requested direction, of the first row after the cursor's row"""
+        cursor_sort, cursor_descending, digest, value, row = self._decode_cursor(cursor)
+        if cursor_sort != sort_by or cursor_descending != descending:
+            raise ValueError("Cursor does not belong to this sort order")
+        if digest != _filters_digest(filters):
+            raise ValueError("Cursor does not belong to these filters")
+        if not _fits(value, values):
+            raise ValueError("Invalid cursor")
+        if values.dtype.kind == 'f':
+            # Compare in the column's precision, so a float32 value finds itself
+            value = values.dtype.type(value)
+
+        if values.dtype.kind == 'O':
+            # Missing text sorts last and cannot be compared, so search only the present values
+            present = _present_count(values)
+            if value is None:
+                low, high = present, len(values)
+            else:
+                low = np.searchsorted(values[:present], value, side='left')
+                high = np.searchsorted(values[:present], value, side='right')
+        else:
+            low = np.searchsorted(values, value, side='left')
+            high = np.searchsorted(values, value, side='right')
+        if descending:
+            # Rows before the cursor's row in ascending order come after it in descending order
+            return len(positions) - (low + int(np.searchsorted(positions[low:high], row, side='left')))
+        return low + int(np.searchsorted(positions[low:high], row, side='right'))
+
+    @staticmethod
+    def _encode_cursor(sort_by: Optional[str], descending: bool, filters: List[Filter], value, row) -> str:
+        payload = json.dumps([sort_by, descending, _filters_digest(filters),
+                              value.item() if hasattr(value, 'item') else value, int(row)])
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor: str):
+        try:
+            sort_by, descending, digest, value, row = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return sort_by, bool(descending), digest, value, int(row)
+        except (ValueError, TypeError):
+            raise ValueError("Invalid cursor")
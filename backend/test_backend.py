@@ -3,15 +3,47 @@
 Unit tests for the playlist API backend
 """
 import unittest
+import asyncio
 import sys
 import os
+import base64
+import subprocess
+import gzip
 import json
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
 from unittest.mock import Mock, patch
 
 # Add the backend directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from data_processor import PlaylistDataProcessor
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import main
+import export
+from data_processor import PlaylistDataProcessor, _convert_values
+from json_stream import stream_columns, DEFAULT_CHUNK_SIZE
+from column_stats import ColumnStats
+import compact
+from compact import DerivedColumn, compact_columns, to_python_list
+from id_index import HashedIdIndex
+from metrics import MetricsRegistry
+import parallel_ingest
+from parallel_ingest import attribute_ranges, ingest_columns, split_range
+from playlist_registry import PlaylistRegistry
+from profiler import SamplingProfiler
+from rating_feed import MAX_WATCHED_SONGS, RatingFeed
+from rating_store import RatingStore
+from search_index import TitleIndex
+from reloader import PlaylistReloader, source_signature
+from similarity import SIMILARITY_FEATURES, SimilarityIndex
+import response_cache
+from response_cache import ResponseCache
 
 class TestDataProcessor(unittest.TestCase):
     """Test the PlaylistDataProcessor class"""
@@ -65,7 +97,173 @@ class TestDataProcessor(unittest.TestCase):
         self.assertEqual(df.iloc[0]['title'], 'Test Song 1')
         self.assertEqual(df.iloc[1]['title'], 'Test Song 2')
         self.assertEqual(df.iloc[0]['duration_s'], 180.0)
-    
+
+    def test_load_column_dtypes(self):
+        """Test that columns are built with the schema dtypes"""
+        df = self.processor.load_and_normalize()
+
+        self.assertEqual(df['danceability'].dtype, np.float64)
+        self.assertEqual(df['duration_ms'].dtype, np.int64)
+        self.assertEqual(df['title'].dtype, object)
+        self.assertEqual(list(df['index']), [0, 1])
+
+    def test_load_non_contiguous_and_missing_keys(self):
+        """Test rows keyed out of order, with gaps and with missing values"""
+        with open(self.test_json_path, 'w') as f:
+            json.dump({
+                "id": {"5": "test_id_3", "0": "test_id_1", "2": "test_id_2"},
+                "title": {"0": "Test Song 1", "2": "Test Song 2", "5": "Test Song 3"},
+                "energy": {"0": 0.6, "5": 0.9},
+                "duration_ms": {"0": 180000, "2": 200000, "5": 220000}
+            }, f)
+
+        df = self.processor.load_and_normalize()
+
+        self.assertEqual(list(df['index']), [0, 2, 5])
+        self.assertEqual(list(df['id']), ['test_id_1', 'test_id_2', 'test_id_3'])
+        self.assertTrue(np.isnan(df.iloc[1]['energy']))
+        self.assertEqual(df.iloc[2]['duration_s'], 220.0)
+
+    def test_sort_text_column_with_gaps(self):
+        """Test that sorting by a title with missing values puts them last and cursors walk past them"""
+        with open(self.test_json_path, 'w') as f:
+            json.dump({
+                "id": {"0": "test_id_1", "1": "test_id_2", "2": "test_id_3", "3": "test_id_4", "4": "test_id_5"},
+                "title": {"0": "Zed", "2": "Alpha", "3": "Mid"},
+                "energy": {"0": 0.1, "1": 0.2, "2": 0.3, "3": 0.4, "4": 0.5}
+            }, f)
+
+        for compact in (False, True):
+            processor = PlaylistDataProcessor(self.test_json_path, compact=compact)
+            processor.load_and_normalize()
+            for descending, expected in ((False, [2, 3, 0, 1, 4]), (True, [4, 1, 0, 3, 2])):
+                positions, total, _ = processor.query.page('title', descending, [], 0, 5)
+                self.assertEqual((list(positions), total), (expected, 5))
+
+                # One row per page, so cursors land on missing titles too
+                walked, cursor = [], None
+                while True:
+                    positions, _, cursor = processor.query.page('title', descending, [], 0, 1, cursor=cursor)
+                    walked += list(positions)
+                    if cursor is None:
+                        break
+                self.assertEqual(walked, expected)
+
+    def test_streaming_load_matches_memory_load(self):
+        """Test that the streaming loader produces the same frame for any chunk size"""
+        with open(self.test_json_path, 'w') as f:
+            json.dump({
+                "id": {"1": "test_id_2", "0": "test_id_1", "4": "test_id_3"},
+                "title": {"0": 'Say "hi", {ok}', "1": "Test Song 2", "4": "Café,\""},
+                "energy": {"0": 0.6, "4": None},
+                "duration_ms": {"0": 180000, "1": 200000, "4": 220000}
+            }, f, indent=1)
+
+        expected = self.processor.load_and_normalize()
+        for chunk_size in (1, 7, 64, DEFAULT_CHUNK_SIZE):
+            columns = stream_columns(self.test_json_path, _convert_values, chunk_size)
+            pd.testing.assert_frame_equal(pd.DataFrame(self.processor._finalize_columns(columns)), expected)
+
+        streaming = PlaylistDataProcessor(self.test_json_path, load_mode='streaming')
+        pd.testing.assert_frame_equal(streaming.load_and_normalize(), expected)
+
+        with self.assertRaises(ValueError):
+            PlaylistDataProcessor(self.test_json_path, load_mode='lazy')
+
+    def test_snapshot_cache(self):
+        """Test that a warm load uses the snapshot and a changed source rebuilds it"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            expected = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir).load_and_normalize()
+
+            with patch.object(PlaylistDataProcessor, '_parse_columns') as parse:
+                warm = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir).load_and_normalize()
+                parse.assert_not_called()
+            pd.testing.assert_frame_equal(warm, expected)
+
+            # Touching the file without changing it keeps the snapshot
+            os.utime(self.test_json_path, ns=(0, 0))
+            with patch.object(PlaylistDataProcessor, '_parse_columns') as parse:
+                PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir).load_and_normalize()
+                parse.assert_not_called()
+
+            self.mock_data['title']['1'] = 'Renamed Song'
+            with open(self.test_json_path, 'w') as f:
+                json.dump(self.mock_data, f)
+            rebuilt = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir).load_and_normalize()
+            self.assertEqual(rebuilt.iloc[1]['title'], 'Renamed Song')
+
+            # A lone surrogate from a \udcxx escape survives the snapshot round trip
+            self.mock_data['title']['1'] = 'Bad \udcff'
+            with open(self.test_json_path, 'w') as f:
+                json.dump(self.mock_data, f)
+            PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir).load_and_normalize()
+            warm = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir).load_and_normalize()
+            self.assertEqual(warm.iloc[1]['title'], 'Bad \udcff')
+
+    def test_load_timings(self):
+        """Test that each load records the phases it went through"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir)
+            cold.load_and_normalize()
+            warm = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir)
+            warm.load_and_normalize()
+
+        for phase in ('parse', 'snapshot_write', 'finalize', 'title_index', 'id_index', 'total'):
+            self.assertIn(phase, cold.load_timings)
+        self.assertNotIn('parse', warm.load_timings)
+        self.assertIn('snapshot_load', warm.load_timings)
+        self.assertTrue(all(seconds >= 0 for seconds in warm.load_timings.values()))
+        self.assertEqual(max(cold.load_timings.values()), cold.load_timings['total'])
+
+    def test_shared_mode_ratings_visible_across_processors(self):
+        """Test that processors attached to one shared snapshot see each other's ratings"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            writer = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir, shared=True)
+            reader = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir, shared=True)
+            writer.load_and_normalize()
+            df = reader.load_and_normalize()
+
+            self.assertTrue(writer.update_star_rating('test_id_2', 4))
+            self.assertEqual(df[df['id'] == 'test_id_2']['star_rating'].iloc[0], 4)
+
+        with self.assertRaises(ValueError):
+            PlaylistDataProcessor(self.test_json_path, shared=True)
+
+    def test_shared_mode_rating_orderings_not_stale(self):
+        """Test that rating sorts and filters see another processor's writes to the shared column"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            writer = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir, shared=True)
+            reader = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir, shared=True)
+            writer.load_and_normalize()
+            reader.load_and_normalize()
+            rated = [('star_rating', '>=', 5.0)]
+
+            # Computed once before the write, as a cache would keep them
+            self.assertEqual(reader.query.page('star_rating', True, [], 0, 1)[0].tolist(), [1])
+            self.assertEqual(reader.query.page(None, False, rated, 0, 10)[1], 0)
+
+            self.assertTrue(writer.update_star_rating('test_id_1', 5))
+            self.assertEqual(reader.query.page('star_rating', True, [], 0, 1)[0].tolist(), [0])
+            self.assertEqual(reader.query.page(None, False, rated, 0, 10)[1], 1)
+
+    def test_shared_mode_rating_aggregates_not_stale(self):
+        """Test that rating histograms and scatters see another processor's writes to the shared column"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            writer = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir, shared=True)
+            reader = PlaylistDataProcessor(self.test_json_path, cache_dir=cache_dir, shared=True)
+            writer.load_and_normalize()
+            reader.load_and_normalize()
+            edges = [0, 1, 2, 3, 4, 5, 6]
+
+            self.assertEqual(reader.aggregates.histogram('star_rating', edges)['counts'], [2, 0, 0, 0, 0, 0])
+            self.assertEqual(reader.aggregates.scatter('index', 'star_rating')['points']['y'], [0.0, 0.0])
+            # Columns without ratings are still cached
+            self.assertIs(reader.aggregates.histogram('energy'), reader.aggregates.histogram('energy'))
+
+            self.assertTrue(writer.update_star_rating('test_id_1', 5))
+            self.assertEqual(reader.aggregates.histogram('star_rating', edges)['counts'], [1, 0, 0, 0, 0, 1])
+            self.assertEqual(reader.aggregates.scatter('index', 'star_rating')['points']['y'], [5.0, 0.0])
+
     def test_get_song_by_title(self):
         """Test song search by title"""
         self.processor.load_and_normalize()
@@ -89,6 +287,42 @@ class TestDataProcessor(unittest.TestCase):
         # Test no match
         song = self.processor.get_song_by_title('Nonexistent Song')
         self.assertIsNone(song)
+        
+        # Regex metacharacters are matched literally
+        self.assertIsNone(self.processor.get_song_by_title('Song ('))
+        self.assertIsNotNone(self.processor.get_song_by_title('t s'))
+    
+    def test_search_songs_ranked(self):
+        """Test ranked title search with a limit"""
+        self.mock_data['title'] = {"0": "Encore: Test", "1": "test"}
+        with open(self.test_json_path, 'w') as f:
+            json.dump(self.mock_data, f)
+        self.processor.load_and_normalize()
+        
+        songs = self.processor.search_songs('TEST', limit=5)
+        self.assertEqual([song['id'] for song in songs], ['test_id_2', 'test_id_1'])
+        self.assertEqual(len(self.processor.search_songs('test', limit=1)), 1)
+        self.assertEqual(self.processor.search_songs('missing', limit=5), [])
+        
+        # The index follows a reload of changed data
+        self.mock_data['title'] = {"0": "Other", "1": "Another"}
+        with open(self.test_json_path, 'w') as f:
+            json.dump(self.mock_data, f)
+        self.processor.load_and_normalize()
+        self.assertIsNone(self.processor.get_song_by_title('test'))
+    
+    def test_short_title_queries_match_brute_force(self):
+        """Test that one- and two-character queries, answered from the bigram and character tables, match a scan"""
+        # A lone surrogate, as a \udcxx escape in the JSON gives, must not break the index
+        titles = ['Zz Top', 'a', '', None, 'ab', 'Ba', 'Çava', 'xa\x00b', 'AAB', 'b a', 'bad\udcff', '\udcffz']
+        index = TitleIndex(titles)
+        folded = ['' if title is None else title.casefold().replace('\x00', ' ') for title in titles]
+        for query in ('a', 'b', 'z', 'ç', 'q', 'ab', 'Ba', 'zz', 'aa', 'a b', ' ', 'qx', '\x00',
+                      '\udcff', 'd\udcff', '\udcffz', 'ad\udcff', 'bad\udcff'):
+            needle = query.casefold()
+            expected = [] if '\x00' in needle else [row for row, title in enumerate(folded) if needle in title]
+            self.assertEqual(index.first_match(query), expected[0] if expected else None, query)
+            self.assertEqual(sorted(index.search(query, limit=len(titles))), expected, query)
     
     def test_update_star_rating(self):
         """Test star rating update"""
@@ -130,6 +364,37 @@ class TestDataProcessor(unittest.TestCase):
         
         self.assertEqual(len(df_from_csv), len(original_df))
         self.assertEqual(list(df_from_csv.columns), list(original_df.columns))
+    
+    def test_save_to_ndjson(self):
+        """Test newline-delimited JSON export"""
+        df = self.processor.load_and_normalize()
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'songs.ndjson')
+            self.processor.save_to_ndjson(path, columns=['id', 'energy'])
+            restored = pd.read_json(path, lines=True, dtype=False)
+        
+        pd.testing.assert_frame_equal(restored, df[['id', 'energy']])
+    
+    @unittest.skipUnless(export.pa is not None, "pyarrow is not installed")
+    def test_save_to_parquet_and_arrow_keep_dtypes(self):
+        """Test Parquet and Arrow exports round-trip values and dtypes"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        df = self.processor.load_and_normalize()
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parquet_path = os.path.join(tmp_dir, 'songs.parquet')
+            arrow_path = os.path.join(tmp_dir, 'songs.arrows')
+            self.processor.save_to_parquet(parquet_path)
+            self.processor.save_to_arrow(arrow_path)
+            from_parquet = pq.read_table(parquet_path).to_pandas()
+            with pa.ipc.open_stream(arrow_path) as reader:
+                from_arrow = reader.read_all().to_pandas()
+        
+        for restored in (from_parquet, from_arrow):
+            pd.testing.assert_frame_equal(restored, df)
+            self.assertEqual(restored['star_rating'].dtype, np.int8)
 
 class TestAPIEndpoints(unittest.TestCase):
     """Test API endpoints"""
@@ -161,5 +426,1477 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(start_idx, 40)
         self.assertEqual(end_idx, 50)
 
+class TestAPIClient(unittest.TestCase):
+    """Test API endpoints through the FastAPI test client"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Load the sample playlist once for all endpoint tests"""
+        json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        cls.processor = PlaylistDataProcessor(json_path)
+        cls.processor.load_and_normalize()
+    
+    def setUp(self):
+        """Point the app at the sample data and reset ratings"""
+        self.processor.engine.write_ratings([(slice(None), 0)])
+        self.processor.stats = ColumnStats(self.processor.columns)
+        main.processor = self.processor
+        self.client = TestClient(main.app)
+    
+    @property
+    def df(self):
+        """The frame over the current snapshot, including every rating written so far"""
+        return self.processor.get_normalized_data()
+    
+    def test_songs_page_matches_pydantic_serialization(self):
+        """Test that the fast page encoder is byte-for-byte the response_model output"""
+        self.processor.update_star_rating(self.df['id'][2], 4)
+        total = len(self.df)
+        
+        for page, size in [(1, 10), (3, 7), (15, 7), (2, 100), (50, 10)]:
+            start = (page - 1) * size
+            response = self.client.get('/api/songs', params={'page': page, 'size': size})
+            self.assertEqual(response.status_code, 200)
+            
+            songs = [main.Song(**row) for row in self.df.iloc[start:start + size].to_dict('records')]
+            expected = JSONResponse(content=jsonable_encoder(main.PaginatedResponse(
+                songs=songs, total=total, page=page, size=size, total_pages=(total + size - 1) // size,
+                next_cursor=response.json()['next_cursor']
+            ))).body
+            self.assertEqual(response.content, expected)
+    
+    def test_songs_sorted_and_filtered(self):
+        """Test server-side sorting and range filters"""
+        response = self.client.get('/api/songs', params=[
+            ('sort_by', 'tempo'), ('order', 'desc'), ('size', 100),
+            ('filter', 'energy>0.5'), ('filter', 'tempo>=100'), ('filter', 'tempo<140'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        
+        expected = self.df[(self.df['energy'] > 0.5) & (self.df['tempo'] >= 100) & (self.df['tempo'] < 140)]
+        songs = response.json()['songs']
+        self.assertEqual(response.json()['total'], len(expected))
+        self.assertEqual([song['tempo'] for song in songs], sorted(expected['tempo'], reverse=True))
+        
+        for params in ({'sort_by': 'nope'}, {'filter': 'title>3'}, {'filter': 'energy~1'}, {'cursor': 'bad'}):
+            self.assertEqual(self.client.get('/api/songs', params=params).status_code, 400)
+    
+    def test_songs_keyset_cursor(self):
+        """Test that following next_cursor walks the same rows as offset pages"""
+        # Ties on star_rating exercise the row-position tie breaker
+        self.processor.update_star_ratings(list(self.df['id'][:30]), [3] * 30)
+        
+        for order in ('asc', 'desc'):
+            params = {'sort_by': 'star_rating', 'order': order, 'size': 7}
+            offset_ids, cursor_ids, cursor = [], [], None
+            for page in range(1, 16):
+                offset_ids += [song['id'] for song in self.client.get(
+                    '/api/songs', params={**params, 'page': page}).json()['songs']]
+            while True:
+                body = self.client.get('/api/songs', params={**params, **({'cursor': cursor} if cursor else {})}).json()
+                cursor_ids += [song['id'] for song in body['songs']]
+                cursor = body['next_cursor']
+                if cursor is None:
+                    break
+            
+            self.assertEqual(len(cursor_ids), len(self.df))
+            self.assertEqual(cursor_ids, offset_ids)
+            ratings = dict(zip(self.df['id'], self.df['star_rating']))
+            key = [ratings[song_id] for song_id in cursor_ids]
+            self.assertEqual(key, sorted(key, reverse=(order == 'desc')))
+    
+    def test_songs_cursor_must_match_query(self):
+        """Test that a cursor of the wrong value type or from other filters is rejected"""
+        params = {'sort_by': 'key', 'filter': 'energy>0.2', 'size': 5}
+        cursor = self.client.get('/api/songs', params=params).json()['next_cursor']
+        self.assertEqual(self.client.get('/api/songs', params={**params, 'cursor': cursor}).status_code, 200)
+        
+        # The same cursor under other filters
+        for filters in ({'filter': 'energy>0.3'}, {}):
+            response = self.client.get('/api/songs', params={'sort_by': 'key', 'size': 5, **filters, 'cursor': cursor})
+            self.assertEqual(response.status_code, 400)
+        
+        # A cursor whose sort value is text for an integer column
+        sort_by, descending, digest, value, row = json.loads(base64.urlsafe_b64decode(cursor))
+        for bad in ('abc', True, 1.5):
+            forged = base64.urlsafe_b64encode(json.dumps([sort_by, descending, digest, bad, row]).encode()).decode()
+            response = self.client.get('/api/songs', params={**params, 'cursor': forged})
+            self.assertEqual(response.status_code, 400)
+    
+    def test_bulk_rating_update(self):
+        """Test applying many ratings in one request"""
+        ids = list(self.df['id'][:3])
+        response = self.client.post('/api/songs/ratings', json={'ratings': [
+            {'song_id': ids[0], 'rating': 5},
+            {'song_id': ids[1], 'rating': 2},
+            {'song_id': ids[0], 'rating': 3},
+            {'song_id': 'missing', 'rating': 4},
+        ]})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(response.json()['not_found'], ['missing'])
+        self.assertEqual(list(self.df['star_rating'][:3]), [3, 2, 0])
+    
+    def test_bulk_rating_update_rejects_invalid_rating(self):
+        """Test that an out-of-range rating rejects the whole batch"""
+        ids = list(self.df['id'][:2])
+        response = self.client.post('/api/songs/ratings', json={'ratings': [
+            {'song_id': ids[0], 'rating': 5},
+            {'song_id': ids[1], 'rating': 9},
+        ]})
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(self.df['star_rating'][:2]), [0, 0])
+    
+    def test_histogram_with_edges(self):
+        """Test that histogram bins are half-open and match a direct count"""
+        edges = [0, 120, 180, 240, 300, 360, 420]
+        response = self.client.get('/api/charts/histogram', params=[('column', 'duration_s')] + [('edges', e) for e in edges])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        
+        durations = self.df['duration_s']
+        expected = [int(((durations >= low) & (durations < high)).sum()) for low, high in zip(edges, edges[1:])]
+        self.assertEqual(body['counts'], expected)
+        self.assertEqual(body['underflow'] + sum(body['counts']) + body['overflow'], len(self.df))
+        
+        response = self.client.get('/api/charts/histogram', params=[('column', 'title'), ('edges', 0), ('edges', 1)])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/charts/histogram', params=[('column', 'tempo'), ('edges', 2), ('edges', 1)])
+        self.assertEqual(response.status_code, 400)
+    
+    def test_histogram_tracks_rating_changes(self):
+        """Test that a cached star_rating histogram is recomputed after a rating write"""
+        params = [('column', 'star_rating')] + [('edges', e) for e in range(7)]
+        self.assertEqual(self.client.get('/api/charts/histogram', params=params).json()['counts'][0], len(self.df))
+        
+        self.processor.update_star_rating(self.df['id'][0], 5)
+        counts = self.client.get('/api/charts/histogram', params=params).json()['counts']
+        self.assertEqual(counts[0], len(self.df) - 1)
+        self.assertEqual(counts[5], 1)
+    
+    def test_scatter_is_capped(self):
+        """Test that both scatter reductions stay within max_points"""
+        response = self.client.get('/api/charts/scatter', params={'y': 'danceability', 'max_points': 50})
+        self.assertEqual(response.status_code, 200)
+        points = response.json()['points']
+        self.assertEqual(len(points['x']), 50)
+        # LTTB keeps the first and last points and only returns real rows
+        self.assertEqual(points['x'][0], self.df['index'].iloc[0])
+        self.assertEqual(points['x'][-1], self.df['index'].iloc[-1])
+        rows = self.df.set_index('index')['danceability']
+        self.assertEqual(points['y'], [rows[x] for x in points['x']])
+        
+        response = self.client.get('/api/charts/scatter', params={
+            'x': 'energy', 'y': 'danceability', 'method': 'grid', 'max_points': 50
+        })
+        self.assertEqual(response.status_code, 200)
+        points = response.json()['points']
+        self.assertLessEqual(len(points['count']), 50)
+        self.assertEqual(sum(points['count']), len(self.df))
+    
+    def test_stats_match_pandas(self):
+        """Test cached statistics against pandas, including the column selector"""
+        response = self.client.get('/api/stats')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['total_songs'], len(self.df))
+        for column in ['danceability', 'energy', 'acousticness', 'tempo', 'duration_s', 'valence']:
+            stats = body['statistics'][column]
+            self.assertAlmostEqual(stats['min'], self.df[column].min())
+            self.assertAlmostEqual(stats['max'], self.df[column].max())
+            self.assertAlmostEqual(stats['mean'], self.df[column].mean())
+            self.assertAlmostEqual(stats['median'], self.df[column].median())
+            self.assertAlmostEqual(stats['std'], self.df[column].std(ddof=0))
+            self.assertAlmostEqual(stats['p95'], self.df[column].quantile(0.95))
+        
+        response = self.client.get('/api/stats', params={'columns': 'tempo,key'})
+        self.assertEqual(list(response.json()['statistics']), ['tempo', 'key'])
+        response = self.client.get('/api/stats', params={'columns': 'title'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_rating_stats_follow_updates(self):
+        """Test that incrementally maintained rating stats equal a full recount"""
+        ids = self.df['id']
+        self.processor.update_star_rating(ids[0], 5)
+        self.processor.update_star_rating(ids[1], 2)
+        self.processor.update_star_rating(ids[0], 3)
+        self.client.post('/api/songs/ratings', json={'ratings': [
+            {'song_id': ids[2], 'rating': 4}, {'song_id': ids[1], 'rating': 1}, {'song_id': ids[2], 'rating': 5},
+        ]})
+        
+        stats = self.client.get('/api/stats', params={'columns': 'star_rating'}).json()['statistics']['star_rating']
+        ratings = self.df['star_rating'].astype(float)
+        self.assertEqual(stats['rated'], 3)
+        self.assertAlmostEqual(stats['rated_mean'], 3.0)
+        self.assertAlmostEqual(stats['mean'], ratings.mean())
+        self.assertAlmostEqual(stats['std'], ratings.std(ddof=0))
+        for q in (5, 25, 75, 95):
+            self.assertAlmostEqual(stats[f'p{q}'], ratings.quantile(q / 100))
+    
+    def test_csv_export_streams_dataframe_csv(self):
+        """Test that the chunked CSV export matches DataFrame.to_csv"""
+        self.processor.update_star_rating(self.df['id'][1], 3)
+        expected = self.df.to_csv(index=False).encode('utf-8')
+        
+        response = self.client.get('/api/export/csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('playlist_data.csv', response.headers['content-disposition'])
+        self.assertEqual(response.content, expected)
+        
+        # Chunk boundaries must not change the output
+        chunks = list(export.iter_csv(self.processor.columns, list(self.df.columns), chunk_rows=7))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), expected)
+    
+    def test_csv_export_columns_filters_and_gzip(self):
+        """Test column selection, filtering and gzip compression of the CSV export"""
+        params = [('columns', 'id,title'), ('columns', 'energy'), ('filter', 'energy>0.5'), ('compression', 'gzip')]
+        response = self.client.get('/api/export/csv', params=params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/gzip')
+        
+        expected = self.df.loc[self.df['energy'] > 0.5, ['id', 'title', 'energy']]
+        self.assertEqual(gzip.decompress(response.content), expected.to_csv(index=False).encode('utf-8'))
+        
+        response = self.client.get('/api/export/csv', params={'columns': 'nope'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_export_formats(self):
+        """Test the format parameter of the bulk export endpoint"""
+        response = self.client.get('/api/export', params={'format': 'ndjson', 'filter': 'tempo>120'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), int((self.df['tempo'] > 120).sum()))
+        self.assertEqual(json.loads(lines[0])['id'], self.df.loc[self.df['tempo'] > 120, 'id'].iloc[0])
+        
+        response = self.client.get('/api/export', params={'format': 'xml'})
+        self.assertEqual(response.status_code, 422)
+        
+        if export.pa is None:
+            self.assertEqual(self.client.get('/api/export', params={'format': 'parquet'}).status_code, 501)
+            return
+        
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        response = self.client.get('/api/export', params={'format': 'arrow', 'columns': 'id,energy'})
+        self.assertEqual(response.status_code, 200)
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.column_names, ['id', 'energy'])
+        self.assertEqual(table.num_rows, len(self.df))
+        
+        response = self.client.get('/api/export', params={'format': 'parquet'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(pq.read_table(pa.BufferReader(response.content)).num_rows, len(self.df))
+        
+        response = self.client.get('/api/export', params={'format': 'parquet', 'compression': 'gzip'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_batch_id_lookup(self):
+        """Test that a batch of ids returns each song, or null, in request order"""
+        ids = [self.df['id'][4], 'missing', self.df['id'][0], self.df['id'][4]]
+        self.processor.update_star_rating(ids[0], 5)
+        response = self.client.post('/api/songs/batch', json={'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        
+        expected = [{'id': song_id, 'song': None if row is None else
+                     jsonable_encoder(main.Song(**self.df.iloc[row].to_dict()))}
+                    for song_id, row in zip(ids, [4, None, 0, 4])]
+        self.assertEqual(response.json(), {'results': expected})
+        self.assertEqual(response.json()['results'][0]['song']['star_rating'], 5)
+        
+        too_many = self.client.post('/api/songs/batch', json={'ids': ['x'] * 10001})
+        self.assertEqual(too_many.status_code, 422)
+    
+    def test_batch_title_search_matches_single_searches(self):
+        """Test that batch search results equal one /api/songs/search call per title, streamed as NDJSON"""
+        titles = ['love', 'a', 'no such title', str(self.df['title'][7]).upper(), 'love', 'the']
+        response = self.client.post('/api/songs/search/batch', json={'titles': titles, 'limit': 3},
+                                    headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['content-type'], 'application/x-ndjson')
+        
+        lines = [json.loads(line) for line in response.content.decode('utf-8').splitlines()]
+        self.assertEqual([line['title'] for line in lines], titles)
+        for line in lines:
+            single = self.client.get('/api/songs/search', params={'title': line['title'], 'limit': 3})
+            self.assertEqual(line['songs'], single.json())
+        
+        # Batches larger than one encoding chunk still come back whole and in order
+        with patch.object(main, 'BATCH_CHUNK_SIZE', 2):
+            chunked = self.client.post('/api/songs/search/batch', params={'format': 'json'},
+                                       json={'titles': titles, 'limit': 3})
+        self.assertEqual(chunked.json(), {'results': lines})
+    
+    def test_similar_songs_match_brute_force(self):
+        """Test that the similar-songs endpoint returns the exact nearest neighbours"""
+        features = self.df[list(SIMILARITY_FEATURES)].to_numpy(dtype=np.float64)
+        standardized = (features - features.mean(axis=0)) / features.std(axis=0)
+        song = 7
+        distances = np.sqrt(((standardized - standardized[song]) ** 2).sum(axis=1))
+        distances[song] = np.inf
+        expected = np.argsort(distances, kind='stable')[:5]
+        
+        response = self.client.get(f"/api/songs/{self.df['id'][song]}/similar", params={'k': 5})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['features'], list(SIMILARITY_FEATURES))
+        self.assertEqual([item['id'] for item in body['songs']], list(self.df['id'][expected]))
+        np.testing.assert_allclose([item['distance'] for item in body['songs']], distances[expected], rtol=1e-4)
+        
+        self.assertEqual(self.client.get('/api/songs/missing/similar').status_code, 404)
+        self.assertEqual(self.client.get(f"/api/songs/{self.df['id'][0]}/similar", params={'k': 0}).status_code, 422)
+    
+    def test_conditional_get_and_invalidation(self):
+        """Test ETag revalidation, and that a rating write invalidates cached responses"""
+        params = {'page': 1, 'size': 5}
+        first = self.client.get('/api/songs', params=params)
+        etag = first.headers['etag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertEqual(first.headers['cache-control'], 'no-cache')
+        
+        hits = main.response_cache.hits
+        cached = self.client.get('/api/songs', params=params)
+        self.assertEqual(cached.content, first.content)
+        self.assertEqual(main.response_cache.hits, hits + 1)
+        
+        response = self.client.get('/api/songs', params=params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response.headers['etag'], etag)
+        response = self.client.get('/api/songs', params=params,
+                                   headers={'If-Modified-Since': first.headers['last-modified']})
+        self.assertEqual(response.status_code, 304)
+        
+        # A rating on another page changes the version but not this body, so the validators hold
+        self.processor.update_star_rating(self.df['id'][50], 3)
+        response = self.client.get('/api/songs', params=params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        
+        self.processor.update_star_rating(self.df['id'][0], 5)
+        response = self.client.get('/api/songs', params=params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['etag'], etag)
+        self.assertEqual(response.json()['songs'][0]['star_rating'], 5)
+        
+        stats = self.client.get('/api/stats').json()['statistics']['star_rating']
+        self.assertEqual(stats['rated'], 2)
+        self.processor.update_star_rating(self.df['id'][1], 4)
+        self.assertEqual(self.client.get('/api/stats').json()['statistics']['star_rating']['rated'], 3)
+    
+    def test_cached_responses_match_their_snapshot(self):
+        """Test that a rating written while a cached response is built does not leak into it"""
+        song_id = self.df['id'][0]
+        title = self.df['title'][0]
+        requests = [
+            ('/api/songs/search', {'title': title}, self.processor.title_index, 'first_match',
+             lambda body: body['star_rating']),
+            ('/api/songs/search', {'title': title, 'limit': 1}, self.processor.title_index, 'search',
+             lambda body: body[0]['star_rating']),
+            ('/api/charts/histogram', {'column': 'star_rating', 'edges': list(range(7))}, self.processor.aggregates,
+             '_check_column', lambda body: max(edge for edge, count in zip(body['edges'], body['counts']) if count)),
+            ('/api/charts/scatter', {'y': 'star_rating', 'max_points': 5000}, self.processor.aggregates,
+             '_check_column', lambda body: max(body['points']['y'])),
+        ]
+        for url, params, target, method, rating in requests:
+            self.processor.update_star_rating(song_id, 1)
+            real = getattr(target, method)
+            
+            def write_then_call(*args):
+                # The write lands after the request took its snapshot but before the body is built
+                self.processor.update_star_rating(song_id, 4)
+                return real(*args)
+            
+            with patch.object(target, method, side_effect=write_then_call):
+                first = self.client.get(url, params=params)
+            self.assertEqual(rating(first.json()), 1, url)
+            
+            again = self.client.get(url, params=params)
+            self.assertEqual(rating(again.json()), 4, url)
+            self.assertNotEqual(again.headers['etag'], first.headers['etag'], url)
+    
+    def test_cached_responses_are_compressed(self):
+        """Test that cached bodies are sent compressed to clients that accept it"""
+        params = {'page': 1, 'size': 50}
+        plain = self.client.get('/api/songs', params=params, headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('content-encoding', plain.headers)
+        
+        response = self.client.get('/api/songs', params=params, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+        self.assertEqual(response.headers['vary'], 'Accept-Encoding')
+        self.assertEqual(response.content, plain.content)
+        self.assertLess(int(response.headers['content-length']), len(plain.content))
+        
+        if response_cache.brotli is not None:
+            response = self.client.get('/api/songs', params=params, headers={'Accept-Encoding': 'gzip, br'})
+            self.assertEqual(response.headers['content-encoding'], 'br')
+            self.assertEqual(response.content, plain.content)
+        
+        # Tiny bodies are not worth compressing
+        response = self.client.get('/api/songs', params={'page': 1, 'size': 1}, headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('content-encoding', response.headers)
+        
+        stats = self.client.get('/api/admin/cache').json()
+        self.assertTrue(stats['enabled'])
+        self.assertGreater(stats['hits'], 0)
+        self.assertGreater(stats['bytes'], 0)
+    
+    def test_response_cache_bounds(self):
+        """Test that the cache evicts least recently used entries past its entry and byte limits"""
+        cache = ResponseCache(max_entries=3, max_bytes=1000)
+        for name in 'abc':
+            cache.put(name, 1, name.encode() * 100)
+        self.assertIsNotNone(cache.get('a', 1))
+        self.assertIsNone(cache.get('b', 2))
+        cache.put('d', 1, b'd' * 100)
+        self.assertIsNone(cache.get('b', 1))
+        self.assertIsNotNone(cache.get('a', 1))
+        
+        cache.put('e', 1, b'e' * 800)
+        self.assertIsNone(cache.get('c', 1))
+        self.assertEqual((cache.stats()['entries'], cache.stats()['bytes']), (3, 1000))
+        cache.put('f', 1, b'f' * 2000)
+        self.assertIsNone(cache.get('f', 1))
+        self.assertEqual(cache.stats()['evictions'], 2)
+        
+        entry = cache.put('g', 1, b'g' * 100)
+        again = cache.put('g', 2, b'g' * 100)
+        self.assertEqual((again.etag, again.last_modified), (entry.etag, entry.last_modified))
+        self.assertEqual(ResponseCache.make_key('/x', [('b', '1'), ('a', '2'), ('b', '0')]),
+                         ('/x', (('a', '2'), ('b', '1'), ('b', '0'))))
+    
+    def test_similarity_index_blocks_and_missing_values(self):
+        """Test that small blocks, batched queries and missing features give the brute-force answer"""
+        rng = np.random.default_rng(3)
+        columns = {'index': np.arange(500), 'energy': rng.random(500), 'tempo': rng.random(500) * 200}
+        columns['energy'][::50] = np.nan
+        index = SimilarityIndex(columns, block_rows=37)
+        self.assertEqual(index.features, ['energy', 'tempo'])
+        
+        queries = np.array([0, 1, 250, 499])
+        neighbours, distances = index.nearest(queries, 12)
+        self.assertEqual(neighbours.shape, (4, 12))
+        for row, query in enumerate(queries):
+            brute = np.sqrt(((index.matrix.astype(np.float64) - index.matrix[query]) ** 2).sum(axis=1))
+            brute[query] = np.inf
+            np.testing.assert_allclose(distances[row], np.sort(brute)[:12], rtol=1e-4, atol=1e-5)
+            self.assertNotIn(query, neighbours[row])
+        
+        self.assertEqual(index.nearest([3], 10_000)[0].shape, (1, 499))
+    
+    def test_metrics_endpoint(self):
+        """Test that /metrics counts requests by route template and reports load and cache metrics"""
+        before = main.http_requests.value(method='GET', path='/api/songs/{song_id}/similar', status=200)
+        for row in (0, 1, 2):
+            self.client.get(f"/api/songs/{self.df['id'][row]}/similar")
+        self.client.get('/api/songs/missing/similar')
+        self.client.get('/no/such/path')
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain; version=0.0.4'))
+        text = response.text
+        self.assertIn(f'playlist_http_requests_total{{method="GET",path="/api/songs/{{song_id}}/similar",status="200"}} '
+                      f'{before + 3}', text)
+        self.assertIn('path="/api/songs/{song_id}/similar",status="404"', text)
+        self.assertIn('path="unmatched",status="404"', text)
+        self.assertNotIn('/api/songs/missing/similar', text)
+        self.assertIn('playlist_http_request_duration_seconds_bucket{method="GET",path="/api/songs/{song_id}/similar",le="+Inf"}',
+                      text)
+        self.assertIn(f"playlist_songs {len(self.df)}", text)
+        self.assertIn('playlist_load_phase_seconds{phase="title_index"}', text)
+        self.assertIn('playlist_response_cache_hits_total', text)
+        self.assertIn('process_start_time_seconds', text)
+    
+    def test_profile_endpoint(self):
+        """Test that the profiler is off unless enabled, and returns collapsed stacks when it is"""
+        self.assertEqual(self.client.get('/api/admin/profile', params={'seconds': 0.05}).status_code, 404)
+        with patch('main.PLAYLIST_PROFILING', True):
+            response = self.client.get('/api/admin/profile', params={'seconds': 0.2, 'interval_ms': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('profile.folded', response.headers['content-disposition'])
+        self.assertTrue(response.text)
+        for line in response.text.splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+            self.assertTrue(stack)
+
+class TestMetrics(unittest.TestCase):
+    """Test the Prometheus exposition and the sampling profiler"""
+    
+    def test_registry_text_format(self):
+        """Test counter, gauge and histogram rendering, with cumulative buckets"""
+        registry = MetricsRegistry()
+        requests = registry.counter('test_requests_total', 'Requests.', ['path'])
+        temperature = registry.gauge('test_temperature', 'Temperature.')
+        latency = registry.histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+        requests.inc(path='/a')
+        requests.inc(2, path='/a "quoted"')
+        temperature.set(21.5)
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(value)
+        
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[:4], ['# HELP test_requests_total Requests.', '# TYPE test_requests_total counter',
+                                     'test_requests_total{path="/a"} 1', 'test_requests_total{path="/a \\"quoted\\""} 2'])
+        self.assertIn('test_temperature 21.5', lines)
+        self.assertIn('# TYPE test_latency_seconds histogram', lines)
+        self.assertEqual([line for line in lines if line.startswith('test_latency_seconds')], [
+            'test_latency_seconds_bucket{le="0.1"} 2',
+            'test_latency_seconds_bucket{le="1"} 3',
+            'test_latency_seconds_bucket{le="+Inf"} 4',
+            'test_latency_seconds_sum 3.65',
+            'test_latency_seconds_count 4',
+        ])
+        
+        with self.assertRaises(ValueError):
+            requests.inc(route='/a')
+    
+    def test_profiler_samples_busy_function(self):
+        """Test that the collapsed stacks attribute most samples to the function keeping a thread busy"""
+        stop = threading.Event()
+        
+        def busy_loop():
+            while not stop.is_set():
+                sum(range(1000))
+        
+        worker = threading.Thread(target=busy_loop, name='busy-worker')
+        worker.start()
+        try:
+            with SamplingProfiler(interval=0.002) as profiler:
+                time.sleep(0.2)
+        finally:
+            stop.set()
+            worker.join()
+        
+        self.assertGreater(profiler.samples, 10)
+        self.assertGreater(profiler.duration, 0.15)
+        busy = [line for line in profiler.collapsed().splitlines() if line.startswith('busy-worker;')]
+        self.assertTrue(busy)
+        self.assertTrue(all('busy_loop (test_backend.py:' in line for line in busy))
+        self.assertNotIn('sampling-profiler', profiler.collapsed())
+        
+        with self.assertRaises(ValueError):
+            SamplingProfiler(interval=0)
+
+class TestCompactLayout(unittest.TestCase):
+    """Test that the compact column layout serves the same data in less memory"""
+    
+    @classmethod
+    def setUpClass(cls):
+        """Load the sample playlist in both layouts"""
+        cls.json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        cls.standard = PlaylistDataProcessor(cls.json_path)
+        cls.standard.load_and_normalize()
+        cls.compact = PlaylistDataProcessor(cls.json_path, compact=True)
+        cls.compact.load_and_normalize()
+    
+    def get(self, processor, path, **params):
+        main.processor = processor
+        response = TestClient(main.app).get(path, params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.content
+    
+    def test_compact_dtypes_and_memory_report(self):
+        """Test the narrowed columns and that the report counts them"""
+        columns = self.compact.columns
+        for name in ('key', 'mode', 'time_signature'):
+            self.assertEqual(columns[name].dtype, np.int8)
+        self.assertEqual(columns['danceability'].dtype, np.float32)
+        self.assertIsInstance(columns['duration_s'], DerivedColumn)
+        if compact.pa is not None:
+            self.assertIsInstance(columns['title'].dtype, pd.StringDtype)
+        
+        standard, report = self.standard.memory_report(), self.compact.memory_report()
+        self.assertEqual(report['layout'], 'compact')
+        self.assertEqual(report['columns']['key'], {'dtype': 'int8', 'bytes': len(columns['key']), 'mapped': False})
+        self.assertEqual(report['columns']['duration_s']['bytes'], 0)
+        self.assertLess(report['column_bytes'] * 2, standard['column_bytes'])
+        self.assertEqual(report['total_bytes'], report['column_bytes'] + report['index_bytes'])
+        
+        # A value that float32 would change keeps its column float64
+        narrowed = compact_columns({'energy': np.array([0.5, 0.123456789])})
+        self.assertEqual(narrowed['energy'].dtype, np.float64)
+    
+    def test_api_responses_match_standard_layout(self):
+        """Test that every read endpoint answers byte for byte as with the standard layout"""
+        song_id = self.standard.columns['id'][3]
+        requests = [
+            ('/api/songs', {'page': 2, 'size': 25}),
+            ('/api/songs', {'sort_by': 'title', 'filter': 'danceability>=0.5', 'size': 10}),
+            ('/api/songs', {'sort_by': 'energy', 'order': 'desc', 'size': 10}),
+            ('/api/songs/search', {'title': 'a', 'limit': 10}),
+            ('/api/songs/search', {'title': 'love'}),
+            (f'/api/songs/{song_id}/similar', {'k': 5}),
+            ('/api/charts/histogram', {'column': 'danceability', 'bins': 7}),
+            ('/api/charts/histogram', {'column': 'duration_s', 'edges': [100, 200, 300]}),
+            ('/api/charts/scatter', {'x': 'energy', 'y': 'valence', 'max_points': 20}),
+            ('/api/stats', {'columns': 'danceability,duration_s,key,star_rating'}),
+            ('/api/export', {'format': 'csv'}),
+            ('/api/export', {'format': 'ndjson', 'filter': 'acousticness<0.1'}),
+        ]
+        for processor in (self.standard, self.compact):
+            processor.update_star_ratings([song_id, processor.columns['id'][7]], [5, 2])
+        
+        for path, params in requests:
+            with self.subTest(path=path, params=params):
+                self.assertEqual(self.get(self.compact, path, **params), self.get(self.standard, path, **params))
+        
+        # The keyset cursor of a page sorted by a float32 column leads to the same next page
+        page = json.loads(self.get(self.compact, '/api/songs', sort_by='valence', size=10))
+        self.assertEqual(self.get(self.compact, '/api/songs', sort_by='valence', size=10, cursor=page['next_cursor']),
+                         self.get(self.standard, '/api/songs', sort_by='valence', size=10,
+                                  cursor=page['next_cursor']))
+    
+    def test_compact_snapshot_maps_strings(self):
+        """Test that a warm compact load maps its snapshot, strings included, apart from standard ones"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            PlaylistDataProcessor(self.json_path, cache_dir=cache_dir).load_and_normalize()
+            cold = PlaylistDataProcessor(self.json_path, cache_dir=cache_dir, compact=True)
+            cold.load_and_normalize()
+            with patch.object(PlaylistDataProcessor, '_parse_columns') as parse:
+                warm = PlaylistDataProcessor(self.json_path, cache_dir=cache_dir, compact=True)
+                warm.load_and_normalize()
+                parse.assert_not_called()
+            
+            self.assertEqual(warm.columns['danceability'].dtype, np.float32)
+            self.assertTrue(warm.memory_report()['columns']['danceability']['mapped'])
+            self.assertEqual(to_python_list(warm.columns['title']), to_python_list(cold.columns['title']))
+            self.assertEqual(warm.get_song_by_title('a'), self.standard.get_song_by_title('a'))
+    
+    def test_hashed_id_index(self):
+        """Test id lookups, duplicates included, against a pandas Index"""
+        ids = np.array(['a', 'b', 'c', 'b', 'd'], dtype=object)
+        index = HashedIdIndex(ids)
+        self.assertFalse(index.is_unique)
+        self.assertEqual(index.get_loc('a'), 0)
+        self.assertEqual(index.get_loc('b').tolist(), [1, 3])
+        with self.assertRaises(KeyError):
+            index.get_loc('z')
+        
+        unique = HashedIdIndex(ids[[0, 1, 2, 4]])
+        self.assertTrue(unique.is_unique)
+        queries = pd.Index(['d', 'z', 'a', None], dtype=object)
+        np.testing.assert_array_equal(unique.get_indexer(queries),
+                                      pd.Index(ids[[0, 1, 2, 4]]).get_indexer(queries))
+        
+        self.assertTrue(self.compact.update_star_rating(self.compact.columns['id'][0], 3))
+        self.assertFalse(self.compact.update_star_rating('missing', 3))
+        self.assertEqual(int(self.compact.columns['star_rating'][0]), 3)
+
+class TestConcurrentAccess(unittest.TestCase):
+    """Stress readers against concurrent rating writers"""
+    
+    def test_queued_writes_share_one_copy(self):
+        """Test that writes queued behind the write lock are applied together, each with its own result"""
+        json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        processor = PlaylistDataProcessor(json_path)
+        processor.load_and_normalize()
+        ids = list(processor.columns['id'][:8])
+        version = processor.ratings_version
+        results = {}
+        
+        def write(index):
+            song_id = ids[index] if index else 'no-such-song'
+            results[index] = processor.update_star_rating(song_id, index % 5 + 1)
+        
+        writers = [threading.Thread(target=write, args=(index,)) for index in range(8)]
+        with processor.engine.write_lock:
+            for thread in writers:
+                thread.start()
+            while len(processor._write_queue) < len(writers):
+                time.sleep(0.001)
+        for thread in writers:
+            thread.join()
+        
+        self.assertEqual(processor.ratings_version, version + 1)
+        self.assertEqual(results, {index: index > 0 for index in range(8)})
+        self.assertEqual(processor.star_ratings[1:8].tolist(), [index % 5 + 1 for index in range(1, 8)])
+        self.assertEqual(processor.stats.summary('star_rating')['rated'], 7)
+    
+    def test_readers_see_consistent_snapshots_during_writes(self):
+        """Test that readers never see a half-applied write and never fail while ratings change"""
+        json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        processor = PlaylistDataProcessor(json_path)
+        processor.load_and_normalize()
+        ids = list(processor.normalized_data['id'])
+        group, others = ids[:20], ids[20:]
+        errors, reads = [], [0]
+        done = threading.Event()
+        
+        def bulk_writer(seed):
+            # Every bulk write gives the whole group one rating, so any mixture is a torn read
+            rng = np.random.default_rng(seed)
+            for _ in range(100):
+                processor.update_star_ratings(group, [int(rng.integers(1, 6))] * len(group))
+        
+        def single_writer(seed):
+            rng = np.random.default_rng(seed)
+            for _ in range(100):
+                processor.update_star_rating(others[int(rng.integers(len(others)))], int(rng.integers(1, 6)))
+        
+        def reader():
+            try:
+                while not done.is_set():
+                    snapshot = processor.snapshot()
+                    self.assertEqual(len(set(snapshot.columns['star_rating'][:20].tolist())), 1)
+                    
+                    positions, total, _ = processor.query.page('star_rating', False, [], 0, len(ids), None, snapshot)
+                    rows = main.encode_song_records(snapshot.columns, positions)
+                    ratings = [row['star_rating'] for row in rows]
+                    self.assertEqual(ratings, sorted(ratings))
+                    self.assertEqual(total, len(ids))
+                    
+                    histogram = processor.aggregates.histogram('star_rating', list(range(7)))
+                    self.assertEqual(sum(histogram['counts']), len(ids))
+                    reads[0] += 1
+            except Exception as e:
+                errors.append(e)
+        
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        writers = [threading.Thread(target=bulk_writer, args=(seed,)) for seed in range(3)]
+        writers += [threading.Thread(target=single_writer, args=(seed,)) for seed in range(3, 6)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        done.set()
+        for thread in readers:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertGreater(reads[0], 0)
+        # One version per applied batch; writes that queued up together share one
+        self.assertLessEqual(processor.ratings_version, 1 + 6 * 100)
+        self.assertGreater(processor.ratings_version, 1)
+        
+        # The incrementally maintained distribution matches a recount of the final ratings
+        final = processor.star_ratings
+        stats = processor.stats.summary('star_rating')
+        self.assertEqual(stats['rated'], int(np.count_nonzero(final)))
+        self.assertAlmostEqual(stats['mean'], float(final.mean()))
+
+class TestRatingStore(unittest.TestCase):
+    """Test the rating log's durability and crash recovery"""
+    
+    def setUp(self):
+        """Use a fresh log directory for every test"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = self.tmp_dir.name
+    
+    def tearDown(self):
+        """Remove the log directory"""
+        self.tmp_dir.cleanup()
+    
+    def open_store(self, **kwargs):
+        kwargs.setdefault('durability', 'none')
+        store = RatingStore(self.directory, **kwargs)
+        self.addCleanup(store.close)
+        return store
+    
+    def log_files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.log'))
+    
+    def test_replay_after_crash(self):
+        """Test that records survive a process that never closed the store"""
+        store = self.open_store()
+        store.append([('a', 5), ('b', 2)])
+        store.append([('a', 3)])
+        
+        # Reopening without close() is what a restart after a crash sees
+        recovered = self.open_store()
+        self.assertEqual(recovered.ratings, {'a': 3, 'b': 2})
+    
+    def test_torn_tail_is_discarded(self):
+        """Test that a partially written last record is dropped and appends continue cleanly"""
+        store = self.open_store()
+        store.append([('a', 4), ('b', 1)])
+        store.close()
+        
+        path = os.path.join(self.directory, self.log_files()[-1])
+        with open(path, 'ab') as file:
+            file.write(b'1234abcd ["c",')
+        
+        recovered = self.open_store()
+        self.assertEqual(recovered.ratings, {'a': 4, 'b': 1})
+        recovered.append([('c', 5)])
+        recovered.close()
+        self.assertEqual(self.open_store().ratings, {'a': 4, 'b': 1, 'c': 5})
+    
+    def test_corrupt_record_stops_replay(self):
+        """Test that a record failing its checksum ends replay of that log"""
+        store = self.open_store()
+        store.append([('a', 4), ('b', 1), ('c', 2)])
+        store.close()
+        
+        path = os.path.join(self.directory, self.log_files()[-1])
+        with open(path, 'rb') as file:
+            lines = file.read().split(b'\n')
+        lines[1] = lines[1].replace(b'1]', b'5]')
+        with open(path, 'wb') as file:
+            file.write(b'\n'.join(lines))
+        
+        self.assertEqual(self.open_store().ratings, {'a': 4})
+    
+    def test_compaction_snapshot_and_crash_points(self):
+        """Test recovery at each step of compaction"""
+        store = self.open_store(compact_after=10 ** 9)
+        store.append([('a', 1), ('b', 2)])
+        
+        # Crash after sealing the log but before the snapshot is written
+        generation, ratings = store._rotate()
+        store.append([('a', 5)])
+        self.assertEqual(len(self.log_files()), 2)
+        self.assertEqual(self.open_store().ratings, {'a': 5, 'b': 2})
+        
+        # Crash after the snapshot is written but before sealed logs are deleted
+        store._write_snapshot(generation, ratings)
+        self.assertEqual(self.open_store().ratings, {'a': 5, 'b': 2})
+        
+        store.compact()
+        self.assertEqual(len(self.log_files()), 1)
+        store.append([('c', 3)])
+        self.assertEqual(self.open_store().ratings, {'a': 5, 'b': 2, 'c': 3})
+    
+    def test_automatic_compaction(self):
+        """Test that compaction starts on its own once enough records are logged"""
+        store = self.open_store(compact_after=50)
+        for i in range(60):
+            store.append([(f'song-{i}', i % 5 + 1)])
+        store.close()
+        
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'ratings.snapshot.json')))
+        recovered = self.open_store()
+        self.assertEqual(recovered.ratings, {f'song-{i}': i % 5 + 1 for i in range(60)})
+    
+    def test_sync_durability_group_commit(self):
+        """Test that concurrent sync writers are all durable yet share fsyncs"""
+        store = self.open_store(durability='sync')
+        real_fsync = os.fsync
+        fsyncs = []
+        
+        def slow_fsync(fd):
+            fsyncs.append(fd)
+            time.sleep(0.002)
+            real_fsync(fd)
+        
+        def writer(worker):
+            for i in range(25):
+                ticket = store.append([(f'{worker}-{i}', 1)])
+                store.wait_durable(ticket)
+                self.assertGreaterEqual(store._synced, ticket)
+        
+        with patch('rating_store.os.fsync', slow_fsync):
+            threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(len(store.ratings), 200)
+        self.assertLess(len(fsyncs), 200)
+    
+    def test_processor_restores_ratings(self):
+        """Test that a processor replays logged ratings and logs new writes"""
+        json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        processor = PlaylistDataProcessor(json_path)
+        processor.load_and_normalize()
+        processor.attach_rating_store(self.open_store())
+        ids = processor.normalized_data['id']
+        processor.update_star_rating(ids[0], 4)
+        processor.update_star_ratings([ids[1], 'missing', ids[2]], [2, 5, 3])
+        
+        restarted = PlaylistDataProcessor(json_path)
+        restarted.load_and_normalize()
+        self.assertEqual(restarted.attach_rating_store(self.open_store()), 0)
+        self.assertEqual(list(restarted.normalized_data['star_rating'][:4]), [4, 2, 3, 0])
+        self.assertEqual(restarted.stats.summary('star_rating')['rated'], 3)
+    
+    def test_failed_log_append_leaves_rating_unapplied(self):
+        """Test that a rating write whose log append fails is not applied in memory either"""
+        json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        processor = PlaylistDataProcessor(json_path)
+        processor.load_and_normalize()
+        store = self.open_store()
+        processor.attach_rating_store(store)
+        ids = list(processor.columns['id'][:2])
+        version = processor.ratings_version
+        
+        with patch.object(store, 'append', side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                processor.update_star_ratings(ids, [4, 5])
+        self.assertEqual(list(processor.columns['star_rating'][:2]), [0, 0])
+        self.assertEqual(processor.ratings_version, version)
+        self.assertEqual(store.ratings, {})
+        
+        # The next write goes through as usual
+        self.assertTrue(processor.update_star_rating(ids[0], 3))
+        self.assertEqual(store.ratings, {ids[0]: 3})
+    
+    def test_replay_skips_out_of_range_ratings(self):
+        """Test that a logged rating outside 1-5 is skipped with a warning instead of failing startup"""
+        json_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        processor = PlaylistDataProcessor(json_path)
+        processor.load_and_normalize()
+        ids = list(processor.columns['id'][:3])
+        store = self.open_store()
+        store.append([(ids[0], 4), (ids[1], 9), (ids[2], 0), ('missing', 2)])
+        store.close()
+        
+        with self.assertLogs('data_processor', level='WARNING') as logs:
+            self.assertEqual(processor.attach_rating_store(self.open_store()), 3)
+        self.assertTrue(any('not between 1 and 5' in line for line in logs.output))
+        self.assertEqual(list(processor.columns['star_rating'][:3]), [4, 0, 0])
+
+class TestHotReload(unittest.TestCase):
+    """Test reloading the playlist file while the old data keeps serving"""
+    
+    def setUp(self):
+        """Copy the sample playlist to a file the tests can change"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        with open(sample, 'r', encoding='utf-8') as file:
+            self.data = json.load(file)
+        self.json_path = os.path.join(self.tmp_dir.name, 'playlist.json')
+        self.write_playlist(self.data)
+        
+        self.processor = PlaylistDataProcessor(self.json_path)
+        self.processor.load_and_normalize()
+        self.ids = list(self.processor.columns['id'])
+    
+    def write_playlist(self, data):
+        with open(self.json_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+    
+    def changed_playlist(self):
+        """The sample without its first song and with the rest in reverse order"""
+        keys = list(self.data['id'])[1:][::-1]
+        return {attribute: {str(row): values[key] for row, key in enumerate(keys)}
+                for attribute, values in self.data.items()}
+    
+    def ratings_by_id(self, processor):
+        columns = processor.columns
+        return {song_id: int(rating) for song_id, rating in zip(columns['id'], columns['star_rating']) if rating}
+    
+    def test_ratings_carry_forward_by_id(self):
+        """Test that ratings follow their songs to new positions and old readers are unaffected"""
+        self.processor.update_star_ratings(self.ids[:3], [5, 4, 3])
+        old_snapshot = self.processor.snapshot()
+        self.write_playlist(self.changed_playlist())
+        
+        successor = self.processor.build_successor()
+        self.assertEqual(len(successor.columns['index']), len(self.ids) - 1)
+        self.assertEqual(self.processor.hand_over(successor), 2)
+        self.assertEqual(self.ratings_by_id(successor), {self.ids[1]: 4, self.ids[2]: 3})
+        self.assertEqual(successor.stats.summary('star_rating')['rated'], 2)
+        
+        # A write reaching the old processor after the hand-over lands in the new one
+        self.assertTrue(self.processor.update_star_rating(self.ids[-1], 2))
+        self.assertEqual(self.processor.update_star_ratings([self.ids[4], self.ids[0]], [1, 1]), [self.ids[0]])
+        self.assertEqual(self.ratings_by_id(successor)[self.ids[-1]], 2)
+        self.assertEqual(self.ratings_by_id(successor)[self.ids[4]], 1)
+        self.assertIs(self.processor.snapshot(), old_snapshot)
+        with self.assertRaises(ValueError):
+            self.processor.hand_over(successor)
+    
+    def test_rating_store_moves_to_successor(self):
+        """Test that the rating log follows the reload and keeps ratings of removed songs"""
+        store = RatingStore(os.path.join(self.tmp_dir.name, 'ratings'), durability='none')
+        self.addCleanup(store.close)
+        self.processor.attach_rating_store(store)
+        self.processor.update_star_ratings(self.ids[:2], [5, 4])
+        
+        self.write_playlist(self.changed_playlist())
+        successor = self.processor.build_successor()
+        self.processor.hand_over(successor)
+        self.assertIsNone(self.processor.rating_store)
+        self.assertIs(successor.rating_store, store)
+        self.processor.update_star_rating(self.ids[5], 3)
+        self.assertEqual(store.ratings, {self.ids[0]: 5, self.ids[1]: 4, self.ids[5]: 3})
+        
+        # The removed song's rating comes back with it
+        self.write_playlist(self.data)
+        restored = successor.build_successor()
+        successor.hand_over(restored)
+        self.assertEqual(self.ratings_by_id(restored), {self.ids[0]: 5, self.ids[1]: 4, self.ids[5]: 3})
+    
+    def test_failed_reload_keeps_serving(self):
+        """Test that a broken file leaves the current processor in place"""
+        published = []
+        reloader = PlaylistReloader(lambda: self.processor, published.append)
+        with open(self.json_path, 'w', encoding='utf-8') as file:
+            file.write('{"id": {"0": ')
+        
+        status = reloader.reload()
+        self.assertEqual(status['state'], 'failed')
+        self.assertEqual(published, [])
+        self.assertTrue(self.processor.update_star_rating(self.ids[0], 5))
+        self.assertEqual(self.ratings_by_id(self.processor), {self.ids[0]: 5})
+    
+    def test_watcher_reloads_changed_file(self):
+        """Test that the watcher publishes a new processor once the file changes"""
+        current = [self.processor]
+        reloader = PlaylistReloader(lambda: current[-1], current.append)
+        self.addCleanup(reloader.close)
+        self.processor.update_star_rating(self.ids[1], 4)
+        reloader.watch(0.01)
+        
+        self.write_playlist(self.changed_playlist())
+        deadline = time.monotonic() + 10
+        while len(current) == 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        self.assertEqual(len(current), 2)
+        self.assertEqual(len(current[-1].columns['index']), len(self.ids) - 1)
+        self.assertEqual(self.ratings_by_id(current[-1]), {self.ids[1]: 4})
+        self.assertEqual(reloader.status['reloads'], 1)
+    
+    def test_reload_endpoint(self):
+        """Test the admin endpoint swaps in new data while a held processor keeps the old"""
+        main.processor = self.processor
+        main.reloader = PlaylistReloader(main.current_processor, main.publish_processor)
+        self.addCleanup(setattr, main, 'reloader', None)
+        client = TestClient(main.app)
+        client.post('/api/songs/rating', json={'song_id': self.ids[0], 'rating': 5})
+        self.write_playlist(self.changed_playlist())
+        
+        response = client.post('/api/admin/reload', params={'wait': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['songs'], len(self.ids) - 1)
+        self.assertEqual(client.get('/api/songs').json()['total'], len(self.ids) - 1)
+        self.assertEqual(len(self.processor.columns['index']), len(self.ids))
+        self.assertIsNot(main.processor, self.processor)
+        
+        # The first song was removed, so its rating does not apply any more
+        response = client.post('/api/songs/rating', json={'song_id': self.ids[0], 'rating': 2})
+        self.assertEqual(response.status_code, 404)
+        
+        # A background reload; the blocking one after it waits for it to finish first
+        self.assertEqual(client.post('/api/admin/reload').status_code, 202)
+        main.reloader.reload()
+        self.assertEqual(client.get('/api/admin/reload').json()['reloads'], 3)
+        
+        with patch('main.PLAYLIST_ADMIN_TOKEN', 'secret'):
+            self.assertEqual(client.post('/api/admin/reload').status_code, 403)
+            self.assertEqual(client.get('/api/admin/reload', headers={'X-Admin-Token': 'secret'}).status_code, 200)
+
+class TestStartup(unittest.TestCase):
+    """Test loading the dataset in the background behind liveness and readiness probes"""
+    
+    def start_settings(self, source: str) -> dict:
+        return dict(PLAYLIST_SOURCE=source, PLAYLIST_BACKGROUND_LOAD=True, PLAYLIST_CACHE_DIR='',
+                    PLAYLIST_RATINGS_DIR='', PLAYLIST_DIR='', PLAYLIST_RELOAD_INTERVAL=0, processor=None,
+                    reloader=None, registry=None, startup_status='loading', startup_error=None, startup_timings={})
+    
+    def wait_for(self, client: TestClient, predicate) -> dict:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            body = client.get('/health/ready').json()
+            if predicate(body):
+                return body
+            time.sleep(0.01)
+        self.fail(f"Readiness never matched, last seen: {body}")
+    
+    def test_background_load_serves_before_search_indexes(self):
+        """Test that pages and ratings are served while the search indexes are still being built"""
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        release = threading.Event()
+        build_indexes = PlaylistDataProcessor.build_indexes
+        
+        def held_build(processor):
+            release.wait(10)
+            build_indexes(processor)
+        
+        with patch.multiple(main, **self.start_settings(sample)), \
+                patch.object(PlaylistDataProcessor, 'build_indexes', held_build):
+            client = TestClient(main.app)
+            self.assertEqual(client.get('/health/live').status_code, 200)
+            loading = client.get('/health/ready')
+            self.assertEqual((loading.status_code, loading.json()['status']), (503, 'loading'))
+            response = client.get('/api/songs')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['retry-after'], '1')
+            
+            with TestClient(main.app) as client:
+                body = self.wait_for(client, lambda body: body['status'] == 'ready')
+                self.assertEqual(body['indexes'], 'building')
+                for phase in ('imports', 'app', 'dataset', 'ready'):
+                    self.assertIn(phase, body['timings'])
+                self.assertEqual(client.get('/api/songs').status_code, 200)
+                song_id = main.processor.columns['id'][0]
+                rating = client.post('/api/songs/rating', json={'song_id': song_id, 'rating': 4})
+                self.assertEqual(rating.status_code, 200)
+                
+                release.set()
+                search = client.get('/api/songs/search', params={'title': main.processor.columns['title'][0]})
+                self.assertEqual(search.status_code, 200)
+                self.assertEqual(search.json()['id'], song_id)
+                self.wait_for(client, lambda body: body['indexes'] == 'ready' and 'indexes' in body['timings'])
+                self.assertIn('title_index', main.processor.load_timings)
+                self.assertIn('playlist_startup_phase_seconds{phase="indexes"}', client.get('/metrics').text)
+    
+    def test_failed_background_load(self):
+        """Test that a failed load fails both probes instead of leaving the server loading forever"""
+        with patch.multiple(main, **self.start_settings(os.path.join(tempfile.gettempdir(), 'missing-playlist.json'))):
+            with TestClient(main.app) as client:
+                body = self.wait_for(client, lambda body: body['status'] != 'loading')
+                self.assertEqual(body['status'], 'failed')
+                self.assertIn('missing-playlist.json', body['error'])
+                self.assertEqual(client.get('/health/ready').status_code, 503)
+                self.assertEqual(client.get('/health/live').status_code, 503)
+                self.assertEqual(client.get('/api/songs').status_code, 503)
+    
+    def test_import_leaves_pandas_unloaded(self):
+        """Test that importing the app does not import pandas, so serving can start before it loads"""
+        check = "import sys, main; sys.exit('pandas' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', check], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+class TestPlaylistRegistry(unittest.TestCase):
+    """Test serving many playlists, loaded lazily under a memory budget"""
+    
+    NAMES = ('jazz', 'pop', 'rock')
+    
+    def setUp(self):
+        """Split the sample playlist into three playlist files"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        with open(sample, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        self.frames = {}
+        self.playlist_bytes = 0
+        for part, name in enumerate(self.NAMES):
+            keys = list(data['id'])[part::len(self.NAMES)]
+            with open(os.path.join(self.tmp_dir.name, f'{name}.json'), 'w', encoding='utf-8') as file:
+                json.dump({attribute: {str(row): values[key] for row, key in enumerate(keys)}
+                           for attribute, values in data.items()}, file)
+            processor = PlaylistDataProcessor(os.path.join(self.tmp_dir.name, f'{name}.json'))
+            self.frames[name] = processor.load_and_normalize()
+            # Budgets are in units of the largest playlist, so a budget of 2.2 holds any two of these three
+            self.playlist_bytes = max(self.playlist_bytes, processor.memory_report()['total_bytes'])
+    
+    def make_registry(self, playlists_in_budget: float, **options) -> PlaylistRegistry:
+        registry = PlaylistRegistry(self.tmp_dir.name, int(self.playlist_bytes * playlists_in_budget), **options)
+        self.addCleanup(registry.close)
+        return registry
+    
+    def test_lazy_loading_shares_one_load(self):
+        """Test that nothing loads up front and concurrent first requests share one load"""
+        registry = self.make_registry(10)
+        self.assertEqual(registry.names(), list(self.NAMES))
+        self.assertEqual(registry.status()['loaded'], [])
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get('pop'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(registry.loads, 1)
+        self.assertTrue(all(processor is results[0] for processor in results))
+        pd.testing.assert_frame_equal(results[0].get_normalized_data(), self.frames['pop'])
+        
+        for name in ('missing', '../jazz', '.hidden'):
+            with self.assertRaises(KeyError):
+                registry.get(name)
+    
+    def test_least_recently_used_unloaded_and_ratings_kept(self):
+        """Test eviction order under the budget, and that ratings survive unloading with or without a rating log"""
+        for ratings_dir in (None, os.path.join(self.tmp_dir.name, 'ratings')):
+            with self.subTest(ratings_dir=ratings_dir):
+                registry = self.make_registry(2.2, ratings_dir=ratings_dir, ratings_durability='none')
+                jazz = registry.get('jazz')
+                song_id = jazz.columns['id'][3]
+                self.assertTrue(jazz.update_star_rating(song_id, 4))
+                registry.get('pop')
+                registry.get('jazz')
+                registry.get('rock')
+                self.assertEqual([entry['name'] for entry in registry.status()['loaded']], ['jazz', 'rock'])
+                self.assertEqual(registry.evictions, 1)
+                
+                registry.get('pop')
+                self.assertNotIn('jazz', [entry['name'] for entry in registry.status()['loaded']])
+                # A request still holding the unloaded processor reads from it, and its writes reach the reloaded one
+                self.assertEqual(jazz.columns['star_rating'][3], 4)
+                self.assertTrue(jazz.update_star_rating(jazz.columns['id'][5], 2))
+                reloaded = registry.get('jazz')
+                self.assertIsNot(reloaded, jazz)
+                self.assertEqual(reloaded.columns['star_rating'][3], 4)
+                self.assertEqual(reloaded.columns['star_rating'][5], 2)
+                self.assertLessEqual(registry.status()['bytes'], registry.memory_budget)
+    
+    def test_playlist_routes_and_fan_out(self):
+        """Test the scoped routes, and that cross-playlist search and stats match each playlist's own"""
+        registry = self.make_registry(10)
+        main.processor = PlaylistDataProcessor(os.path.join(self.tmp_dir.name, 'jazz.json'))
+        main.processor.load_and_normalize()
+        with patch('main.registry', registry):
+            client = TestClient(main.app)
+            for name in self.NAMES:
+                body = client.get(f'/api/playlists/{name}/songs', params={'size': 3}).json()
+                self.assertEqual(body['total'], len(self.frames[name]))
+                self.assertEqual([song['id'] for song in body['songs']], list(self.frames[name]['id'][:3]))
+            self.assertEqual(client.get('/api/playlists/missing/songs').status_code, 404)
+            
+            song_id = self.frames['rock']['id'][0]
+            response = client.post('/api/playlists/rock/songs/rating', json={'song_id': song_id, 'rating': 5})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(registry.get('rock').columns['star_rating'][0], 5)
+            self.assertEqual(main.processor.columns['star_rating'].max(), 0)
+            
+            title = str(self.frames['pop']['title'][2])
+            results = client.get('/api/playlists/search', params={'title': title, 'limit': 3}).json()['results']
+            for result in results:
+                single = client.get(f"/api/playlists/{result['playlist']}/songs/search", params={'title': title, 'limit': 3})
+                self.assertEqual(result['songs'], single.json())
+            self.assertIn('pop', [result['playlist'] for result in results])
+            
+            body = client.get('/api/playlists/stats', params={'columns': 'energy,tempo', 'playlists': 'jazz,rock'}).json()
+            self.assertEqual(list(body['playlists']), ['jazz', 'rock'])
+            combined = pd.concat([self.frames['jazz'], self.frames['rock']])
+            self.assertEqual(body['total_songs'], len(combined))
+            for column in ('energy', 'tempo'):
+                self.assertAlmostEqual(body['statistics'][column]['mean'], combined[column].mean())
+                self.assertAlmostEqual(body['statistics'][column]['std'], combined[column].std(ddof=0))
+                self.assertEqual(body['statistics'][column]['max'], combined[column].max())
+            self.assertEqual(client.get('/api/playlists/stats', params={'playlists': 'nope'}).status_code, 404)
+            self.assertEqual(client.get('/api/playlists/stats', params={'columns': 'title'}).status_code, 400)
+            
+            self.assertEqual(client.get('/api/playlists').json()['playlists'], list(self.NAMES))
+            self.assertIn('path="/api/playlists/{name}/songs",status="200"', client.get('/metrics').text)
+        
+        with patch('main.registry', None):
+            self.assertEqual(client.get('/api/playlists/jazz/songs').status_code, 404)
+
+class TestParallelIngest(unittest.TestCase):
+    """Test ingesting a playlist file or shard directory in worker processes"""
+    
+    def setUp(self):
+        """Write the sample playlist as one file and as three shards of consecutive rows, the last without energy"""
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        with open(sample, 'r', encoding='utf-8') as file:
+            self.data = json.load(file)
+        self.data['title']['1'] = 'Say "{hi}" \\'
+        self.data['title']['2'] = '}}\\"{'
+        
+        self.path = os.path.join(self.tmp_dir.name, 'playlist.json')
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump(self.data, file, indent=1)
+        self.shard_dir = os.path.join(self.tmp_dir.name, 'shards')
+        os.mkdir(self.shard_dir)
+        keys = list(self.data['id'])
+        for shard, start in enumerate(range(0, len(keys), 40)):
+            self.write_shard(f'part-{shard}.json', keys[start:start + 40])
+        self.expected = PlaylistDataProcessor(self.path).load_and_normalize()
+    
+    def write_shard(self, name: str, keys):
+        shard = {attribute: {key: values[key] for key in keys} for attribute, values in self.data.items()}
+        if name == 'part-2.json':
+            del shard['energy']
+        with open(os.path.join(self.shard_dir, name), 'w', encoding='utf-8') as file:
+            json.dump(shard, file)
+    
+    def test_attribute_ranges_skip_braces_in_strings(self):
+        """Test that the scan finds every attribute's row object at any block size"""
+        expected = attribute_ranges(self.path)
+        self.assertEqual([attribute for attribute, _, _ in expected], list(self.data))
+        with open(self.path, 'rb') as file:
+            raw = file.read()
+        for attribute, start, end in expected:
+            self.assertEqual(json.loads(raw[start:end]), self.data[attribute])
+        for block_size in (1, 3, 64):
+            self.assertEqual(attribute_ranges(self.path, block_size), expected)
+    
+    def test_split_range_cuts_between_entries(self):
+        """Test that chunks of a row object hold whole entries, whatever the strings in them contain"""
+        data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        raw = bytes(data)
+        for attribute, start, end in attribute_ranges(self.path):
+            for chunk_bytes in (1, 7, 100, end - start):
+                chunks = split_range(data, start, end, chunk_bytes)
+                rows = {}
+                for first, last in chunks:
+                    rows.update(json.loads(b'{' + raw[first:last] + b'}'))
+                self.assertEqual(list(rows.items()), list(self.data[attribute].items()), (attribute, chunk_bytes))
+                if chunk_bytes == 1:
+                    self.assertEqual(len(chunks), len(self.data[attribute]))
+    
+    def test_parallel_chunks_balance_one_file(self):
+        """Test that one file is cut into many chunks across the workers and still gives the serial frame"""
+        busy = {}
+        with patch.multiple(parallel_ingest, MIN_CHUNK_BYTES=256, CHUNKS_PER_WORKER=64):
+            columns = ingest_columns(self.path, _convert_values, 2, busy)
+            self.assertGreater(len(parallel_ingest._plan_tasks([self.path], 2)), len(self.data))
+        processor = PlaylistDataProcessor(self.path)
+        pd.testing.assert_frame_equal(pd.DataFrame(processor._finalize_columns(columns)), self.expected)
+        self.assertTrue(1 <= len(busy) <= 2)
+        self.assertTrue(all(seconds > 0 for seconds in busy.values()))
+    
+    def test_parallel_load_matches_serial(self):
+        """Test that a file and shards give the serial frame with one or several workers"""
+        missing_energy = self.expected.copy()
+        missing_energy.loc[missing_energy['index'] >= 80, 'energy'] = np.nan
+        
+        for source, expected in ((self.path, self.expected), (self.shard_dir, missing_energy)):
+            for workers in (1, 2):
+                processor = PlaylistDataProcessor(source, load_mode='parallel', ingest_workers=workers)
+                pd.testing.assert_frame_equal(processor.load_and_normalize(), expected)
+            # Shards are read in this process in the other load modes
+            serial = PlaylistDataProcessor(source, load_mode='streaming').load_and_normalize()
+            pd.testing.assert_frame_equal(serial, expected)
+        
+        self.write_shard('part-3.json', ['0'])
+        with self.assertRaises(ValueError):
+            ingest_columns(self.shard_dir, _convert_values)
+    
+    def test_shard_directory_snapshot_and_signature(self):
+        """Test that the snapshot and reload signature of a shard directory follow its shards"""
+        signature = source_signature(self.shard_dir)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold = PlaylistDataProcessor(self.shard_dir, cache_dir=cache_dir).load_and_normalize()
+            with patch.object(PlaylistDataProcessor, '_parse_columns') as parse:
+                warm = PlaylistDataProcessor(self.shard_dir, cache_dir=cache_dir).load_and_normalize()
+                parse.assert_not_called()
+            pd.testing.assert_frame_equal(warm, cold)
+            
+            self.data['title']['0'] = 'Renamed Song'
+            self.write_shard('part-0.json', list(self.data['id'])[:40])
+            os.utime(os.path.join(self.shard_dir, 'part-0.json'), ns=(0, 2**62))
+            self.assertNotEqual(source_signature(self.shard_dir), signature)
+            rebuilt = PlaylistDataProcessor(self.shard_dir, cache_dir=cache_dir).load_and_normalize()
+            self.assertEqual(rebuilt.iloc[0]['title'], 'Renamed Song')
+
+class TestLiveRatings(unittest.TestCase):
+    """Test pushing coalesced rating updates to subscribers over WebSocket"""
+    
+    def test_batches_coalesce_and_fan_out_by_song(self):
+        """Test that writes within a window become one batch and each subscriber gets only its songs"""
+        stats_calls = []
+        
+        async def run():
+            feed = RatingFeed(0.05, stats=lambda: stats_calls.append(1) or {'rated': len(stats_calls)})
+            feed.start(asyncio.get_running_loop())
+            everything = feed.subscribe()
+            page = feed.subscribe(['a', 'b'])
+            quiet = feed.subscribe(['b'], stats=False)
+        
+            # Written from other threads, as rating POSTs are
+            await asyncio.to_thread(feed.publish, [('a', 1), ('c', 2)])
+            await asyncio.to_thread(feed.publish, [('a', 3)])
+            first = json.loads(await everything.next())
+            self.assertEqual(first, {'type': 'ratings', 'batch': 1, 'ratings': {'a': 3, 'c': 2}, 'stats': {'rated': 1}})
+            self.assertEqual(json.loads(await page.next())['ratings'], {'a': 3})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(quiet.next(), 0.1)
+            self.assertEqual((feed.batches, feed.updates, len(stats_calls)), (1, 2, 1))
+        
+            # A subscriber that falls behind gets one merged message, and a new page replaces the old one
+            feed.watch(page, ['c'])
+            feed.publish([('b', 4), ('c', 5)])
+            await asyncio.sleep(0.1)
+            feed.publish([('c', 1)])
+            await asyncio.sleep(0.1)
+            self.assertEqual(json.loads(await page.next()), {'type': 'ratings', 'batch': 3, 'ratings': {'c': 1}, 'stats': {'rated': 3}})
+            self.assertEqual(json.loads(await quiet.next()), {'type': 'ratings', 'batch': 2, 'ratings': {'b': 4}})
+            self.assertEqual(json.loads(await everything.next())['ratings'], {'b': 4, 'c': 1})
+        
+            with self.assertRaises(ValueError):
+                feed.watch(page, [str(song) for song in range(MAX_WATCHED_SONGS + 1)])
+            feed.close()
+            self.assertIsNone(await everything.next())
+            self.assertEqual(feed.subscribers, 0)
+            # Nobody listens, so writes are not even collected
+            feed.publish([('a', 2)])
+            self.assertEqual(feed._pending, {})
+        
+        asyncio.run(run())
+    
+    def test_shared_mode_feed_pushes_other_workers_writes(self):
+        """Test that polling the shared rating column pushes writes made by another worker"""
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Two processors sharing one rating column stand in for two workers
+            this_worker = PlaylistDataProcessor(sample, cache_dir=cache_dir, shared=True)
+            other_worker = PlaylistDataProcessor(sample, cache_dir=cache_dir, shared=True)
+            this_worker.load_and_normalize()
+            other_worker.load_and_normalize()
+            song_ids = to_python_list(this_worker.columns['id'][:3])
+            
+            polled_on = set()
+            
+            def source():
+                polled_on.add(threading.current_thread())
+                return this_worker.shared_rating_changes()
+            
+            async def run():
+                feed = RatingFeed(0.01)
+                feed.start(asyncio.get_running_loop())
+                feed.poll(source, 0.02)
+                subscription = feed.subscribe(song_ids[:2], stats=False)
+                await asyncio.sleep(0.05)
+                
+                await asyncio.to_thread(other_worker.update_star_ratings, song_ids, [4, 2, 5])
+                message = json.loads(await asyncio.wait_for(subscription.next(), 5))
+                self.assertEqual(message['ratings'], {song_ids[0]: 4, song_ids[1]: 2})
+                
+                # Unchanged ratings are not pushed again
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(subscription.next(), 0.1)
+                feed.close()
+                self.assertIsNone(feed._poll_handle)
+            
+            asyncio.run(run())
+            # The whole-column comparison runs off the event loop
+            self.assertTrue(polled_on)
+            self.assertNotIn(threading.main_thread(), polled_on)
+            self.assertEqual(this_worker.shared_rating_changes(), [])
+    
+    def test_websocket_pushes_page_ratings(self):
+        """Test that a dashboard page gets its songs' ratings, and the rating stats, as other clients write them"""
+        sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'playlist.json')
+        settings = dict(PLAYLIST_SOURCE=sample, PLAYLIST_BACKGROUND_LOAD=False, PLAYLIST_CACHE_DIR='',
+                        PLAYLIST_RATINGS_DIR='', PLAYLIST_DIR='', PLAYLIST_RELOAD_INTERVAL=0, PLAYLIST_ADMIN_TOKEN='',
+                        processor=None, reloader=None, registry=None, startup_status='loading',
+                        startup_error=None, startup_timings={})
+        with patch.multiple(main, **settings), TestClient(main.app) as client:
+            first_page = [song['id'] for song in client.get('/api/songs', params={'size': 5}).json()['songs']]
+            second_page = [song['id'] for song in client.get('/api/songs', params={'page': 2, 'size': 5}).json()['songs']]
+        
+            with client.websocket_connect('/api/songs/ratings/live') as websocket:
+                websocket.send_text(json.dumps({'subscribe': first_page + ['no-such-song']}))
+                self.assertEqual(json.loads(websocket.receive_text())['ratings'], dict.fromkeys(first_page, 0))
+        
+                updates = [(first_page[0], 3), (first_page[0], 5), (first_page[1], 2), (second_page[0], 4)]
+                client.post('/api/songs/ratings', json={'ratings': [{'song_id': song_id, 'rating': rating}
+                                                                    for song_id, rating in updates]})
+                message = json.loads(websocket.receive_text())
+                self.assertEqual(message['ratings'], {first_page[0]: 5, first_page[1]: 2})
+                self.assertEqual(message['stats']['total_songs'], 100)
+                self.assertEqual(message['stats']['statistics']['star_rating']['rated'], 3)
+        
+                # Turning the page sends the new page's current ratings first
+                websocket.send_text(json.dumps({'subscribe': second_page, 'stats': False}))
+                self.assertEqual(json.loads(websocket.receive_text())['ratings'], {**dict.fromkeys(second_page, 0), second_page[0]: 4})
+                websocket.send_text('{"subscribe": "everything"}')
+                self.assertEqual(json.loads(websocket.receive_text())['type'], 'error')
+                self.assertIn('playlist_rating_feed_subscribers 1', client.get('/metrics').text)
+        
+                # Writes to a reloaded dataset are pushed too
+                self.assertEqual(client.post('/api/admin/reload', params={'wait': 'true'}).status_code, 200)
+                client.post('/api/songs/rating', json={'song_id': second_page[1], 'rating': 1})
+                self.assertEqual(json.loads(websocket.receive_text()), {'type': 'ratings', 'batch': 2, 'ratings': {second_page[1]: 1}})
+        
+            deadline = time.monotonic() + 5
+            while main.rating_feed.subscribers and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(main.rating_feed.subscribers, 0)
+
 if __name__ == '__main__':
     unittest.main()
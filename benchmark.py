@@ -0,0 +1,819 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the playlist data processing backend
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import httpx
+import numpy as np
+import pandas as pd
+import main
+import export
+from data_processor import PlaylistDataProcessor, _convert_values
+from parallel_ingest import ingest_columns
+from rating_store import RatingStore
+from search_index import TitleIndex
+from similarity import SIMILARITY_FEATURES, SimilarityIndex
+
+DEFAULT_LOAD_SIZES = [1_000, 10_000, 100_000, 1_000_000, 5_000_000]
+
+def make_synthetic_playlist(num_songs: int, seed: int = 42) -> dict:
+    """Build a column-oriented playlist dict shaped like assets/playlist.json"""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    words = ['love', 'night', 'fire', 'dream', 'summer', 'heart', 'city', 'rain', 'gold', 'wild']
+
+    def column(make_value):
+        return {str(i): make_value(i) for i in range(num_songs)}
+
+    return {
+        'id': column(lambda i: ''.join(rng.choice(alphabet) for _ in range(22))),
+        'title': column(lambda i: f"{rng.choice(words).title()} {rng.choice(words).title()} {i}"),
+        'danceability': column(lambda i: round(rng.random(), 3)),
+        'energy': column(lambda i: round(rng.random(), 3)),
+        'key': column(lambda i: rng.randint(0, 11)),
+        'loudness': column(lambda i: round(rng.uniform(-30, 0), 3)),
+        'mode': column(lambda i: rng.randint(0, 1)),
+        'acousticness': column(lambda i: round(rng.random(), 5)),
+        'instrumentalness': column(lambda i: round(rng.random(), 5)),
+        'liveness': column(lambda i: round(rng.random(), 4)),
+        'valence': column(lambda i: round(rng.random(), 3)),
+        'tempo': column(lambda i: round(rng.uniform(60, 200), 3)),
+        'duration_ms': column(lambda i: rng.randint(60_000, 480_000)),
+        'time_signature': column(lambda i: rng.choice([3, 4, 4, 4, 5])),
+        'num_bars': column(lambda i: rng.randint(20, 250)),
+        'num_sections': column(lambda i: rng.randint(3, 15)),
+        'num_segments': column(lambda i: rng.randint(200, 1500)),
+        'class': column(lambda i: rng.randint(0, 1)),
+    }
+
+def write_synthetic_playlist(path: str, num_songs: int, seed: int = 42):
+    """Write a synthetic playlist JSON file with num_songs rows"""
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(make_synthetic_playlist(num_songs, seed), file)
+
+def write_synthetic_shards(directory: str, num_songs: int, shards: int, seed: int = 42):
+    """Write a synthetic playlist as shards files of consecutive rows, shard-0000.json and so on"""
+    os.makedirs(directory, exist_ok=True)
+    data = make_synthetic_playlist(num_songs, seed)
+    bounds = np.linspace(0, num_songs, shards + 1).astype(int)
+    for shard, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        keys = [str(i) for i in range(start, stop)]
+        with open(os.path.join(directory, f'shard-{shard:04d}.json'), 'w', encoding='utf-8') as file:
+            json.dump({attribute: {key: values[key] for key in keys} for attribute, values in data.items()}, file)
+
+def legacy_load_and_normalize(json_file_path: str) -> pd.DataFrame:
+    """The original per-row dict loader, kept here as the comparison baseline"""
+    with open(json_file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+
+    first_key = list(data.keys())[0]
+    num_songs = len(data[first_key])
+
+    normalized_rows = []
+    for i in range(num_songs):
+        row = {'index': i}
+        for attribute, values in data.items():
+            row[attribute] = values[str(i)]
+        normalized_rows.append(row)
+
+    df = pd.DataFrame(normalized_rows)
+    df['star_rating'] = 0
+    df['duration_s'] = df['duration_ms'] / 1000
+    return df
+
+def measure(func, *args):
+    """Return (seconds, peak traced bytes, result) for func
+
+    Timing and memory come from separate runs because tracemalloc slows
+    allocation-heavy code down several times over.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+def bench_load(sizes):
+    """Compare the legacy row loop against the columnar and streaming loaders"""
+    print(f"{'Rows':>10} {'Legacy (s)':>12} {'Legacy peak':>12} {'Columnar (s)':>13} {'Columnar peak':>14} "
+          f"{'Stream (s)':>11} {'Stream peak':>12} {'Final size':>11}")
+    print("-" * 102)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            path = os.path.join(tmp_dir, f'playlist_{size}.json')
+            write_synthetic_playlist(path, size)
+
+            legacy_time, legacy_peak, _ = measure(legacy_load_and_normalize, path)
+            columnar_time, columnar_peak, _ = measure(PlaylistDataProcessor(path).load_and_normalize)
+            stream_time, stream_peak, df = measure(PlaylistDataProcessor(path, load_mode='streaming').load_and_normalize)
+            final_size = df.memory_usage(index=False, deep=True).sum()
+
+            print(f"{size:>10} {legacy_time:>12.3f} {legacy_peak / 2**20:>10.1f}MB "
+                  f"{columnar_time:>13.3f} {columnar_peak / 2**20:>12.1f}MB "
+                  f"{stream_time:>11.3f} {stream_peak / 2**20:>10.1f}MB {final_size / 2**20:>9.1f}MB")
+            os.remove(path)
+
+def bench_startup(sizes):
+    """Compare cold startup (parse + write snapshot) with warm startup (memory-mapped snapshot)"""
+    print(f"{'Rows':>10} {'No cache (s)':>13} {'Cold (s)':>10} {'Warm (s)':>10} {'Speedup':>8}")
+    print("-" * 55)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        for size in sizes:
+            path = os.path.join(tmp_dir, f'playlist_{size}.json')
+            write_synthetic_playlist(path, size)
+
+            timings = []
+            for kwargs in ({}, {'cache_dir': cache_dir}, {'cache_dir': cache_dir}):
+                start = time.perf_counter()
+                PlaylistDataProcessor(path, **kwargs).load_and_normalize()
+                timings.append(time.perf_counter() - start)
+
+            no_cache, cold, warm = timings
+            print(f"{size:>10} {no_cache:>13.3f} {cold:>10.3f} {warm:>10.3f} {no_cache / warm:>7.1f}x")
+            os.remove(path)
+
+def bench_memory(sizes):
+    """Compare the memory per song of the standard and compact column layouts"""
+    print(f"{'Rows':>10} {'Layout':>9} {'Load (s)':>9} {'Columns/song':>13} {'Indexes/song':>13} "
+          f"{'Total/song':>11} {'Total':>10} {'Same data':>10}")
+    print("-" * 92)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            path = os.path.join(tmp_dir, f'playlist_{size}.json')
+            write_synthetic_playlist(path, size)
+
+            records = None
+            for compact in (False, True):
+                processor = PlaylistDataProcessor(path, compact=compact)
+                start = time.perf_counter()
+                processor.load_and_normalize()
+                load_time = time.perf_counter() - start
+                report = processor.memory_report()
+
+                sample = main.encode_song_records(processor.columns, slice(0, min(size, 10_000)))
+                records = records or sample
+                print(f"{size:>10} {report['layout']:>9} {load_time:>9.2f} "
+                      f"{report['column_bytes'] / size:>11.0f} B {report['index_bytes'] / size:>11.0f} B "
+                      f"{report['bytes_per_song']:>9.0f} B {report['total_bytes'] / 2**20:>8.1f}MB "
+                      f"{str(sample == records):>10}")
+                del processor
+            os.remove(path)
+
+def time_per_call(func, *args, repeat: int = 20) -> float:
+    """Average wall time of func(*args) in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def bench_search(sizes):
+    """Compare the title index against the str.contains scan it replaced"""
+    queries = ['love', 'summer rain', 'gold 4', 'xyz', 'ni']
+    print(f"{'Rows':>10} {'Build (s)':>10} {'Query':>14} {'Scan (ms)':>10} {'First (ms)':>11} {'Top 10 (ms)':>12}")
+    print("-" * 72)
+
+    for size in sizes:
+        titles = pd.Series(list(make_synthetic_playlist(size)['title'].values()))
+        start = time.perf_counter()
+        index = TitleIndex(titles)
+        build_time = time.perf_counter() - start
+
+        for query in queries:
+            scan = time_per_call(lambda: titles[titles.str.contains(query, case=False, na=False)].head(1), repeat=3)
+            first = time_per_call(index.first_match, query)
+            top = time_per_call(index.search, query, 10)
+            print(f"{size:>10} {build_time:>10.2f} {query!r:>14} {scan:>10.2f} {first:>11.3f} {top:>12.3f}")
+
+def brute_force_similar(df: pd.DataFrame, row: int, k: int) -> np.ndarray:
+    """Nearest songs by standardizing the features and sorting every distance, per query"""
+    features = df[list(SIMILARITY_FEATURES)]
+    standardized = (features - features.mean()) / features.std(ddof=0)
+    distances = np.sqrt(((standardized - standardized.iloc[row]) ** 2).sum(axis=1)).to_numpy()
+    distances[row] = np.inf
+    return np.argsort(distances)[:k]
+
+def bench_similar(sizes, k: int, batch: int):
+    """Compare the similarity index against a brute-force pandas scan"""
+    print(f"{'Rows':>10} {'Build (s)':>10} {'Brute (ms)':>11} {'Index (ms)':>11} {'Speedup':>8} "
+          f"{f'Batch {batch} (ms/q)':>19} {'Same':>5}")
+    print("-" * 82)
+
+    for size in sizes:
+        playlist = make_synthetic_playlist(size)
+        df = pd.DataFrame({name: list(playlist[name].values()) for name in SIMILARITY_FEATURES})
+        columns = {'index': np.arange(size), **{name: df[name].to_numpy() for name in SIMILARITY_FEATURES}}
+        del playlist
+
+        start = time.perf_counter()
+        index = SimilarityIndex(columns)
+        build_time = time.perf_counter() - start
+
+        rows = np.random.default_rng(0).integers(0, size, batch)
+        brute = time_per_call(brute_force_similar, df, int(rows[0]), k, repeat=3)
+        single = time_per_call(index.nearest, rows[:1], k)
+        batched = time_per_call(index.nearest, rows, k, repeat=3) / batch
+        same = np.array_equal(brute_force_similar(df, int(rows[0]), k), index.nearest(rows[:1], k)[0][0])
+        print(f"{size:>10} {build_time:>10.2f} {brute:>11.1f} {single:>11.2f} {brute / single:>7.1f}x "
+              f"{batched:>19.2f} {str(same):>5}")
+
+async def legacy_get_all_songs(page: int = 1, size: int = 10):
+    """The original iterrows-based /api/songs handler, kept here as the comparison baseline"""
+    df = main.processor.get_normalized_data()
+    total = len(df)
+    start_idx = (page - 1) * size
+    songs = []
+    for _, row in df.iloc[start_idx:start_idx + size].iterrows():
+        songs.append(main.Song(**row.to_dict()))
+    return main.PaginatedResponse(songs=songs, total=total, page=page, size=size,
+                                  total_pages=(total + size - 1) // size)
+
+def load_app_data(path: str):
+    """Point the FastAPI app at a freshly loaded processor for path"""
+    main.processor = PlaylistDataProcessor(path)
+    main.processor.load_and_normalize()
+
+async def run_load(make_url, num_requests: int, concurrency: int, make_body=None, make_headers=None):
+    """Issue num_requests GETs (POSTs with make_body) against the in-process app; return (latencies in ms, seconds)"""
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    counter = iter(range(num_requests))
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def worker():
+            for i in counter:
+                start = time.perf_counter()
+                if make_body is None:
+                    response = await client.get(make_url(i), headers=make_headers(i) if make_headers else None)
+                else:
+                    response = await client.post(make_url(i), json=make_body(i))
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.is_error:
+                    response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return np.array(latencies), elapsed
+
+def bench_pagination(size: int, num_requests: int, concurrency: int, page_size: int):
+    """Load test GET /api/songs against the legacy iterrows handler"""
+    main.app.add_api_route('/bench/legacy/songs', legacy_get_all_songs, response_model=main.PaginatedResponse)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        write_synthetic_playlist(path, size)
+        load_app_data(path)
+
+    rng = random.Random(0)
+    pages = [rng.randint(1, max(size // page_size, 1)) for _ in range(num_requests)]
+
+    print(f"{size} songs, {num_requests} requests, concurrency {concurrency}, page size {page_size}")
+    print(f"{'Handler':>10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'req/s':>10}")
+    print("-" * 44)
+    for name, route in (('legacy', '/bench/legacy/songs'), ('columnar', '/api/songs')):
+        latencies, elapsed = asyncio.run(run_load(
+            lambda i: f'{route}?page={pages[i]}&size={page_size}', num_requests, concurrency))
+        print(f"{name:>10} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f} "
+              f"{num_requests / elapsed:>10.0f}")
+
+async def fetch_etags(urls):
+    """The ETag each URL is currently served with"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url='http://bench') as client:
+        return {url: (await client.get(url)).headers['etag'] for url in urls}
+
+def bench_cache(size: int, num_requests: int, concurrency: int):
+    """Dashboard-style repeated reads with the response cache off, on, and revalidated with If-None-Match"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        write_synthetic_playlist(path, size)
+        load_app_data(path)
+
+    urls = [f'/api/songs?page={page}&size=100' for page in range(1, 6)]
+    urls += [f'/api/songs?page=1&size=100&sort_by={column}&order=desc' for column in ('energy', 'tempo', 'title')]
+    urls += ['/api/stats', '/api/charts/histogram?column=duration_s&bins=20',
+             '/api/charts/scatter?y=energy&max_points=500']
+    cache = main.response_cache or main.ResponseCache()
+
+    print(f"{size} songs, {num_requests} requests over {len(urls)} URLs, concurrency {concurrency}")
+    print(f"{'Cache':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'req/s':>10}")
+    print("-" * 46)
+    for mode in ('off', 'on', 'revalidate'):
+        main.response_cache = None if mode == 'off' else cache
+        make_headers = None
+        if mode == 'revalidate':
+            etags = asyncio.run(fetch_etags(urls))
+            make_headers = lambda i: {'If-None-Match': etags[urls[i % len(urls)]]}
+        latencies, elapsed = asyncio.run(run_load(lambda i: urls[i % len(urls)], num_requests, concurrency,
+                                                  make_headers=make_headers))
+        print(f"{mode:>12} {np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 99):>10.2f} "
+              f"{num_requests / elapsed:>10.0f}")
+    print(f"Cache: {cache.stats()}")
+
+async def post_batch(url: str, body: dict) -> int:
+    """POST one batch request to the in-process app, returning the response size"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url='http://bench') as client:
+        response = await client.post(url, json=body)
+        response.raise_for_status()
+        return len(response.content)
+
+def bench_batch(size: int, batch_sizes, concurrency: int):
+    """Per-title GET /api/songs/search calls vs one batch request for the same titles"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        write_synthetic_playlist(path, size)
+        load_app_data(path)
+    # Every lookup should do its full work, as a library sync's distinct titles would
+    main.response_cache = None
+
+    titles = main.processor.columns['title']
+    rng = random.Random(0)
+    print(f"{size} songs, per-title calls at concurrency {concurrency}")
+    print(f"{'Titles':>8} {'Per title (s)':>14} {'Batch JSON (s)':>15} {'Batch NDJSON (s)':>17} {'Speedup':>8}")
+    print("-" * 67)
+    for batch_size in batch_sizes:
+        queries = [str(titles[rng.randrange(size)]) for _ in range(batch_size)]
+        _, single = asyncio.run(run_load(lambda i: httpx.URL('/api/songs/search', params={'title': queries[i]}),
+                                         batch_size, concurrency))
+        timings = []
+        for url in ('/api/songs/search/batch', '/api/songs/search/batch?format=ndjson'):
+            start = time.perf_counter()
+            asyncio.run(post_batch(url, {'titles': queries}))
+            timings.append(time.perf_counter() - start)
+        print(f"{batch_size:>8} {single:>14.3f} {timings[0]:>15.3f} {timings[1]:>17.3f} "
+              f"{single / timings[0]:>7.1f}x")
+
+def same_columns(left: dict, right: dict) -> bool:
+    return list(left) == list(right) and all(
+        left[name].dtype == right[name].dtype and pd.Series(left[name]).equals(pd.Series(right[name]))
+        for name in left)
+
+def bench_ingest(size: int, shards: int, workers):
+    """Parse time of one large file and of a shard directory by number of worker processes, against json.load
+
+    Balance is the mean over the workers of the seconds each spent parsing,
+    divided by the most any one spent: 100% means no worker waited on
+    another, so the wall time can only shrink further with more CPUs.
+    """
+    cpus = os.cpu_count() or 1
+    print(f"{size} songs; one file and {shards} shards; {cpus} CPUs")
+    print(f"{'Source':>8} {'Workers':>8} {'Parse (s)':>10} {'Speedup':>8} {'Efficiency':>11} "
+          f"{'Busiest (s)':>12} {'Balance':>8} {'Same data':>10}")
+    print("-" * 82)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        shard_dir = os.path.join(tmp_dir, 'shards')
+        write_synthetic_playlist(path, size)
+        write_synthetic_shards(shard_dir, size, shards)
+
+        # The serial baseline every worker count is compared against
+        processor = PlaylistDataProcessor(path)
+        serial = processor._parse_columns()
+        baseline = processor.load_timings['parse']
+        print(f"{'file':>8} {'json.load':>8} {baseline:>10.3f} {1:>7.2f}x {'':>11} {'':>12} {'':>8} {'yes':>10}")
+
+        for source, source_path in (('file', path), ('shards', shard_dir)):
+            for count in workers:
+                busy = {}
+                start = time.perf_counter()
+                columns = ingest_columns(source_path, _convert_values, count, busy)
+                elapsed = time.perf_counter() - start
+                speedup = baseline / elapsed
+                busiest = max(busy.values()) if busy else elapsed
+                balance = f"{sum(busy.values()) / len(busy) / busiest:.0%}" if busy else ''
+                print(f"{source:>8} {count:>8} {elapsed:>10.3f} {speedup:>7.2f}x {speedup / count:>10.0%} "
+                      f"{busiest:>12.3f} {balance:>8} {'yes' if same_columns(columns, serial) else 'NO':>10}")
+                del columns
+    if max(workers) > cpus:
+        print(f"Worker counts above {cpus} share CPUs, so they cannot scale further here")
+
+def legacy_export_csv(df: pd.DataFrame, path: str):
+    """The original export: write the whole DataFrame to a temp file, then serve the file"""
+    df.to_csv(path, index=False)
+
+def consume(chunks) -> int:
+    """Drain a chunk iterator, returning the number of bytes produced"""
+    return sum(len(chunk) for chunk in chunks)
+
+def bench_export(sizes):
+    """Time-to-first-byte, total time and peak memory of the CSV export, temp file vs streaming"""
+    print(f"{'Rows':>10} {'Export':>10} {'TTFB (s)':>10} {'Total (s)':>10} {'Peak':>10} {'Size':>10}")
+    print("-" * 66)
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'playlist.json')
+            write_synthetic_playlist(path, size)
+            load_app_data(path)
+            columns = main.processor.columns
+            names = export.select_columns(columns)
+
+            # The file can only be served once it has been written completely
+            csv_path = os.path.join(tmp_dir, 'export.csv')
+            elapsed, peak, _ = measure(legacy_export_csv, main.processor.normalized_data, csv_path)
+            print(f"{size:>10} {'temp file':>10} {elapsed:>10.2f} {elapsed:>10.2f} {peak / 2**20:>8.1f}MB "
+                  f"{os.path.getsize(csv_path) / 2**20:>8.1f}MB")
+
+            for label, make_chunks in (('stream', lambda: export.iter_csv(columns, names)),
+                                       ('gzip', lambda: export.gzip_chunks(export.iter_csv(columns, names)))):
+                start = time.perf_counter()
+                chunks = make_chunks()
+                first = len(next(chunks))
+                first_byte = time.perf_counter() - start
+                total_bytes = first + consume(chunks)
+                elapsed = time.perf_counter() - start
+                _, peak, _ = measure(lambda: consume(make_chunks()))
+                print(f"{size:>10} {label:>10} {first_byte:>10.3f} {elapsed:>10.2f} {peak / 2**20:>8.1f}MB "
+                      f"{total_bytes / 2**20:>8.1f}MB")
+
+def bench_ratings(size: int, num_requests: int, concurrency: int):
+    """Throughput of POST /api/songs/rating without a rating log and at each durability level"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        write_synthetic_playlist(path, size)
+        load_app_data(path)
+        ids = main.processor.normalized_data['id'].tolist()
+        rng = random.Random(0)
+        bodies = [{'song_id': rng.choice(ids), 'rating': rng.randint(1, 5)} for _ in range(num_requests)]
+
+        print(f"{size} songs, {num_requests} rating POSTs, concurrency {concurrency}")
+        print(f"{'Durability':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'req/s':>10} {'fsyncs':>8}")
+        print("-" * 54)
+        for durability in (None, 'none', 'batch', 'sync'):
+            store = None
+            if durability is not None:
+                store = RatingStore(os.path.join(tmp_dir, f'ratings-{durability}'), durability=durability)
+            main.processor.rating_store = store
+
+            fsyncs = [0]
+            real_fsync = os.fsync
+            def counting_fsync(fd):
+                fsyncs[0] += 1
+                real_fsync(fd)
+            os.fsync = counting_fsync
+            try:
+                latencies, elapsed = asyncio.run(run_load(
+                    lambda i: '/api/songs/rating', num_requests, concurrency, lambda i: bodies[i]))
+            finally:
+                os.fsync = real_fsync
+                if store is not None:
+                    store.close()
+            print(f"{durability or 'no log':>12} {np.percentile(latencies, 50):>10.2f} "
+                  f"{np.percentile(latencies, 99):>10.2f} {num_requests / elapsed:>10.0f} {fsyncs[0]:>8}")
+        main.processor.rating_store = None
+
+def bench_concurrency(size: int, seconds: float, readers: int, write_rates):
+    """Read throughput of sorted /api/songs pages while rating writes run at several rates"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        write_synthetic_playlist(path, size)
+        load_app_data(path)
+    processor = main.processor
+    ids = processor.normalized_data['id'].tolist()
+
+    def read_page(rng):
+        snapshot = processor.snapshot()
+        start = rng.randrange(max(size - 100, 1))
+        positions, _, _ = processor.query.page('star_rating', False, [], start, 100, None, snapshot)
+        main.encode_song_records(snapshot.columns, positions)
+
+    print(f"{size} songs, {readers} reader threads, {seconds:.0f}s per run, sorted by star_rating")
+    print(f"{'Writes/s':>10} {'Reads/s':>10} {'Read p99 (ms)':>14} {'Writes done':>12}")
+    print("-" * 50)
+    for rate in write_rates:
+        stop = threading.Event()
+        latencies = [[] for _ in range(readers)]
+        writes = [0]
+
+        def reader(index):
+            rng = random.Random(index)
+            while not stop.is_set():
+                start = time.perf_counter()
+                read_page(rng)
+                latencies[index].append((time.perf_counter() - start) * 1000)
+
+        def writer():
+            rng = random.Random(0)
+            next_write = time.perf_counter()
+            while not stop.is_set():
+                processor.update_star_rating(rng.choice(ids), rng.randint(1, 5))
+                writes[0] += 1
+                next_write += 1 / rate
+                time.sleep(max(next_write - time.perf_counter(), 0))
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+        if rate:
+            threads.append(threading.Thread(target=writer))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        all_latencies = np.concatenate([np.array(values) for values in latencies])
+        print(f"{rate:>10} {len(all_latencies) / seconds:>10.0f} {np.percentile(all_latencies, 99):>14.2f} "
+              f"{writes[0]:>12}")
+
+# Regression suite: fixed workloads, timed per call, written as JSON and compared with a baseline
+SUITE_VERSION = 1
+# Timings compared against the baseline. Tail latencies are recorded too, but vary too much
+# from run to run on a shared machine to fail a build on
+SUITE_METRICS = ('p50_ms',)
+
+def summarize(latencies, elapsed: float = None) -> dict:
+    """Percentiles of per-call latencies in milliseconds, and throughput when the wall time is known"""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    summary = {
+        'count': len(latencies),
+        'mean_ms': round(float(latencies.mean()), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 4),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+        'max_ms': round(float(latencies.max()), 4),
+    }
+    if elapsed is not None:
+        summary['throughput_rps'] = round(len(latencies) / elapsed, 1)
+    return summary
+
+def time_calls(func, inputs, warmup: int = 1) -> np.ndarray:
+    """Milliseconds taken by func(item) for each item of inputs, after warmup untimed calls"""
+    inputs = list(inputs)
+    for item in inputs[:warmup]:
+        func(item)
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+def suite_micro(path: str, repeat: int, seed: int) -> dict:
+    """Per-call timings of the PlaylistDataProcessor methods the API is built on"""
+    rng = random.Random(seed)
+    load_and_normalize = lambda _: PlaylistDataProcessor(path).load_and_normalize()
+    results = {'load_and_normalize': summarize(time_calls(load_and_normalize, range(max(repeat // 50, 3))))}
+
+    processor = PlaylistDataProcessor(path)
+    processor.load_and_normalize()
+    ids = processor.columns['id'].tolist()
+    titles = processor.columns['title'].tolist()
+    size = len(ids)
+    # Whole titles, words that match many titles, and titles that match nothing
+    queries = [rng.choice([titles[rng.randrange(size)], rng.choice(['love', 'night', 'gold']), f'missing {i}'])
+               for i in range(repeat)]
+    batches = [[ids[rng.randrange(size)] for _ in range(100)] for _ in range(max(repeat // 5, 20))]
+    ratings = [(ids[rng.randrange(size)], rng.randint(1, 5)) for _ in range(repeat)]
+
+    results['get_song_by_title'] = summarize(time_calls(processor.get_song_by_title, queries))
+    results['search_songs'] = summarize(time_calls(processor.search_songs, queries))
+    results['search_titles_100'] = summarize(time_calls(processor.search_titles, [
+        [titles[rng.randrange(size)] for _ in range(100)] for _ in range(len(batches))]))
+    results['find_songs_100'] = summarize(time_calls(processor.find_songs, batches))
+    results['similar_songs'] = summarize(time_calls(lambda song_id: processor.similar_songs(song_id, 10),
+                                                    [song_id for song_id, _ in ratings]))
+    results['update_star_rating'] = summarize(time_calls(lambda item: processor.update_star_rating(*item), ratings))
+    results['update_star_ratings_100'] = summarize(time_calls(
+        lambda batch: processor.update_star_ratings(batch, [3] * len(batch)), batches))
+    return results
+
+def suite_http(path: str, num_requests: int, concurrency: int, seed: int) -> dict:
+    """Latency and throughput of the main endpoints under concurrent load, response cache off"""
+    load_app_data(path)
+    # Every request should do its handler's full work; the cache has its own benchmark
+    main.response_cache = None
+    rng = random.Random(seed)
+    ids = main.processor.columns['id'].tolist()
+    titles = main.processor.columns['title'].tolist()
+    size = len(ids)
+    pages = max(size // 100, 1)
+
+    scenarios = {
+        'songs_page': (lambda i: f'/api/songs?page={rng.randint(1, pages)}&size=100', None),
+        'songs_sorted': (lambda i: f'/api/songs?page={rng.randint(1, pages)}&size=100&sort_by=energy&order=desc', None),
+        'search': (lambda i: httpx.URL('/api/songs/search', params={'title': titles[rng.randrange(size)], 'limit': 10}),
+                   None),
+        'similar': (lambda i: f'/api/songs/{ids[rng.randrange(size)]}/similar?k=10', None),
+        'stats': (lambda i: '/api/stats', None),
+        'histogram': (lambda i: '/api/charts/histogram?column=energy&bins=20', None),
+        'rating': (lambda i: '/api/songs/rating',
+                   lambda i: {'song_id': ids[rng.randrange(size)], 'rating': rng.randint(1, 5)}),
+        'batch_100': (lambda i: '/api/songs/batch', lambda i: {'ids': [ids[rng.randrange(size)] for _ in range(100)]}),
+    }
+    results = {}
+    for name, (make_url, make_body) in scenarios.items():
+        # The stats endpoints are slow and always the same request, so they get fewer
+        count = num_requests if name not in ('stats', 'histogram') else max(num_requests // 10, concurrency)
+        # Untimed first requests build whatever the endpoint builds lazily, such as a sort order
+        asyncio.run(run_load(make_url, concurrency, concurrency, make_body))
+        latencies, elapsed = asyncio.run(run_load(make_url, count, concurrency, make_body))
+        results[name] = summarize(latencies, elapsed)
+    return results
+
+def compare_results(current: dict, baseline: dict, tolerance: float, min_delta_ms: float):
+    """Rows of (name, metric, baseline, current, ratio, regressed) for every timing in both runs
+
+    A timing regresses when it is more than tolerance slower than the
+    baseline and also slower by at least min_delta_ms, so sub-millisecond
+    jitter on very fast calls does not count.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric in SUITE_METRICS:
+            old, new = before[metric], result[metric]
+            ratio = new / old if old else float('inf')
+            rows.append((name, metric, old, new, ratio, ratio > 1 + tolerance and new - old >= min_delta_ms))
+    return rows
+
+def bench_suite(size: int, seed: int, repeat: int, num_requests: int, concurrency: int, rounds: int, output: str,
+                baseline_path: str, tolerance: float, min_delta_ms: float):
+    """Run the regression suite, write its results as JSON and fail if they are slower than the baseline
+
+    Every benchmark runs rounds times and keeps its fastest round by median:
+    other load on the machine only ever slows a round down, so the fastest
+    is the one closest to what the code itself costs.
+    """
+    config = {'size': size, 'seed': seed, 'repeat': repeat, 'requests': num_requests, 'concurrency': concurrency,
+              'rounds': rounds}
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('version') != SUITE_VERSION or baseline.get('config') != config:
+            raise SystemExit(f"Baseline {baseline_path} was run with {baseline.get('config')}, not {config}; "
+                             f"rerun it with the same options")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'playlist.json')
+        write_synthetic_playlist(path, size, seed)
+        results = {}
+        for _ in range(rounds):
+            round_results = {f'micro.{name}': result for name, result in suite_micro(path, repeat, seed).items()}
+            round_results.update((f'http.{name}', result)
+                                 for name, result in suite_http(path, num_requests, concurrency, seed).items())
+            for name, result in round_results.items():
+                if name not in results or result['p50_ms'] < results[name]['p50_ms']:
+                    results[name] = result
+
+    current = {
+        'version': SUITE_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+                        'platform': sys.platform, 'cpus': os.cpu_count()},
+        'config': config,
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(current, file, indent=2)
+
+    print(f"{size} songs, seed {seed}; results written to {output}")
+    print(f"{'Benchmark':<32} {'Count':>6} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10} {'req/s':>9}")
+    print("-" * 82)
+    for name, result in results.items():
+        throughput = f"{result['throughput_rps']:>9.0f}" if 'throughput_rps' in result else f"{'':>9}"
+        print(f"{name:<32} {result['count']:>6} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} "
+              f"{result['p99_ms']:>10.3f} {throughput}")
+    if baseline is None:
+        return
+
+    rows = compare_results(current, baseline, tolerance, min_delta_ms)
+    print(f"\nAgainst {baseline_path} (tolerance {tolerance:.0%}, at least {min_delta_ms} ms)")
+    print(f"{'Benchmark':<32} {'Metric':>7} {'Baseline':>10} {'Current':>10} {'Ratio':>7}")
+    print("-" * 70)
+    for name, metric, old, new, ratio, regressed in rows:
+        print(f"{name:<32} {metric[:3]:>7} {old:>10.3f} {new:>10.3f} {ratio:>6.2f}x{'  REGRESSION' if regressed else ''}")
+    regressions = [f"{name} {metric}" for name, metric, _, _, _, regressed in rows if regressed]
+    if regressions:
+        raise SystemExit(f"{len(regressions)} timings regressed against {baseline_path}: {', '.join(regressions)}")
+    print("No regressions")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Playlist backend benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    load_parser = subparsers.add_parser('load', help="Loader time and peak memory: legacy, columnar and streaming")
+    load_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_LOAD_SIZES)
+
+    startup_parser = subparsers.add_parser('startup', help="Cold vs warm startup with the snapshot cache")
+    startup_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_LOAD_SIZES)
+
+    memory_parser = subparsers.add_parser('memory', help="Memory per song, standard vs compact layout")
+    memory_parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+
+    search_parser = subparsers.add_parser('search', help="Title index vs str.contains scan")
+    search_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+
+    similar_parser = subparsers.add_parser('similar', help="Similar-songs index vs brute-force pandas scan")
+    similar_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    similar_parser.add_argument('--k', type=int, default=10)
+    similar_parser.add_argument('--batch', type=int, default=64)
+
+    pagination_parser = subparsers.add_parser('pagination', help="Load test GET /api/songs, legacy vs columnar")
+    pagination_parser.add_argument('--size', type=int, default=100_000)
+    pagination_parser.add_argument('--requests', type=int, default=2_000)
+    pagination_parser.add_argument('--concurrency', type=int, default=16)
+    pagination_parser.add_argument('--page-size', type=int, default=100)
+
+    cache_parser = subparsers.add_parser('cache', help="Repeated dashboard reads with the response cache off and on")
+    cache_parser.add_argument('--size', type=int, default=100_000)
+    cache_parser.add_argument('--requests', type=int, default=3_000)
+    cache_parser.add_argument('--concurrency', type=int, default=16)
+
+    batch_parser = subparsers.add_parser('batch', help="Per-title search calls vs one batch search request")
+    batch_parser.add_argument('--size', type=int, default=100_000)
+    batch_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1_000, 10_000])
+    batch_parser.add_argument('--concurrency', type=int, default=16)
+
+    export_parser = subparsers.add_parser('export', help="CSV export: temp file vs streaming, TTFB and peak memory")
+    export_parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000, 3_000_000])
+
+    ratings_parser = subparsers.add_parser('ratings', help="Rating POST throughput at each rating log durability level")
+    ratings_parser.add_argument('--size', type=int, default=100_000)
+    ratings_parser.add_argument('--requests', type=int, default=5_000)
+    ratings_parser.add_argument('--concurrency', type=int, default=32)
+
+    concurrency_parser = subparsers.add_parser('concurrency', help="Read throughput under concurrent rating writes")
+    concurrency_parser.add_argument('--size', type=int, default=100_000)
+    concurrency_parser.add_argument('--seconds', type=float, default=5.0)
+    concurrency_parser.add_argument('--readers', type=int, default=4)
+    concurrency_parser.add_argument('--write-rates', type=int, nargs='+', default=[0, 10, 100, 1000])
+
+    ingest_parser = subparsers.add_parser('ingest', help="Parallel ingestion scaling by worker count, file and shards")
+    ingest_parser.add_argument('--size', type=int, default=1_000_000)
+    ingest_parser.add_argument('--shards', type=int, default=16)
+    ingest_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+
+    generate_parser = subparsers.add_parser('generate', help="Write a synthetic playlist.json-shaped file")
+    generate_parser.add_argument('output')
+    generate_parser.add_argument('--size', type=int, default=100_000)
+    generate_parser.add_argument('--seed', type=int, default=42)
+
+    suite_parser = subparsers.add_parser('suite', help="Regression suite: processor methods and endpoints, as JSON")
+    suite_parser.add_argument('--size', type=int, default=100_000)
+    suite_parser.add_argument('--seed', type=int, default=42)
+    suite_parser.add_argument('--repeat', type=int, default=500, help="Calls per processor method")
+    suite_parser.add_argument('--requests', type=int, default=1_000, help="Requests per endpoint")
+    suite_parser.add_argument('--concurrency', type=int, default=16)
+    suite_parser.add_argument('--rounds', type=int, default=3, help="Runs of each benchmark; the fastest is kept")
+    suite_parser.add_argument('--output', default='benchmark-results.json')
+    suite_parser.add_argument('--baseline', help="Results of an earlier run to compare with; exit 1 on a regression")
+    suite_parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown, as a fraction")
+    suite_parser.add_argument('--min-delta-ms', type=float, default=0.05, help="Smallest slowdown that counts")
+
+    args = parser.parse_args()
+    if args.benchmark == 'generate':
+        write_synthetic_playlist(args.output, args.size, args.seed)
+        print(f"Wrote {args.size} songs to {args.output}")
+    elif args.benchmark == 'suite':
+        bench_suite(args.size, args.seed, args.repeat, args.requests, args.concurrency, args.rounds,
+                    args.output, args.baseline, args.tolerance, args.min_delta_ms)
+    elif args.benchmark == 'load':
+        bench_load(args.sizes)
+    elif args.benchmark == 'startup':
+        bench_startup(args.sizes)
+    elif args.benchmark == 'memory':
+        bench_memory(args.sizes)
+    elif args.benchmark == 'search':
+        bench_search(args.sizes)
+    elif args.benchmark == 'similar':
+        bench_similar(args.sizes, args.k, args.batch)
+    elif args.benchmark == 'pagination':
+        bench_pagination(args.size, args.requests, args.concurrency, args.page_size)
+    elif args.benchmark == 'cache':
+        bench_cache(args.size, args.requests, args.concurrency)
+    elif args.benchmark == 'batch':
+        bench_batch(args.size, args.batch_sizes, args.concurrency)
+    elif args.benchmark == 'export':
+        bench_export(args.sizes)
+    elif args.benchmark == 'ratings':
+        bench_ratings(args.size, args.requests, args.concurrency)
+    elif args.benchmark == 'ingest':
+        bench_ingest(args.size, args.shards, args.workers)
+    elif args.benchmark == 'concurrency':
+        bench_concurrency(args.size, args.seconds, args.readers, args.write_rates)
+
+if __name__ == "__main__":
+    main_cli()
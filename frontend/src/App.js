@@ -1,8 +1,12 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { playlistAPI } from "./api";
 import StarRating from "./components/StarRating";
 import Pagination from "./components/Pagination";
-import Charts from "./components/Charts";
+import Charts, {
+  DURATION_BINS,
+  ACOUSTICNESS_BINS,
+  TEMPO_BINS,
+} from "./components/Charts";
 
 function App() {
   const [songs, setSongs] = useState([]);
@@ -16,18 +20,53 @@ function App() {
   const [searchTitle, setSearchTitle] = useState("");
   const [searchResult, setSearchResult] = useState(null);
   const [showCharts, setShowCharts] = useState(false);
-  const [allSongs, setAllSongs] = useState([]);
+  const [chartData, setChartData] = useState(null);
   const [message, setMessage] = useState(null);
+  const ratingFeed = useRef(null);
 
   useEffect(() => {
     loadSongs();
-  }, [currentPage]);
+  }, [currentPage, sortConfig]);
+
+  // Ratings set by anyone arrive over a live feed, so the table never needs re-polling
+  useEffect(() => {
+    const feed = playlistAPI.openRatingFeed(applyRatings, { stats: false });
+    ratingFeed.current = feed;
+    return () => feed.close();
+  }, []);
+
+  // Watch just the songs on screen; the key changes only when they do, not when their ratings do
+  const shownIds = songs
+    .map((song) => song.id)
+    .concat(searchResult ? [searchResult.id] : [])
+    .join("\n");
+  useEffect(() => {
+    ratingFeed.current?.watch(shownIds ? shownIds.split("\n") : []);
+  }, [shownIds]);
+
+  const applyRatings = ({ ratings }) => {
+    const rated = (song) =>
+      Object.prototype.hasOwnProperty.call(ratings, song.id) &&
+      ratings[song.id] !== song.star_rating
+        ? { ...song, star_rating: ratings[song.id] }
+        : song;
+    setSongs((current) => current.map(rated));
+    setSearchResult((current) => (current ? rated(current) : current));
+  };
 
   const loadSongs = async () => {
     try {
       setLoading(true);
       setError(null);
-      const response = await playlistAPI.getSongs(currentPage, pageSize);
+      // Sorting happens on the server so it covers every page, not just this one
+      const sortOptions = sortConfig.key
+        ? { sort_by: sortConfig.key, order: sortConfig.direction }
+        : {};
+      const response = await playlistAPI.getSongs(
+        currentPage,
+        pageSize,
+        sortOptions
+      );
       setSongs(response.songs);
       setTotalPages(response.total_pages);
       setTotalSongs(response.total);
@@ -38,14 +77,19 @@ function App() {
     }
   };
 
-  const loadAllSongs = async () => {
+  const loadChartData = async () => {
     try {
       setLoading(true);
-      // Load all songs for charts (assuming max 1000 songs)
-      const response = await playlistAPI.getSongs(1, 1000);
-      setAllSongs(response.songs);
+      // The server bins and downsamples, so chart payloads stay small for any catalog size
+      const [danceability, duration, acousticness, tempo] = await Promise.all([
+        playlistAPI.getScatter("index", "danceability"),
+        playlistAPI.getHistogram("duration_s", DURATION_BINS),
+        playlistAPI.getHistogram("acousticness", ACOUSTICNESS_BINS),
+        playlistAPI.getHistogram("tempo", TEMPO_BINS),
+      ]);
+      setChartData({ danceability, duration, acousticness, tempo });
     } catch (err) {
-      setError("Failed to load all songs: " + err.message);
+      setError("Failed to load chart data: " + err.message);
     } finally {
       setLoading(false);
     }
@@ -57,13 +101,7 @@ function App() {
       direction = "desc";
     }
     setSortConfig({ key, direction });
-
-    const sortedSongs = [...songs].sort((a, b) => {
-      if (a[key] < b[key]) return direction === "asc" ? -1 : 1;
-      if (a[key] > b[key]) return direction === "asc" ? 1 : -1;
-      return 0;
-    });
-    setSongs(sortedSongs);
+    setCurrentPage(1);
   };
 
   const handleSearch = async () => {
@@ -135,8 +173,8 @@ function App() {
 
   const toggleCharts = () => {
     setShowCharts(!showCharts);
-    if (!showCharts && allSongs.length === 0) {
-      loadAllSongs();
+    if (!showCharts && chartData === null) {
+      loadChartData();
     }
   };
 
@@ -302,7 +340,7 @@ function App() {
             />
           </div>
 
-          {showCharts && allSongs.length > 0 && <Charts songs={allSongs} />}
+          {showCharts && chartData && <Charts data={chartData} />}
         </>
       )}
     </div>
@@ -1,4 +1,4 @@
-import { render, screen, fireEvent, waitFor } from "@testing-library/react";
+import { render, screen, fireEvent, waitFor, act } from "@testing-library/react";
 import "@testing-library/jest-dom";
 import App from "./App";
 import { playlistAPI } from "./api";
@@ -10,6 +10,9 @@ jest.mock("./api", () => ({
     searchSong: jest.fn(),
     updateRating: jest.fn(),
     exportCSV: jest.fn(),
+    getHistogram: jest.fn(),
+    getScatter: jest.fn(),
+    openRatingFeed: jest.fn(() => ({ watch: jest.fn(), close: jest.fn() })),
   },
 }));
 
@@ -70,7 +73,7 @@ test("loads songs on mount", async () => {
   render(<App />);
 
   await waitFor(() => {
-    expect(playlistAPI.getSongs).toHaveBeenCalledWith(1, 10);
+    expect(playlistAPI.getSongs).toHaveBeenCalledWith(1, 10, {});
   });
 });
 
@@ -151,6 +154,20 @@ test("sorting functionality", async () => {
   });
 });
 
+test("sorting requests sorted songs from the server", async () => {
+  render(<App />);
+
+  const titleHeader = await screen.findByText("Title");
+  fireEvent.click(titleHeader);
+
+  await waitFor(() => {
+    expect(playlistAPI.getSongs).toHaveBeenCalledWith(1, 10, {
+      sort_by: "title",
+      order: "asc",
+    });
+  });
+});
+
 test("handles API errors gracefully", async () => {
   playlistAPI.getSongs.mockRejectedValue(new Error("API Error"));
 
@@ -176,3 +193,20 @@ test("pagination is displayed when needed", async () => {
     expect(screen.getByText("Next")).toBeInTheDocument();
   });
 });
+
+test("live rating updates change the shown songs without refetching", async () => {
+  render(<App />);
+  await screen.findByText("Test Song 1");
+
+  const feed = playlistAPI.openRatingFeed.mock.results[0].value;
+  await waitFor(() => {
+    expect(feed.watch).toHaveBeenLastCalledWith(["1", "2"]);
+  });
+
+  const onUpdate = playlistAPI.openRatingFeed.mock.calls[0][0];
+  act(() => onUpdate({ ratings: { "1": 4 } }));
+
+  const row = screen.getByText("Test Song 1").closest("tr");
+  expect(row.querySelectorAll(".star.filled")).toHaveLength(4);
+  expect(playlistAPI.getSongs).toHaveBeenCalledTimes(1);
+});
@@ -1,6 +1,11 @@
 import axios from "axios";
 
 const API_BASE_URL = process.env.REACT_APP_API_URL || "http://localhost:8000";
+const WS_BASE_URL = API_BASE_URL.replace(/^http/, "ws");
+
+// Milliseconds before reconnecting a dropped rating feed, doubling up to the maximum
+const FEED_RETRY_MS = 1000;
+const FEED_MAX_RETRY_MS = 30000;
 
 const api = axios.create({
   baseURL: API_BASE_URL,
@@ -8,9 +13,13 @@ const api = axios.create({
 });
 
 export const playlistAPI = {
-  // Get all songs with pagination
-  getSongs: async (page = 1, size = 10) => {
-    const response = await api.get(`/api/songs?page=${page}&size=${size}`);
+  // Get all songs with pagination; options may carry sort_by, order and filter
+  getSongs: async (page = 1, size = 10, options = {}) => {
+    const response = await api.get("/api/songs", {
+      params: { page, size, ...options },
+      // Repeat array params as filter=a&filter=b, which FastAPI expects
+      paramsSerializer: { indexes: null },
+    });
     return response.data;
   },
 
@@ -39,11 +48,81 @@ export const playlistAPI = {
     return response.data;
   },
 
+  // Get a histogram of a numeric column over the given bin edges
+  getHistogram: async (column, edges) => {
+    const response = await api.get("/api/charts/histogram", {
+      params: { column, edges },
+      paramsSerializer: { indexes: null },
+    });
+    return response.data;
+  },
+
+  // Get a scatter plot reduced to at most maxPoints points
+  getScatter: async (x, y, maxPoints = 200, method = "lttb") => {
+    const response = await api.get("/api/charts/scatter", {
+      params: { x, y, method, max_points: maxPoints },
+    });
+    return response.data;
+  },
+
   // Get statistics
   getStatistics: async () => {
     const response = await api.get("/api/stats");
     return response.data;
   },
+
+  // Open a live feed of rating changes. watch(songIds) picks the songs to hear
+  // about, replacing the previous ones; onUpdate receives each batch as
+  // { ratings: { id: rating }, stats }, starting with the current ratings of
+  // the watched songs. A dropped connection is reopened, and reopening sends
+  // the current ratings again, so no change is missed.
+  openRatingFeed: (onUpdate, { stats = true } = {}) => {
+    let socket = null;
+    let songIds = [];
+    let closed = false;
+    let retryMs = FEED_RETRY_MS;
+
+    const subscribe = () => {
+      if (socket && socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ subscribe: songIds, stats }));
+      }
+    };
+
+    const connect = () => {
+      if (closed) {
+        return;
+      }
+      socket = new WebSocket(`${WS_BASE_URL}/api/songs/ratings/live`);
+      socket.onopen = () => {
+        retryMs = FEED_RETRY_MS;
+        subscribe();
+      };
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === "ratings") {
+          onUpdate(message);
+        }
+      };
+      socket.onclose = () => {
+        if (!closed) {
+          setTimeout(connect, retryMs);
+          retryMs = Math.min(retryMs * 2, FEED_MAX_RETRY_MS);
+        }
+      };
+    };
+
+    connect();
+    return {
+      watch: (ids) => {
+        songIds = ids;
+        subscribe();
+      },
+      close: () => {
+        closed = true;
+        socket.close();
+      },
+    };
+  },
 };
 
 export default api;
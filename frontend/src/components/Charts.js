@@ -23,16 +23,22 @@ ChartJS.register(
   Legend
 );
 
-const Charts = ({ songs }) => {
-  // Scatter chart for danceability
+// Bin edges requested from /api/charts/histogram; bins are [edge, next edge)
+export const DURATION_BINS = [0, 120, 180, 240, 300, 360, 420];
+export const ACOUSTICNESS_BINS = [0, 0.2, 0.4, 0.6, 0.8, 1.0];
+export const TEMPO_BINS = [60, 90, 120, 150, 180, 210, 300];
+
+const binLabels = (edges, unit = "") =>
+  edges.slice(0, -1).map((bin, i) => `${bin}-${edges[i + 1]}${unit}`);
+
+const Charts = ({ data }) => {
+  // Scatter chart for danceability, downsampled on the server
+  const { x: scatterX, y: scatterY } = data.danceability.points;
   const scatterData = {
     datasets: [
       {
         label: "Songs by Danceability",
-        data: songs.map((song, index) => ({
-          x: index,
-          y: song.danceability,
-        })),
+        data: scatterX.map((x, i) => ({ x, y: scatterY[i] })),
         backgroundColor: "rgba(54, 162, 235, 0.6)",
         borderColor: "rgba(54, 162, 235, 1)",
         pointRadius: 4,
@@ -70,27 +76,12 @@ const Charts = ({ songs }) => {
   };
 
   // Histogram for song duration
-  const durationBins = [0, 120, 180, 240, 300, 360, 420];
-  const durationCounts = new Array(durationBins.length - 1).fill(0);
-
-  songs.forEach((song) => {
-    const duration = song.duration_s || song.duration_ms / 1000;
-    for (let i = 0; i < durationBins.length - 1; i++) {
-      if (duration >= durationBins[i] && duration < durationBins[i + 1]) {
-        durationCounts[i]++;
-        break;
-      }
-    }
-  });
-
   const histogramData = {
-    labels: durationBins
-      .slice(0, -1)
-      .map((bin, i) => `${bin}-${durationBins[i + 1]}s`),
+    labels: binLabels(DURATION_BINS, "s"),
     datasets: [
       {
         label: "Number of Songs",
-        data: durationCounts,
+        data: data.duration.counts,
         backgroundColor: "rgba(255, 99, 132, 0.6)",
         borderColor: "rgba(255, 99, 132, 1)",
         borderWidth: 1,
@@ -127,29 +118,12 @@ const Charts = ({ songs }) => {
   };
 
   // Bar chart for acousticness ranges
-  const acousticnessBins = [0, 0.2, 0.4, 0.6, 0.8, 1.0];
-  const acousticnessCounts = new Array(acousticnessBins.length - 1).fill(0);
-
-  songs.forEach((song) => {
-    for (let i = 0; i < acousticnessBins.length - 1; i++) {
-      if (
-        song.acousticness >= acousticnessBins[i] &&
-        song.acousticness < acousticnessBins[i + 1]
-      ) {
-        acousticnessCounts[i]++;
-        break;
-      }
-    }
-  });
-
   const acousticnessData = {
-    labels: acousticnessBins
-      .slice(0, -1)
-      .map((bin, i) => `${bin}-${acousticnessBins[i + 1]}`),
+    labels: binLabels(ACOUSTICNESS_BINS),
     datasets: [
       {
         label: "Number of Songs",
-        data: acousticnessCounts,
+        data: data.acousticness.counts,
         backgroundColor: "rgba(75, 192, 192, 0.6)",
         borderColor: "rgba(75, 192, 192, 1)",
         borderWidth: 1,
@@ -158,26 +132,12 @@ const Charts = ({ songs }) => {
   };
 
   // Bar chart for tempo ranges
-  const tempoBins = [60, 90, 120, 150, 180, 210, 300];
-  const tempoCounts = new Array(tempoBins.length - 1).fill(0);
-
-  songs.forEach((song) => {
-    for (let i = 0; i < tempoBins.length - 1; i++) {
-      if (song.tempo >= tempoBins[i] && song.tempo < tempoBins[i + 1]) {
-        tempoCounts[i]++;
-        break;
-      }
-    }
-  });
-
   const tempoData = {
-    labels: tempoBins
-      .slice(0, -1)
-      .map((bin, i) => `${bin}-${tempoBins[i + 1]} BPM`),
+    labels: binLabels(TEMPO_BINS, " BPM"),
     datasets: [
       {
         label: "Number of Songs",
-        data: tempoCounts,
+        data: data.tempo.counts,
         backgroundColor: "rgba(153, 102, 255, 0.6)",
         borderColor: "rgba(153, 102, 255, 1)",
         borderWidth: 1,